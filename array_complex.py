@@ -0,0 +1,352 @@
+#!/usr/bin/python
+# coding=utf8
+
+import numpy as np
+
+from complex import Cell, Edge, Complex, topological_sort
+from sparse_matrix import SparseMatrix
+
+
+class ArrayComplex:
+    """
+    A complex stored in arrays, as an alternative to Complex.
+    The k-dimensional cells are numbered 0,1,...,sizes[k]-1. The edges from k-dimensional cells to
+    (k-1)-dimensional cells are stored in CSR format: the faces of the cell i are indices[k][indptr[k][i]:indptr[k][i+1]],
+    with incidence degrees degree[k][indptr[k][i]:indptr[k][i+1]].
+    The matching is stored in int arrays: match_down[k][i] is the (k-1)-dimensional cell matched with the k-dimensional
+    cell i, and match_up[k][i] is the (k+1)-dimensional cell matched with it (-1 if there is none).
+    """
+    
+    def __init__(self, sizes, indptr, indices, degree, labels=None):
+        self.sizes = dict(sizes) # Number of cells, by dimension
+        
+        # Remove empty top dimensions (as in Complex)
+        self.d = max(self.sizes.iterkeys()) if len(self.sizes) > 0 else -1
+        while self.d in self.sizes and self.sizes[self.d] == 0:
+            del self.sizes[self.d]
+            self.d -= 1
+        if len(self.sizes) == 0:
+            self.d = -1
+        
+        self.indptr = {k: np.asarray(indptr[k], dtype=np.int64) for k in self.sizes if k-1 in self.sizes}
+        self.indices = {k: np.asarray(indices[k], dtype=np.int32) for k in self.indptr}
+        self.degree = {k: np.asarray(degree[k], dtype=np.int64) for k in self.indptr}
+        self.labels = labels if labels is not None else {} # Optional labels of the cells, by dimension
+        
+        self.clear_matching()
+    
+    
+    @classmethod
+    def from_complex(cls, complex):
+        """
+        Create an ArrayComplex with the same cells, edges and matching of a Complex.
+        """
+        sizes = {k: len(l) for (k, l) in complex.cells.iteritems()}
+        indptr = {}
+        indices = {}
+        degree = {}
+        
+        for k in sizes:
+            if k-1 not in sizes:
+                continue
+            indptr[k] = [0]
+            indices[k] = []
+            degree[k] = []
+            for c in complex.cells[k]:
+                for e in c.subcells:
+                    indices[k].append(e.low.id)
+                    degree[k].append(e.deg)
+                indptr[k].append(len(indices[k]))
+        
+        labels = {k: [c.label for c in l] for (k, l) in complex.cells.iteritems()}
+        result = cls(sizes, indptr, indices, degree, labels)
+        
+        for e in complex.edges:
+            if e.is_in_matching:
+                result.add_to_matching(e.high.d, e.high.id, e.low.id)
+        
+        return result
+    
+    
+    @classmethod
+    def from_lattice(cls, lattice):
+        """
+        Create an ArrayComplex with the simplices of a FaceLattice, computing the faces directly from the bitmasks
+        (the facet obtained by removing the i-th vertex has incidence degree (-1)^i).
+        The k-dimensional cells are the simplices with k vertices in increasing order of bitmask, labelled by their bitmasks.
+        The array cell_index of the result gives the number of every simplex, by bitmask (-1 if it is not present).
+        """
+        masks = np.asarray(lattice.masks, dtype=np.int64)
+        dimensions = np.asarray(lattice.dimensions)
+        labels = {k: masks[dimensions == k] for k in xrange(lattice.dimension+1)}
+        sizes = {k: len(l) for (k, l) in labels.iteritems()}
+        
+        cell_index = np.full(1 << len(lattice.vertices), -1, dtype=np.int32)
+        for l in labels.itervalues():
+            cell_index[l] = np.arange(len(l), dtype=np.int32)
+        
+        indptr = {}
+        indices = {}
+        degree = {}
+        
+        for k in xrange(1, lattice.dimension+1):
+            # column j contains the facets obtained by removing the j-th vertex
+            faces = np.empty((sizes[k], k), dtype=np.int32)
+            rest = labels[k].copy()
+            for j in xrange(k):
+                bit = rest & -rest
+                faces[:, j] = cell_index[labels[k] ^ bit]
+                rest ^= bit
+            
+            indptr[k] = np.arange(sizes[k]+1, dtype=np.int64) * k
+            indices[k] = faces.ravel()
+            degree[k] = np.tile(np.where(np.arange(k) % 2 == 0, 1, -1), sizes[k])
+        
+        result = cls(sizes, indptr, indices, degree, labels)
+        result.cell_index = cell_index
+        return result
+    
+    
+    def to_complex(self, label=None):
+        """
+        Create a Complex with the same cells and edges (but no matching). The cells are labelled with label(l), where l
+        is the label of the cell in self.labels (by default, l itself).
+        """
+        if label is None:
+            label = lambda l: l
+        
+        cells = {k: [Cell(d=k, label=label(self.labels[k][i]) if len(self.labels) > 0 else None) for i in xrange(n)] for (k, n) in self.sizes.iteritems()}
+        edges = [Edge(cells[k][high], cells[k-1][low], deg) for (k, high, low, deg) in self.edges()]
+        return Complex(cells, edges, cells_by_dimension=True)
+    
+    
+    def clear_matching(self):
+        self.match_down = {k: np.full(n, -1, dtype=np.int32) for (k, n) in self.sizes.iteritems()}
+        self.match_up = {k: np.full(n, -1, dtype=np.int32) for (k, n) in self.sizes.iteritems()}
+    
+    
+    def edge_degree(self, k, high, low):
+        """
+        Returns the incidence degree between the k-dimensional cell high and the (k-1)-dimensional cell low (0 if there is no edge).
+        """
+        start, end = self.indptr[k][high], self.indptr[k][high+1]
+        positions = np.nonzero(self.indices[k][start:end] == low)[0]
+        return int(self.degree[k][start + positions[0]]) if len(positions) > 0 else 0
+    
+    
+    def is_matched(self, k, i):
+        return self.match_down[k][i] >= 0 or self.match_up[k][i] >= 0
+    
+    
+    def add_to_matching(self, k, high, low):
+        """
+        Add to the matching the edge between the k-dimensional cell high and the (k-1)-dimensional cell low.
+        """
+        assert not self.is_matched(k, high) and not self.is_matched(k-1, low)
+        assert self.edge_degree(k, high, low) in [-1, 1] # Only regular edges can be collapsed
+        self.match_down[k][high] = low
+        self.match_up[k-1][low] = high
+    
+    
+    def critical_cells(self, k):
+        """
+        Returns the array of unmatched k-dimensional cells.
+        """
+        return np.nonzero((self.match_down[k] < 0) & (self.match_up[k] < 0))[0]
+    
+    
+    def layer(self, k):
+        """
+        Returns the DAG between k-dimensional and (k-1)-dimensional cells, taking into account the matching, as a function
+        children(node) which returns a list of couples (node, degree).
+        The k-dimensional cell i is the node i, and the (k-1)-dimensional cell j is the node sizes[k]+j.
+        """
+        n = self.sizes[k]
+        indptr = self.indptr[k].tolist()
+        indices = self.indices[k].tolist()
+        degree = self.degree[k].tolist()
+        down = self.match_down[k].tolist()
+        up = self.match_up[k-1].tolist()
+        
+        # Degree of the upward edges
+        up_degree = [0] * self.sizes[k-1]
+        for (i, j) in enumerate(down):
+            if j >= 0:
+                up_degree[j] = self.edge_degree(k, i, j)
+        
+        def children(node):
+            if node < n:
+                return [(n + indices[p], degree[p]) for p in xrange(indptr[node], indptr[node+1]) if indices[p] != down[node]]
+            elif up[node-n] >= 0:
+                return [(up[node-n], up_degree[node-n])]
+            else:
+                return []
+        
+        return children
+    
+    
+    def DFS_acyclic(self, node, children, visited, closed):
+        """
+        DFS for the purpose of testing acyclicity (with an explicit stack)
+        """
+        if visited[node]:
+            return closed[node]
+        
+        visited[node] = True
+        stack = [(node, iter(children(node)))]
+        
+        while len(stack) > 0:
+            (v, it) = stack[-1]
+            for (w, deg) in it:
+                if not visited[w]:
+                    visited[w] = True
+                    stack.append((w, iter(children(w))))
+                    break
+                elif not closed[w]:
+                    # Found a cycle
+                    return False
+            else:
+                closed[v] = True
+                stack.pop()
+        
+        return True
+    
+    
+    def is_acyclic(self, k, low=None):
+        """
+        Test acyclicity for k-dimensional and (k-1)-dimensional cells, starting from the (k-1)-dimensional cell low
+        (or from every cell, if low is None).
+        """
+        children = self.layer(k)
+        n = self.sizes[k] + self.sizes[k-1]
+        visited = bytearray(n)
+        closed = bytearray(n)
+        starts = xrange(n) if low is None else [self.sizes[k] + low]
+        return all(self.DFS_acyclic(v, children, visited, closed) for v in starts)
+    
+    
+    def topological_sort(self, k):
+        """
+        Sort topologically the k-dimensional and (k-1)-dimensional cells (see topological_sort()).
+        Nodes are numbered as in self.layer(k).
+        """
+        children = self.layer(k)
+        return topological_sort(range(self.sizes[k] + self.sizes[k-1]), lambda v: [w for (w, deg) in children(v)])
+    
+    
+    def DFS_order(self, node, children, visited, order):
+        """
+        DFS for the purpose of sorting topologically the nodes reachable from the given node (they are appended to order in post-order)
+        """
+        if visited[node]:
+            return
+        
+        visited[node] = True
+        stack = [(node, iter(children(node)))]
+        
+        while len(stack) > 0:
+            (v, it) = stack[-1]
+            for (w, deg) in it:
+                if not visited[w]:
+                    visited[w] = True
+                    stack.append((w, iter(children(w))))
+                    break
+            else:
+                order.append(v)
+                stack.pop()
+    
+    
+    def morse_reduction(self):
+        """
+        Perform Discrete Morse Theory collapses, returning a smaller ArrayComplex with the same homotopy type.
+        The incidence numbers from each critical k-cell to all critical (k-1)-cells are computed with a single traversal.
+        """
+        critical = {k: self.critical_cells(k) for k in self.sizes}
+        new_sizes = {k: len(c) for (k, c) in critical.iteritems()}
+        new_labels = {k: [self.labels[k][i] for i in c] for (k, c) in critical.iteritems()} if len(self.labels) > 0 else None
+        
+        new_indptr = {}
+        new_indices = {}
+        new_degree = {}
+        
+        for k in sorted(self.sizes.iterkeys())[1:]:
+            n = self.sizes[k]
+            children = self.layer(k)
+            
+            # New index of the critical (k-1)-dimensional cells
+            new_index = [-1] * self.sizes[k-1]
+            for (j, c) in enumerate(critical[k-1]):
+                new_index[c] = j
+            
+            visited = bytearray(n + self.sizes[k-1])
+            weight = [0] * (n + self.sizes[k-1])
+            
+            new_indptr[k] = [0]
+            new_indices[k] = []
+            new_degree[k] = []
+            
+            for source in critical[k]:
+                order = []
+                self.DFS_order(source, children, visited, order)
+                weight[source] = 1
+                
+                incidences = []
+                for v in reversed(order):
+                    visited[v] = False
+                    x = weight[v]
+                    weight[v] = 0
+                    if x == 0:
+                        continue
+                    
+                    if v >= n and new_index[v-n] >= 0:
+                        # critical (k-1)-dimensional cell
+                        incidences.append((new_index[v-n], x))
+                        continue
+                    
+                    for (w, deg) in children(v):
+                        weight[w] += deg*x if v < n else -deg*x
+                
+                incidences.sort()
+                new_indices[k].extend(j for (j, x) in incidences)
+                new_degree[k].extend(x for (j, x) in incidences)
+                new_indptr[k].append(len(new_indices[k]))
+        
+        return ArrayComplex(new_sizes, new_indptr, new_indices, new_degree, new_labels)
+    
+    
+    def get_boundaries(self, dense=False):
+        """
+        Compute boundary matrices, as SparseMatrix objects (or as NZMATH matrices, if dense is True).
+        """
+        ranks = dict(self.sizes)
+        boundaries = {}
+        
+        for k in ranks.iterkeys():
+            if k-1 not in ranks:
+                continue
+            
+            indptr = self.indptr[k].tolist()
+            indices = self.indices[k].tolist()
+            degree = self.degree[k].tolist()
+            
+            delta = SparseMatrix(ranks[k-1], ranks[k])
+            for i in xrange(ranks[k]):
+                for p in xrange(indptr[i], indptr[i+1]):
+                    delta[indices[p], i] = degree[p]
+            
+            boundaries[k] = delta.to_nzmath() if dense else delta
+        
+        return ranks, boundaries
+    
+    
+    def edges(self):
+        """
+        Returns an iterable of tuples (k, high, low, degree), for all the edges.
+        """
+        for k in sorted(self.indptr.iterkeys()):
+            indptr = self.indptr[k].tolist()
+            indices = self.indices[k].tolist()
+            degree = self.degree[k].tolist()
+            for i in xrange(self.sizes[k]):
+                for p in xrange(indptr[i], indptr[i+1]):
+                    yield (k, i, indices[p], degree[p])
@@ -4,18 +4,114 @@
 from coxeter_graph import *
 from simplicial_complex import SimplicialComplex
 from matching_generator import MatchingGenerator
+from matching import Matching
+import matching_file
 
 import os
 import sys
 import pickle
+import itertools
+import multiprocessing
+import StringIO
 
 MATCHINGS_DIR = 'matchings'
 
 
+def check_component(complex, generator, type, n, d, verbosity=0, workers=1, torsion=False):
+    """
+    Construct (or load) the matching for the given d, check it and print its description (with the torsion
+    coefficients, if torsion is True and the matching is precise).
+    The Morse complex is computed with the given number of worker processes (see Complex.morse_reduction()).
+    Returns the ranks of the boundaries of the Morse complex, or None if no matching was found.
+    """
+    print "*** d=%d ***" % d
+    
+    complex.clear_matching()
+    acyclicity = 'incremental'
+    certificate = None
+    
+    try:
+        matching = generator.generate_toggle_matching(complex, d)
+        # a generated matching is checked at once, with a vectorized Kahn sort
+        acyclicity = 'potential'
+    
+    except NotImplementedError:
+        # MatchingGenerator does not implement this matching
+        # try to load matching from file (preferring the binary format, see matching_file)
+        filename = os.path.join(MATCHINGS_DIR, "%s_%d_%d" % (type, n, d))
+        if os.path.isfile(filename + matching_file.EXTENSION):
+            (matching, first_vertex, certificate) = matching_file.load_matching(filename + matching_file.EXTENSION)
+            if (matching.n, first_vertex) != (len(complex.vertices), complex.vertices[0]):
+                raise Exception("Matching file %s has vertices %d,...,%d instead of %d,...,%d" % (filename + matching_file.EXTENSION, first_vertex, first_vertex + matching.n - 1, complex.vertices[0], complex.vertices[-1]))
+            pairs = None
+            acyclicity = 'batch'
+        
+        elif os.path.isfile(filename + '.p'):
+            # load pickled matching
+            with open(filename + '.p', 'r') as f:
+                pairs = pickle.load(f)
+            acyclicity = 'batch'
+        
+        elif d not in complex.relevant_d_values():
+            # a trivial matching works
+            v = complex.vertices[0]
+            pairs = [(sigma, tuple(u for u in sigma if u!=v)) for sigma in complex.simplices if v in sigma]
+        
+        else:
+            print "Matching not found."
+            return None
+        
+        if pairs is not None:
+            matching = Matching.from_pairs(len(complex.vertices), ((complex.mask(sigma), complex.mask(tau)) for (sigma, tau) in pairs))
+    
+    if verbosity >= 2:
+        print "Matching:"
+        for (sigma, tau) in matching.pairs():
+            print complex.simplex(sigma), complex.simplex(tau)
+    
+    # a matching loaded from file is known in advance, so it can be checked all at once
+    # (a matching stored in the binary format comes with a certificate of acyclicity, which replaces the checks)
+    complex.apply_matching(acyclicity=acyclicity, matching=matching, d=d, certificate=certificate)
+    complex.compute_morse_complex(workers=workers)
+    complex.describe_matching(d, verbosity=verbosity, iterated=True)
+    ranks = complex.get_ranks(iterated=True)
+    
+    if torsion and complex.is_matching_precise(d):
+        print "Torsion (from 1-dim to %d-dim):" % len(ranks), complex.get_torsion()
+    
+    return ranks
+
+
+# Arguments of check_component() in a worker process (see init_worker())
+_worker_arguments = None
+
+def init_worker(arguments):
+    """
+    Initialize a worker process with a dictionary of arguments of check_component() (all but d).
+    """
+    global _worker_arguments
+    _worker_arguments = arguments
+
+
+def check_component_worker(d):
+    """
+    Run check_component() in a worker process, capturing its output.
+    Returns the output and the ranks.
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        ranks = check_component(d=d, **_worker_arguments)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    return output, ranks
+
+
 if __name__ == '__main__':
     
     if len(sys.argv) < 3 or sys.argv[1] == "help":
-        print "Usage: python %s A|B|D|E|F|H|tA|tB|tC|tD|tE|tF|tG|tI n [d] [-v|-vv] [-l]" % sys.argv[0]
+        print "Usage: python %s A|B|D|E|F|H|tA|tB|tC|tD|tE|tF|tG|tI n [d] [-v|-vv] [-l] [-t] [-j N] [-w N] [-i] [-c]" % sys.argv[0]
         sys.exit()
     
     type = sys.argv[1]
@@ -66,49 +162,61 @@ if __name__ == '__main__':
         print "Unknown Coxeter type %s_%d." % (type, n)
         sys.exit()
     
-    complex = SimplicialComplex(graph)
+    if '-c' in sys.argv:
+        # only list the critical simplices, without building the complex
+        for d in (graph.relevant_d_values() if d is None else [d]):
+            print "*** d=%d ***" % d
+            try:
+                critical = sorted(generator.iter_critical_simplices(graph, d))
+            except NotImplementedError:
+                print "Critical simplices not available."
+                sys.exit()
+            print "Critical simplices:"
+            for (mask, w) in critical:
+                print graph.simplex(mask), "\t", "w=%d" % w
+        sys.exit()
+    
+    # with -i, the faces are computed from the bitmasks instead of being stored (see SimplicialComplex)
+    complex = SimplicialComplex(graph, implicit='-i' in sys.argv)
     d_values = complex.relevant_d_values() if d is None else [d]
     ranks = {}
     
-    for d in d_values:
-        print "*** d=%d ***" % d
-        
-        complex.clear_matching()
-        
-        try:
-            generator.generate_matching(complex, d)
-            matching = generator.matching
-        
-        except NotImplementedError:
-            # MatchingGenerator does not implement this matching
-            # try to load matching from file
-            filename = os.path.join(MATCHINGS_DIR, "%s_%d_%d.p" % (type, n, d))
-            if os.path.isfile(filename):
-                # load matching from file
-                with open(filename, 'r') as f:
-                    matching = pickle.load(f)
-            
-            elif d not in complex.relevant_d_values():
-                # a trivial matching works
-                v = complex.vertices[0]
-                matching = [(sigma, tuple(u for u in sigma if u!=v)) for sigma in complex.simplices if v in sigma]
-            
-            else:
-                print "Matching not found."
+    jobs = 1
+    if '-j' in sys.argv:
+        jobs = int(sys.argv[sys.argv.index('-j') + 1])
+    
+    workers = 1
+    if '-w' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('-w') + 1])
+    
+    torsion = '-t' in sys.argv
+    
+    pool = None
+    if jobs > 1 and len(d_values) > 1:
+        # The workers are forked after the complex is built, and share it copy-on-write (the initializer arguments are inherited)
+        arguments = dict(complex=complex, generator=generator, type=type, n=n, verbosity=verbosity, torsion=torsion)
+        pool = multiprocessing.Pool(jobs, init_worker, (arguments,))
+        results = pool.imap(check_component_worker, d_values)
+    else:
+        results = (check_component(complex, generator, type, n, d, verbosity, workers, torsion) for d in d_values)
+    
+    try:
+        # The results are printed in the order of d_values
+        for (d, r) in itertools.izip(d_values, results):
+            if pool is not None:
+                (output, r) = r
+                sys.stdout.write(output)
+            if r is None:
                 sys.exit()
+            ranks[d] = r
         
-        if verbosity >= 2:
-            print "Matching:"
-        
-        for (sigma, tau) in matching:
-            if verbosity >= 2:
-                print sigma, tau
-            complex.add_to_matching(sigma, tau, d)
-        
-        complex.apply_matching()
-        complex.compute_morse_complex()
-        complex.describe_matching(d, verbosity=verbosity)
-        ranks[d] = complex.get_ranks()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        # Also stop the workers if a component fails
+        if pool is not None:
+            pool.terminate()
     
     if '-l' in sys.argv:
         print
@@ -1,4 +1,6 @@
-from nzmath import matrix, vector # http://tnt.math.se.tmu.ac.jp/nzmath/
+import multiprocessing
+
+from sparse_matrix import SparseMatrix
 
 class Cell:
     """
@@ -51,6 +53,23 @@ class Cell:
                 if e.high.d == k:
                     yield (e.high, e.deg)
     
+    def restricted_parents(self, k):
+        """
+        As self.restricted_children(k), but it returns the parents in the DAG
+        """
+        if self.d == k-1:
+            # Edges coming from above
+            for e in self.supercells:
+                if e != self.matching_edge:
+                    yield (e.high, e.deg)
+        
+        if self.d == k:
+            # Edge coming from below (if exists)
+            if self.is_matched():
+                e = self.matching_edge
+                if e.low.d == k-1:
+                    yield (e.low, e.deg)
+    
     def __repr__(self):
         if self.label is None:
             return '<Cell (%d,%d)>' % (self.d, self.id)
@@ -109,6 +128,185 @@ class Edge:
             return '<Edge ' + self.high.label.__str__() + '->' + self.low.label.__str__() + ' of degree %d>' % self.deg
 
 
+def topological_sort(nodes, children):
+    """
+    Sort the nodes of a directed graph topologically with Kahn's algorithm.
+    The graph is given by the function children(node), which returns an iterable of nodes.
+    Returns a couple (order, cycle): if the graph is acyclic, cycle is None;
+    otherwise order is partial and cycle is a short cycle among the nodes which could not be sorted: a DFS finds a cycle,
+    which is then shrunk to the shortest cycle through one of its nodes (see shortest_cycle()).
+    """
+    indegree = {v: 0 for v in nodes}
+    for v in nodes:
+        for w in children(v):
+            indegree[w] += 1
+    
+    order = [v for v in nodes if indegree[v] == 0]
+    i = 0
+    while i < len(order):
+        for w in children(order[i]):
+            indegree[w] -= 1
+            if indegree[w] == 0:
+                order.append(w)
+        i += 1
+    
+    if len(order) == len(nodes):
+        return order, None
+    
+    # Search for a cycle among the remaining nodes with a single DFS (every one of them has a parent among them)
+    remaining = set(v for v in nodes if indegree[v] > 0)
+    finished = set()
+    for v in nodes:
+        if v not in remaining or v in finished:
+            continue
+        
+        # explicit stack of (node, iterator over its children); the nodes on the stack form a path
+        path = [v]
+        on_path = set([v])
+        stack = [(v, iter(children(v)))]
+        while stack:
+            (u, it) = stack[-1]
+            for w in it:
+                if w in on_path:
+                    # back arc: the cycle is the part of the path starting from w
+                    return order, shrink_cycle(path[path.index(w):], children, remaining)
+                if w in remaining and w not in finished:
+                    path.append(w)
+                    on_path.add(w)
+                    stack.append((w, iter(children(w))))
+                    break
+            else:
+                stack.pop()
+                path.pop()
+                on_path.discard(u)
+                finished.add(u)
+    
+    # not reached, since the remaining nodes cannot be acyclic
+    return order, None
+
+
+def shortest_cycle(w, children, nodes):
+    """
+    Returns the shortest cycle through w among the given nodes (found with a BFS), as a list of nodes starting from w,
+    or None if there is none.
+    """
+    parent = {w: None}
+    queue = [w]
+    i = 0
+    while i < len(queue):
+        u = queue[i]
+        i += 1
+        for x in children(u):
+            if x == w:
+                cycle = []
+                while u is not None:
+                    cycle.append(u)
+                    u = parent[u]
+                return cycle[::-1]
+            if x in nodes and x not in parent:
+                parent[x] = u
+                queue.append(x)
+    return None
+
+
+def shrink_cycle(cycle, children, nodes):
+    """
+    Shrink a cycle among the given nodes, replacing it with the shortest cycle through its middle node as long as this is shorter.
+    """
+    while True:
+        shorter = shortest_cycle(cycle[len(cycle) // 2], children, nodes)
+        if len(shorter) >= len(cycle):
+            return cycle
+        cycle = shorter
+
+
+
+class TopologicalOrder:
+    """
+    A topological order of a DAG, maintained dynamically under insertion of arcs (Pearce-Kelly algorithm).
+    The DAG is given by the functions children(node) and parents(node), which return iterables of nodes.
+    """
+    
+    def __init__(self, nodes, children, parents):
+        self.children = children
+        self.parents = parents
+        self.ord = {v: i for (i,v) in enumerate(nodes)} # The nodes are assumed to be given in topological order
+    
+    def add_arc(self, x, y, print_cycle=False):
+        """
+        Update the order after the arc x -> y has been inserted in the DAG.
+        Only the nodes between y and x in the current order are visited.
+        Returns False if the new arc closes a cycle (in this case the order is left unchanged).
+        """
+        ord = self.ord
+        lb = ord[y]
+        ub = ord[x]
+        
+        if lb > ub:
+            # The order is still valid
+            return True
+        
+        # Forward search from y, among nodes with order < ub
+        forward = [y]
+        predecessor = {y: None}
+        stack = [y]
+        while len(stack) > 0:
+            v = stack.pop()
+            for w in self.children(v):
+                o = ord[w]
+                if o == ub:
+                    # x is reachable from y
+                    if print_cycle:
+                        print w
+                        while v is not None:
+                            print v
+                            v = predecessor[v]
+                    return False
+                if o < ub and w not in predecessor:
+                    predecessor[w] = v
+                    forward.append(w)
+                    stack.append(w)
+        
+        # Backward search from x, among nodes with order > lb
+        backward = [x]
+        visited = set(backward)
+        stack = [x]
+        while len(stack) > 0:
+            v = stack.pop()
+            for w in self.parents(v):
+                if ord[w] > lb and w not in visited:
+                    visited.add(w)
+                    backward.append(w)
+                    stack.append(w)
+        
+        # Move the nodes reaching x before the nodes reachable from y, reusing the same positions
+        backward.sort(key=lambda v: ord[v])
+        forward.sort(key=lambda v: ord[v])
+        positions = sorted(ord[v] for v in backward + forward)
+        for (v, i) in zip(backward + forward, positions):
+            ord[v] = i
+        
+        return True
+
+
+
+# Complex shared with the worker processes of Complex.morse_reduction() (inherited when they are forked)
+_reduction_complex = None
+
+def _gradient_paths_worker(task):
+    """
+    Compute the gradient paths from a chunk of k-dimensional cells of _reduction_complex, given as a couple (k, ids).
+    Returns a list of couples (id, incidences), where incidences is a sorted list of couples (id of critical (k-1)-dimensional cell, incidence number).
+    """
+    (k, ids) = task
+    complex = _reduction_complex
+    result = []
+    for i in ids:
+        incidences = complex.gradient_paths(complex.cells[k][i], k)
+        result.append((i, sorted((c.id, x) for (c, x) in incidences.iteritems())))
+    return result
+
+
 class Complex:
     """
     A complex. Only the incidence degree between cells are stored.
@@ -148,6 +346,9 @@ class Complex:
         for e in edges:
             e.high.subcells.append(e)
             e.low.supercells.append(e)
+        
+        # Dynamic topological orders of the DAGs between dimensions k and k-1 (see self.topological_order())
+        self.orders = {}
     
     def all_cells(self):
         # Returns an iterable with all the cells (not by dimension)
@@ -158,7 +359,7 @@ class Complex:
     
     def DFS_acyclic(self, cell, k, print_cycle=False):
         """
-        DFS for the purpose of testing acyclicity
+        DFS for the purpose of testing acyclicity (the path from the starting cell is kept in an explicit stack)
         """
         if cell.visited:
             if cell.closed:
@@ -168,19 +369,31 @@ class Complex:
                     print cell
                 return False
         
-        # print "Visiting cell (%d,%d)" % (cell.d, cell.id)
         cell.visited = True
+        stack = [(cell, cell.restricted_children(k))]
         
-        # print "Restricted children (%d):" % k, [c for c in cell.restricted_children(k)]
-        for (c,w) in cell.restricted_children(k):
-            # print "Launching visit of", c, "from", cell
-            res = self.DFS_acyclic(c, k, print_cycle)
-            if not res:
-                if print_cycle:
-                    print cell
-                return False
+        while len(stack) > 0:
+            (c, children) = stack[-1]
+            for (c1,w) in children:
+                if not c1.visited:
+                    # Launch visit of c1
+                    c1.visited = True
+                    stack.append((c1, c1.restricted_children(k)))
+                    break
+                
+                elif not c1.closed:
+                    # Found a cycle
+                    if print_cycle:
+                        print c1
+                        for (c2, _) in reversed(stack):
+                            print c2
+                    return False
+            
+            else:
+                # All the children of c have been visited
+                c.closed = True
+                stack.pop()
         
-        cell.closed = True
         return True
     
     def is_acyclic(self, starting_cell, k, print_cycle=False):
@@ -196,9 +409,56 @@ class Complex:
         return self.DFS_acyclic(starting_cell, k, print_cycle)
     
     
+    def topological_order(self, k):
+        """
+        Returns the dynamic topological order of the k-dimensional and (k-1)-dimensional cells (it is created if needed).
+        When the order is created, the matching between these dimensions is assumed to be acyclic.
+        """
+        if k not in self.orders:
+            # Initialize the order with a DFS
+            cells = self.cells[k] + self.cells[k-1]
+            for c in cells:
+                c.visited = False
+            
+            order = []
+            for c in cells:
+                self.DFS_order(c, k, order)
+            
+            for c in order:
+                c.visited = False
+            order.reverse()
+            
+            children = lambda cell: (c for (c,w) in cell.restricted_children(k))
+            parents = lambda cell: (c for (c,w) in cell.restricted_parents(k))
+            self.orders[k] = TopologicalOrder(order, children, parents)
+        
+        return self.orders[k]
+    
+    def clear_topological_orders(self):
+        """
+        Forget the dynamic topological orders (must be called when edges are removed from the matching).
+        """
+        self.orders = {}
+    
+    def topological_sort(self, k):
+        """
+        Sort topologically the k-dimensional and (k-1)-dimensional cells, with a single linear-time visit.
+        Returns a couple (order, cycle), where cycle is None if the matching is acyclic (see topological_sort()).
+        """
+        children = lambda cell: [c for (c,w) in cell.restricted_children(k)]
+        return topological_sort(self.cells[k] + self.cells[k-1], children)
+    
+    def add_to_topological_order(self, edge, print_cycle=False):
+        """
+        Update the topological order after the edge has been added to the matching.
+        Returns False if the matching is not acyclic anymore.
+        """
+        return self.topological_order(edge.high.d).add_arc(edge.low, edge.high, print_cycle)
+    
+    
     def DFS_weight(self, cell, target, k):
         """
-        DFS for the purpose of finding weights of the new edges (via dynamic programming on the DAG)
+        DFS for the purpose of finding weights of the new edges (via dynamic programming on the DAG, with an explicit stack)
         """
         if cell == target:
             return [1,0]
@@ -208,23 +468,115 @@ class Complex:
         
         cell.visited = True
         cell.aggregate_weight = [0,0] # (weight of path from cell to target, passing by an even number of other k-dimensional cells; odd)
+        stack = [(cell, cell.restricted_children(k), None)] # (cell, iterator over its children, degree of the edge from its parent)
         
-        for (c,w) in cell.restricted_children(k):
-            (x,y) = self.DFS_weight(c, target, k)
-            if cell.d == k:
-                cell.aggregate_weight[0] += w*x
-                cell.aggregate_weight[1] += w*y
+        while len(stack) > 0:
+            (c, children, _) = stack[-1]
+            for (c1,w) in children:
+                if c1 == target:
+                    (x,y) = (1,0)
+                elif c1.visited:
+                    (x,y) = c1.aggregate_weight
+                else:
+                    # Launch visit of c1
+                    c1.visited = True
+                    c1.aggregate_weight = [0,0]
+                    stack.append((c1, c1.restricted_children(k), w))
+                    break
+                
+                if c.d == k:
+                    c.aggregate_weight[0] += w*x
+                    c.aggregate_weight[1] += w*y
+                else:
+                    c.aggregate_weight[0] += w*y
+                    c.aggregate_weight[1] += w*x
+            
             else:
-                cell.aggregate_weight[0] += w*y
-                cell.aggregate_weight[1] += w*x
+                # All the children of c have been visited: update its parent
+                (_, _, w) = stack.pop()
+                if len(stack) > 0:
+                    parent = stack[-1][0]
+                    (x,y) = c.aggregate_weight
+                    if parent.d == k:
+                        parent.aggregate_weight[0] += w*x
+                        parent.aggregate_weight[1] += w*y
+                    else:
+                        parent.aggregate_weight[0] += w*y
+                        parent.aggregate_weight[1] += w*x
         
         return cell.aggregate_weight
     
     
-    def morse_reduction(self):
+    def DFS_order(self, cell, k, order):
+        """
+        DFS for the purpose of sorting topologically the cells reachable from the given cell (they are appended to order in post-order)
+        """
+        if cell.visited:
+            return
+        
+        cell.visited = True
+        stack = [(cell, cell.restricted_children(k))]
+        
+        while len(stack) > 0:
+            (c, children) = stack[-1]
+            for (c1,w) in children:
+                if not c1.visited:
+                    # Launch visit of c1
+                    c1.visited = True
+                    stack.append((c1, c1.restricted_children(k)))
+                    break
+            
+            else:
+                # All the children of c have been visited
+                order.append(c)
+                stack.pop()
+    
+    
+    def gradient_paths(self, source, k):
+        """
+        Compute the weights of the gradient paths from the k-dimensional cell source to all critical (k-1)-dimensional cells, with a single traversal of the DAG.
+        Returns a sparse vector, as a dictionary critical (k-1)-dimensional cell => incidence number (only non-zero entries are stored).
+        The visited flags of the cells in dimensions k and k-1 are assumed to be False, and are left False.
+        """
+        order = []
+        self.DFS_order(source, k, order)
+        
+        for c in order:
+            c.aggregate_weight = 0
+        source.aggregate_weight = 1 # weight of the paths from source to cell, with sign (-1)^(number of other k-dimensional cells)
+        
+        incidences = {}
+        for cell in reversed(order):
+            # the cells are visited in topological order
+            cell.visited = False
+            x = cell.aggregate_weight
+            if x == 0:
+                continue
+            
+            if cell.d == k-1 and not cell.is_matched():
+                # critical (k-1)-dimensional cell
+                incidences[cell] = x
+                continue
+            
+            for (c,w) in cell.restricted_children(k):
+                if cell.d == k:
+                    c.aggregate_weight += w*x
+                else:
+                    c.aggregate_weight -= w*x
+        
+        return incidences
+    
+    
+    def morse_reduction(self, pairwise=False, workers=1):
         """
         Perform Discrete Morse Theory collapses, returning a smaller complex with the same homotopy type.
+        By default, the incidence numbers from each critical k-cell to all critical (k-1)-cells are computed with a single traversal.
+        If pairwise is True, a new traversal is done for every pair of critical cells (this is much slower).
+        If workers > 1, the traversals from the critical k-cells are split among a pool of worker processes, which share the
+        complex copy-on-write (this requires the fork start method). The result does not depend on the number of workers.
         """
+        global _reduction_complex
+        
         # Create new cells
         new_cells = {k: [] for k in self.cells.iterkeys()}
         for c in self.all_cells():
@@ -236,27 +588,106 @@ class Complex:
         
         # Create new edges
         new_edges = []
-        for k in sorted(self.cells.iterkeys())[1:]:
-            # Create edges from k-dimensional cells to (k-1)-dimensional cells
-            for a in new_cells[k]:
-                for b in new_cells[k-1]:
+        pool = None
+        if workers > 1 and not pairwise:
+            for c in self.all_cells():
+                c.visited = False
+            _reduction_complex = self
+            pool = multiprocessing.Pool(workers)
+        
+        try:
+            for k in sorted(self.cells.iterkeys())[1:]:
+                # Create edges from k-dimensional cells to (k-1)-dimensional cells
+                if pool is not None:
+                    # Split the sources into chunks, and merge the results in the order of the sources
+                    sources = [a.twin.id for a in new_cells[k]]
+                    size = max(1, -(-len(sources) // (4*workers)))
+                    tasks = [(k, sources[i:i+size]) for i in xrange(0, len(sources), size)]
+                    for result in pool.map(_gradient_paths_worker, tasks):
+                        for (i, incidences) in result:
+                            a = self.cells[k][i].twin
+                            for (j, x) in incidences:
+                                new_edges.append(Edge(a, self.cells[k-1][j].twin, x))
+                
+                elif pairwise:
+                    for a in new_cells[k]:
+                        for b in new_cells[k-1]:
+                            # Initialize DFS
+                            for c in self.cells[k] + self.cells[k-1]:
+                                c.visited = False
+                            
+                            # Visit
+                            weight = self.DFS_weight(a.twin, b.twin, k)
+                            w = weight[0] - weight[1]
+                            if w != 0:
+                                new_edges.append(Edge(a, b, w))
+                
+                else:
                     # Initialize DFS
                     for c in self.cells[k] + self.cells[k-1]:
                         c.visited = False
                     
-                    # Visit
-                    weight = self.DFS_weight(a.twin, b.twin, k)
-                    w = weight[0] - weight[1]
-                    if w != 0:
-                        new_edges.append(Edge(a, b, w))
+                    for a in new_cells[k]:
+                        # Visit (the new edges are sorted as in the pairwise case)
+                        incidences = self.gradient_paths(a.twin, k)
+                        for c in sorted(incidences.iterkeys(), key=lambda c: c.id):
+                            new_edges.append(Edge(a, c.twin, incidences[c]))
+            
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            # Also stop the workers and release the complex if the reduction fails
+            if pool is not None:
+                pool.terminate()
+                _reduction_complex = None
         
         # Return the new complex
         return Complex(new_cells, new_edges, cells_by_dimension=True)
     
     
-    def get_boundaries(self):
+    def iterated_reduction(self):
         """
-        Compute boundary matrices.
+        Repeatedly match the edges of degree 1 or -1 (keeping the matching acyclic) and perform the Morse reduction,
+        until no such edge is left. The complex is assumed to have an empty matching, and it is not modified.
+        Returns the final complex, and a dictionary k => number of collapsed couples of k-dimensional and (k-1)-dimensional cells
+        (the rank of the k-th boundary decreases by this number).
+        """
+        assert not any(e.is_in_matching for e in self.edges)
+        
+        complex = self
+        collapsed = {}
+        while True:
+            # Greedily match unit edges
+            matched = []
+            for e in complex.edges:
+                if e.is_matchable():
+                    e.add_to_matching()
+                    if complex.add_to_topological_order(e):
+                        matched.append(e)
+                    else:
+                        # This edge would create a cycle
+                        e.remove_from_matching()
+            
+            if len(matched) == 0:
+                return complex, collapsed
+            
+            for e in matched:
+                collapsed[e.high.d] = collapsed.get(e.high.d, 0) + 1
+            
+            reduced = complex.morse_reduction()
+            
+            # Restore the empty matching
+            for e in matched:
+                e.remove_from_matching()
+            complex.clear_topological_orders()
+            
+            complex = reduced
+    
+    
+    def get_boundaries(self, dense=False):
+        """
+        Compute boundary matrices, as SparseMatrix objects (or as NZMATH matrices, if dense is True).
         """
         ranks = {k: len(l) for (k, l) in self.cells.iteritems()}
         boundaries = {}
@@ -265,29 +696,12 @@ class Complex:
             if k-1 not in ranks:
                 continue
             
-            # Initialize 0-column matrix
-            numrows = max(ranks[k-1], 1) # The max with 1 is required by NZMATH
-            delta = matrix.Matrix(row=numrows, column=1)
-            delta.deleteColumn(1)
-            
+            delta = SparseMatrix(ranks[k-1], ranks[k])
             for c in self.cells[k]:
-                column = vector.Vector([0]*numrows)
                 for e in c.subcells:
                     # Update the column of the boundary map
-                    c1 = e.low
-                    deg = e.deg
-                    column[c1.id+1] = deg
-                
-                # Insert column in the boundary map
-                delta.extendColumn(column)
+                    delta[e.low.id, c.id] = e.deg
             
-            # Adjust the case ranks[k-1]==0
-            if ranks[k-1] == 0:
-                assert delta.row == 1
-                delta.deleteRow(1)
-            
-            boundaries[k] = delta
+            boundaries[k] = delta.to_nzmath() if dense else delta
         
         return ranks, boundaries
-
-
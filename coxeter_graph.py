@@ -3,6 +3,10 @@
 
 from coxeter_type import CoxeterType, Weight
 
+import operator
+
+import numpy as np
+
 
 class Vertex:
     def __init__(self, graph, index):
@@ -32,6 +36,9 @@ class CoxeterGraph:
     SPHERICAL = 'S'
     AFFINE = 'A'
     
+    # Maximum number of vertices for which the table of the Coxeter types is created
+    MAX_TYPE_TABLE_VERTICES = 20
+    
     def __init__(self):
         pass
     
@@ -58,52 +65,209 @@ class CoxeterGraph:
         if self.size == 1:
             # if there is only one vertex, it was not added because there are no arcs
             self.vertices = { 1: Vertex(self, 1) }
+        
+        # Bitmask encoding of simplices: bit i corresponds to the i-th vertex in increasing order
+        self.vertex_list = sorted(self.vertices.iterkeys())
+        self.bit = {v: i for (i, v) in enumerate(self.vertex_list)}
+        self.adjacency = [reduce(operator.or_, (1 << self.bit[w.index] for (a, w) in self.vertices[v].adjacency_list), 0) for v in self.vertex_list]
+        self.vertex_position = [0] * len(self.vertex_list) # position of each vertex in self.vertices
+        for (p, v) in enumerate(self.vertices.iterkeys()):
+            self.vertex_position[self.bit[v]] = p
+        self.components_cache = {} # bitmask => connected components (see connected_components())
+        self.components_arrays = None # see components_table()
+    
+    
+    def mask(self, simplex):
+        """
+        Returns the bitmask of the simplex.
+        """
+        return reduce(operator.or_, (1 << self.bit[v] for v in simplex), 0)
+    
+    
+    def simplex(self, mask):
+        """
+        Returns the simplex (as a sorted tuple of vertices) with the given bitmask.
+        """
+        return tuple(v for (i, v) in enumerate(self.vertex_list) if mask >> i & 1)
+    
     
+    def component_of_lowest(self, mask):
+        """
+        Returns the bitmask of the connected component of the lowest vertex of the simplex with the given bitmask.
+        """
+        component = mask & -mask
+        frontier = component
+        while frontier:
+            bit = frontier & -frontier
+            frontier ^= bit
+            new = self.adjacency[bit.bit_length() - 1] & mask & ~component
+            component |= new
+            frontier |= new
+        return component
     
-    def find_connected_components(self, simplex):
+    
+    def find_connected_components(self, simplex, memo=False):
         """
         Returns the list of connected components of the subgraph induced by the simplex.
-        Each connected component is given as a simplex.
+        Each connected component is given as a simplex. Components are listed in the order in which their first vertex
+        appears in self.vertices.
+        """
+        mask = reduce(operator.or_, (1 << self.bit[v] for v in simplex if v in self.bit), 0)
+        components = self.connected_components(mask, memo=memo)
+        return [self.simplex(c) for c in sorted(components, key=lambda c: min(self.vertex_position[i] for i in xrange(len(self.vertex_list)) if c >> i & 1))]
+    
+    
+    def connected_components(self, mask, memo=False):
         """
-        visited = set() # indices of visited vertices
-        queue = []
+        Returns the list of connected components (as bitmasks) of the subgraph induced by the simplex with the given bitmask,
+        in increasing order of their lowest vertex.
+        If memo is True, the result is stored in (and retrieved from) self.components_cache.
+        """
+        if memo and mask in self.components_cache:
+            return self.components_cache[mask]
+        
         components = []
-        component = []
-        
-        for i in self.vertices.iterkeys():
-            if not i in visited:
-                queue.append(i)
-                
-                while len(queue)>0:
-                    j = queue.pop(0)
-                    if not j in visited and j in simplex:
-                        visited.add(j)
-                        component.append(j)
-                        for (a,k) in self.vertices[j].adjacency_list:
-                            queue.append(k.index)
-                
-                if len(component) > 0:
-                    # found a new component
-                    components.append(tuple(sorted(component)))
-                    component = []
+        rest = mask
+        while rest:
+            component = self.component_of_lowest(rest)
+            components.append(component)
+            rest ^= component
         
+        if memo:
+            self.components_cache[mask] = components
         return components
     
     
     def get_coxeter_type(self, simplex):
         """
         Returns the Coxeter type of the subgraph induced by the simplex (assumed to be connected!).
-        This method must be overwritten by the subclass.
+        This method must be overwritten by the subclass. It is only used to fill self.type_table.
         """
         raise Exception()
     
     
-    def weight(self, simplex):
+    def create_type_table(self):
+        """
+        Fills self.type_table, the list of the Coxeter types of the connected spherical subgraphs, indexed by bitmask
+        (None for the other subsets of vertices). This must be called by the subclass at the end of __init__().
+        For graphs with more than MAX_TYPE_TABLE_VERTICES vertices the table is not created (self.type_table is None),
+        and the types are computed when needed (see coxeter_type()).
+        """
+        self.types_cache = {}
+        if len(self.vertex_list) > self.MAX_TYPE_TABLE_VERTICES:
+            self.type_table = None
+            return
+        
+        full = (1 << len(self.vertex_list)) - 1
+        self.type_table = [None] * (full + 1)
+        for mask in xrange(1, full + 1):
+            if mask == full and self.category == self.AFFINE:
+                # the whole affine graph is not spherical
+                continue
+            if self.component_of_lowest(mask) == mask:
+                self.type_table[mask] = self.get_coxeter_type(self.simplex(mask))
+    
+    
+    def coxeter_type(self, component):
+        """
+        Returns the Coxeter type of the connected spherical subgraph with the given bitmask.
+        """
+        if self.type_table is not None:
+            return self.type_table[component]
+        if component not in self.types_cache:
+            self.types_cache[component] = self.get_coxeter_type(self.simplex(component))
+        return self.types_cache[component]
+    
+    
+    def weight(self, simplex, memo=False):
         """
         Returns the weight of the simplex.
+        If memo is True, the connected components of the simplex are cached (see connected_components()).
+        """
+        components = self.connected_components(self.mask(simplex), memo=memo)
+        return sum([Weight()] + [self.coxeter_type(component).weight() for component in components])
+    
+    
+    def weight_table(self, dimension=None):
+        """
+        Returns the list of the weights of all simplices with at most the given number of vertices, indexed by bitmask
+        (None for larger simplices). They are computed by dynamic programming over subsets: the weight of a simplex is
+        the weight of the component of its lowest vertex plus the weight of the remaining simplex.
+        """
+        if dimension is None:
+            dimension = len(self.vertex_list)
+        
+        table = [None] * (1 << len(self.vertex_list))
+        table[0] = Weight()
+        
+        for mask in xrange(1, len(table)):
+            if bin(mask).count('1') > dimension:
+                continue
+            component = self.component_of_lowest(mask)
+            table[mask] = table[mask ^ component] + self.coxeter_type(component).weight()
+        
+        return table
+    
+    
+    def components_table(self):
+        """
+        Returns the components of the lowest vertex (see component_of_lowest()) of all simplices, as a triple of arrays:
+        the bitmasks of the components (indexed by bitmask), the sorted distinct components, and the position of the
+        component of every simplex among them (indexed by bitmask). The components are computed with array operations, by extending the lowest vertex along the arcs until nothing
+        changes, and they are stored in self.components_arrays.
+        """
+        if self.components_arrays is None:
+            mask = np.arange(1 << len(self.vertex_list), dtype=np.int64)
+            component = mask & -mask
+            while True:
+                neighbours = np.zeros_like(mask)
+                for (i, adjacency) in enumerate(self.adjacency):
+                    neighbours |= -(component >> i & 1) & adjacency
+                new_component = component | (neighbours & mask)
+                if np.array_equal(new_component, component):
+                    break
+                component = new_component
+            
+            (components, position) = np.unique(component, return_inverse=True)
+            self.components_arrays = (component, components, position.astype(np.int32))
+        
+        return self.components_arrays
+    
+    
+    def weight_components(self, d):
         """
-        components = self.find_connected_components(simplex)
-        return sum([Weight()] + [self.get_coxeter_type(component).weight() for component in components])
+        Returns the array of the d-components of the weights of all simplices, indexed by bitmask. They are computed
+        with array operations, as in weight_table(): the component of the lowest vertex is removed until nothing is left.
+        Components which are not of finite type (the whole graph, if it is affine) are given weight 0.
+        """
+        (component, components, position) = self.components_table()
+        types = [self.coxeter_type(c) if c > 0 else None for c in components.tolist()]
+        values = np.array([t.weight().component(d) if t is not None else 0 for t in types], dtype=np.int64)
+        
+        weights = np.zeros(len(component), dtype=np.int64)
+        rest = np.arange(len(component), dtype=np.int64)
+        while rest.any():
+            weights += values[position[rest]]
+            rest ^= component[rest]
+        return weights
+    
+    
+    def relevant_d_values(self):
+        """
+        Returns the list of the values of d for which some simplex has positive d-weight.
+        The weight of a simplex is at most the weight of any simplex containing it, so only the maximal simplices
+        (the whole graph if it is spherical, all the vertices but one if it is affine) are considered.
+        """
+        full = (1 << len(self.vertex_list)) - 1
+        if self.category == self.SPHERICAL:
+            maximal = [full]
+        else:
+            maximal = [full ^ (1 << i) for i in xrange(len(self.vertex_list))]
+        
+        relevant_d = set()
+        for mask in maximal:
+            relevant_d.update(self.weight(self.simplex(mask)).w.iterkeys())
+        return list(sorted(relevant_d))
     
     
     def is_simplex_relevant(self, simplex):
@@ -138,6 +302,8 @@ class SphericalACoxeterGraph(CoxeterGraph):
         assert 0 <= g <= n
         self.f = f  # the first f vertices are special
         self.g = g  # the last g vertices are special
+        
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -170,6 +336,8 @@ class SphericalBCoxeterGraph(CoxeterGraph):
         
         assert 0 <= g <= n
         self.g = g  # the last g vertices are special
+        
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -205,6 +373,8 @@ class SphericalDCoxeterGraph(CoxeterGraph):
         
         assert 0 <= g <= n
         self.g = g  # the last g vertices are special
+        
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -236,6 +406,7 @@ class AffineACoxeterGraph(CoxeterGraph):
         # create graph
         arcs = [(i, (i+1)%(n+1), 3) for i in xrange(n+1)]
         self.create_graph_from_arcs(arcs)
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -259,6 +430,7 @@ class AffineBCoxeterGraph(CoxeterGraph):
         # create graph
         arcs = [(0, 1, 4)] + [(i, i+1, 3) for i in xrange(1, n-1)] + [(n-2, n, 3)]
         self.create_graph_from_arcs(arcs)
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -287,6 +459,7 @@ class AffineCCoxeterGraph(CoxeterGraph):
         # create graph
         arcs = [(0, 1, 4)] + [(i, i+1, 3) for i in xrange(1,n-1)] + [(n-1, n, 4)]
         self.create_graph_from_arcs(arcs)
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -313,6 +486,7 @@ class AffineDCoxeterGraph(CoxeterGraph):
         # create graph
         arcs = [(0, 2, 3)] + [(i, i+1, 3) for i in xrange(1,n-1)] + [(n-2, n, 3)]
         self.create_graph_from_arcs(arcs)
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -351,6 +525,7 @@ class SphericalExceptionalCoxeterGraph(CoxeterGraph):
             raise Exception("Invalid parameters for exceptional Coxeter graph")
         
         self.create_graph_from_arcs(arcs)
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
@@ -437,6 +612,7 @@ class AffineExceptionalCoxeterGraph(CoxeterGraph):
             raise Exception("Invalid parameters for exceptional Coxeter graph")
         
         self.create_graph_from_arcs(arcs)
+        self.create_type_table()
     
     def get_coxeter_type(self, simplex):
         """
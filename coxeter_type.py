@@ -1,19 +1,47 @@
 #!/usr/bin/python
 # coding=utf8
 
-import copy
+from operator import add
 
 
 class Weight:
+    """
+    Weight of a simplex: the exponents of the cyclotomic polynomials in its Poincaré polynomial.
+    The exponents are stored in a tuple indexed by d, without trailing zeros.
+    """
+    
     def __init__(self, w={}):
-        self.w = {d: e for (d,e) in w.iteritems() if e>0} # dictionary: d-component => exponent
+        v = [0] * (max([d for (d,e) in w.iteritems() if e>0] + [-1]) + 1)
+        for (d,e) in w.iteritems():
+            if e>0:
+                v[d] = e
+        self.v = tuple(v) # d-component => exponent
+    
+    @classmethod
+    def from_vector(cls, v):
+        """
+        Create a Weight from a sequence of exponents indexed by d.
+        """
+        weight = cls()
+        v = list(v)
+        while len(v) > 0 and v[-1] == 0:
+            v.pop()
+        weight.v = tuple(v)
+        return weight
+    
+    @property
+    def w(self):
+        """
+        Dictionary d-component => exponent (only positive exponents).
+        """
+        return {d: e for (d,e) in enumerate(self.v) if e>0}
     
     def component(self, d):
         """
         Returns the exponent of the d-th cyclotomic polynomial.
         """
-        if d in self.w:
-            return self.w[d]
+        if d < len(self.v):
+            return self.v[d]
         else:
             return 0
     
@@ -24,22 +52,33 @@ class Weight:
         return self.w.__repr__()
     
     def __eq__(self, other):
-        return self.w == other.w
+        return self.v == other.v
     
-    def __neq__(self, other):
+    def __ne__(self, other):
         return not self == other
     
+    def __hash__(self):
+        return hash(self.v)
+    
     def __add__(self, other):
-        s = set(self.w.keys()) | set(other.w.keys())
-        return Weight({d: self.component(d) + other.component(d) for d in s})
+        a, b = self.v, other.v
+        if len(a) < len(b):
+            a, b = b, a
+        result = Weight()
+        result.v = tuple(map(add, a[:len(b)], b)) + a[len(b):]
+        return result
     
     def __radd__(self, other):
         if other == 0:
-            return copy.deepcopy(self)
+            # weights are immutable
+            return self
         else:
             return self + other
 
 
+# Weights of the Coxeter types, by (type, n, m)
+_weights = {}
+
 
 class CoxeterType:
     """
@@ -59,6 +98,16 @@ class CoxeterType:
         """
         Returns the weight (Poincaré polynomial of the Coxeter group,
         expressed as a product of cyclotomic polynomials).
+        Weights are computed once for every (type, n, m), and shared.
+        """
+        key = (self.type, self.n, self.m)
+        if key not in _weights:
+            _weights[key] = self.compute_weight()
+        return _weights[key]
+    
+    def compute_weight(self):
+        """
+        Computes the weight (see weight()).
         """
         n = self.n
         
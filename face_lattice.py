@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# coding=utf8
+
+from itertools import izip
+import weakref
+
+import numpy as np
+
+from complex import Cell, Edge
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def faces(mask):
+    """
+    Returns the list of the bitmasks of the facets of a simplex, obtained by removing its vertices in increasing order.
+    """
+    faces = []
+    m = mask
+    while m:
+        bit = m & -m
+        faces.append(mask ^ bit)
+        m ^= bit
+    return faces
+
+
+class FaceLattice:
+    """
+    The simplices with at most the given number of vertices, stored in NumPy arrays.
+    Simplices are encoded as bitmasks (bit i corresponds to vertices[i]), and are numbered in increasing order of bitmask.
+    Their facets and labels are not stored, but computed from the bitmasks when they are needed.
+    A face lattice does not depend on the Coxeter graph, so it is shared between simplicial complexes (see face_lattice()),
+    and it must not be modified.
+    """
+    
+    def __init__(self, vertices, dimension):
+        self.vertices = tuple(vertices)
+        self.dimension = dimension
+        
+        all_masks = np.arange(1 << len(self.vertices), dtype=np.int64)
+        all_dimensions = np.zeros(len(all_masks), dtype=np.int8)
+        for i in xrange(len(self.vertices)):
+            all_dimensions += (all_masks >> i & 1).astype(np.int8)
+        
+        present = all_dimensions <= dimension
+        self.masks = all_masks[present]
+        self.dimensions = all_dimensions[present]
+        
+        self.index = np.full(len(all_masks), -1, dtype=np.int32) # bitmask => number of the simplex (-1 if not present)
+        self.index[self.masks] = np.arange(len(self.masks), dtype=np.int32)
+    
+    
+    def __len__(self):
+        return len(self.masks)
+    
+    
+    def label(self, mask):
+        """
+        Returns the sorted tuple of vertices of the simplex with the given bitmask.
+        """
+        return tuple(v for (i, v) in enumerate(self.vertices) if mask >> i & 1)
+    
+    
+    def create_cells(self):
+        """
+        Returns a new list of cells (one for each simplex, labelled by its tuple of vertices, in the order of self.masks),
+        and a new list of edges between them: the facet of a simplex obtained by removing its i-th vertex has sign (-1)^i.
+        They are not shared, since they carry the state of a matching.
+        """
+        masks = self.masks.tolist()
+        cells = [Cell(popcount(mask), label=self.label(mask)) for mask in masks]
+        
+        index = self.index.tolist()
+        edges = []
+        for (cell, mask) in izip(cells, masks):
+            for (i, face) in enumerate(faces(mask)):
+                edges.append(Edge(cell, cells[index[face]], 1 if i % 2 == 0 else -1))
+        return cells, edges
+
+
+# Face lattices, by (vertices, dimension); a face lattice is kept only as long as some simplicial complex uses it
+_face_lattices = weakref.WeakValueDictionary()
+
+def face_lattice(vertices, dimension):
+    """
+    Returns the (shared) face lattice of the simplices with at most the given number of vertices.
+    """
+    key = (tuple(vertices), dimension)
+    lattice = _face_lattices.get(key)
+    if lattice is None:
+        lattice = FaceLattice(vertices, dimension)
+        _face_lattices[key] = lattice
+    return lattice
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# coding=utf8
+
+from array import array
+from itertools import izip
+
+import numpy as np
+
+from complex import Cell, Edge, Complex, topological_sort
+from face_lattice import popcount, faces
+
+
+def incidence_sign(high, low):
+    """
+    Returns the incidence sign between the simplex high and its facet low (given as bitmasks): (-1)^i if the i-th vertex is removed.
+    """
+    return -1 if popcount(high & ((high ^ low) - 1)) % 2 else 1
+
+
+class ImplicitComplex:
+    """
+    The simplicial complex of a FaceLattice, without Cell and Edge objects: the facets and cofacets of a simplex are
+    computed from its bitmask, with incidence sign (-1)^i when the i-th vertex is removed.
+    The matching is stored in an array indexed by bitmask: self.partner[mask] is the bitmask of the simplex matched
+    with mask (-1 if there is none).
+    """
+    
+    def __init__(self, lattice):
+        self.lattice = lattice
+        self.d = lattice.dimension
+        self.full = (1 << len(lattice.vertices)) - 1
+        self.clear_matching()
+    
+    
+    def clear_matching(self):
+        self.partner = array('i', [-1]) * (self.full + 1)
+    
+    
+    def is_present(self, mask):
+        return 0 <= mask <= self.full and self.lattice.index[mask] >= 0
+    
+    
+    def faces(self, mask):
+        """
+        Returns the list of couples (facet, sign).
+        """
+        return [(face, 1 if i % 2 == 0 else -1) for (i, face) in enumerate(faces(mask))]
+    
+    
+    def cofaces(self, mask):
+        """
+        Returns the list of couples (cofacet, sign) of the simplices present in the complex.
+        """
+        if popcount(mask) >= self.d:
+            return []
+        return [(mask | bit, incidence_sign(mask | bit, mask)) for bit in (1 << i for i in xrange(len(self.lattice.vertices))) if not mask & bit]
+    
+    
+    def is_matched(self, mask):
+        return self.partner[mask] >= 0
+    
+    
+    def add_to_matching(self, high, low):
+        """
+        Add to the matching the simplex high and its facet low.
+        """
+        assert self.is_present(high) and self.is_present(low)
+        assert high & low == low and popcount(high ^ low) == 1
+        assert not self.is_matched(high) and not self.is_matched(low)
+        self.partner[high] = low
+        self.partner[low] = high
+    
+    
+    def set_partners(self, partners):
+        """
+        Replace the matching with the given array of partners, indexed by bitmask (-1 for unmatched simplices).
+        The array is assumed to describe a valid matching of the complex (see SimplicialComplex.set_matching()).
+        """
+        assert len(partners) == self.full + 1
+        self.partner = array('i', np.asarray(partners, dtype=np.int32).tostring())
+    
+    
+    def remove_from_matching(self, high, low):
+        assert self.partner[high] == low and self.partner[low] == high
+        self.partner[high] = -1
+        self.partner[low] = -1
+    
+    
+    def cells(self, k):
+        """
+        Returns the list of the bitmasks of the k-dimensional simplices, in increasing order.
+        """
+        return self.lattice.masks[self.lattice.dimensions == k].tolist()
+    
+    
+    def layer(self, k):
+        """
+        Returns the DAG between k-dimensional and (k-1)-dimensional simplices, taking into account the matching,
+        as a function children(mask) which returns a list of couples (mask, sign).
+        """
+        partner = self.partner
+        
+        def children(mask):
+            p = partner[mask]
+            if popcount(mask) == k:
+                return [(face, sign) for (face, sign) in self.faces(mask) if face != p]
+            elif p >= 0 and popcount(p) == k:
+                return [(p, incidence_sign(p, mask))]
+            else:
+                return []
+        
+        return children
+    
+    
+    def topological_sort(self, k):
+        """
+        Sort topologically the k-dimensional and (k-1)-dimensional simplices (see complex.topological_sort()).
+        """
+        children = self.layer(k)
+        return topological_sort(self.cells(k) + self.cells(k-1), lambda v: [w for (w, sign) in children(v)])
+    
+    
+    def DFS_order(self, mask, children, visited, order):
+        """
+        DFS for the purpose of sorting topologically the simplices reachable from the given one (they are appended to order in post-order)
+        """
+        visited.add(mask)
+        stack = [(mask, iter(children(mask)))]
+        
+        while len(stack) > 0:
+            (v, it) = stack[-1]
+            for (w, sign) in it:
+                if w not in visited:
+                    visited.add(w)
+                    stack.append((w, iter(children(w))))
+                    break
+            else:
+                order.append(v)
+                stack.pop()
+    
+    
+    def gradient_paths(self, source, children):
+        """
+        Compute the weights of the gradient paths from the k-dimensional simplex source to all critical (k-1)-dimensional
+        simplices (see Complex.gradient_paths()). Returns a dictionary mask => incidence number (non-zero entries only).
+        """
+        order = []
+        self.DFS_order(source, children, set(), order)
+        
+        weight = {source: 1}
+        incidences = {}
+        for v in reversed(order):
+            x = weight.get(v, 0)
+            if x == 0:
+                continue
+            
+            if v != source and not self.is_matched(v):
+                # critical (k-1)-dimensional simplex
+                incidences[v] = x
+                continue
+            
+            for (w, sign) in children(v):
+                weight[w] = weight.get(w, 0) + (sign*x if popcount(v) > popcount(w) else -sign*x)
+        
+        return incidences
+    
+    
+    def morse_reduction(self, label=None):
+        """
+        Perform Discrete Morse Theory collapses, returning the Morse complex as a Complex.
+        The cells are labelled with label(mask) (by default, the bitmask), and they are sorted as in Complex.morse_reduction().
+        """
+        if label is None:
+            label = lambda mask: mask
+        
+        critical = {k: [mask for mask in self.cells(k) if not self.is_matched(mask)] for k in xrange(self.d+1)}
+        new_cells = {k: [Cell(d=k, label=label(mask)) for mask in l] for (k, l) in critical.iteritems()}
+        
+        new_edges = []
+        for k in xrange(1, self.d+1):
+            children = self.layer(k)
+            index = {mask: i for (i, mask) in enumerate(critical[k-1])}
+            for (a, mask) in izip(new_cells[k], critical[k]):
+                incidences = self.gradient_paths(mask, children)
+                for low in sorted(incidences.iterkeys()):
+                    new_edges.append(Edge(a, new_cells[k-1][index[low]], incidences[low]))
+        
+        return Complex(new_cells, new_edges, cells_by_dimension=True)
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# coding=utf8
+
+import numpy as np
+
+
+class Matching:
+    """
+    A matching on the simplices over n vertices, stored as an int8 array indexed by the bitmask of the simplex:
+    toggle[mask] is the index of the vertex which is added to (or removed from) the simplex to obtain its partner,
+    or -1 if the simplex is critical.
+    """
+    
+    def __init__(self, n, toggle=None):
+        self.n = n
+        assert n < 128 # vertex indices must fit in an int8
+        if toggle is None:
+            self.toggle = np.full(1 << n, -1, dtype=np.int8)
+        else:
+            self.toggle = np.asarray(toggle, dtype=np.int8)
+            assert self.toggle.shape == (1 << n,)
+    
+    
+    @classmethod
+    def from_pairs(cls, n, pairs):
+        """
+        Create a Matching from an iterable of couples of bitmasks.
+        """
+        matching = cls(n)
+        for (sigma, tau) in pairs:
+            matching.add(sigma, tau)
+        return matching
+    
+    
+    def clear(self):
+        self.toggle.fill(-1)
+    
+    
+    def add(self, sigma, tau):
+        """
+        Add to the matching the couple of simplices (given as bitmasks), which must differ by exactly one vertex.
+        """
+        bit = sigma ^ tau
+        assert bit != 0 and bit & (bit-1) == 0
+        assert not self.is_matched(sigma) and not self.is_matched(tau)
+        self.toggle[sigma] = self.toggle[tau] = bit.bit_length() - 1
+    
+    
+    def is_matched(self, mask):
+        return self.toggle[mask] >= 0
+    
+    
+    def partner(self, mask):
+        """
+        Returns the bitmask of the partner of the simplex (-1 if it is critical).
+        """
+        t = int(self.toggle[mask])
+        return mask ^ (1 << t) if t >= 0 else -1
+    
+    
+    def partners(self):
+        """
+        Returns the array of the partners of all simplices (-1 for the critical ones).
+        """
+        masks = np.arange(len(self.toggle), dtype=np.int64)
+        matched = self.toggle >= 0
+        partners = np.full(len(self.toggle), -1, dtype=np.int64)
+        partners[matched] = masks[matched] ^ (np.int64(1) << self.toggle[matched].astype(np.int64))
+        return partners
+    
+    
+    def pairs(self):
+        """
+        Returns the list of couples (high, low) of matched simplices, each one once, sorted by high.
+        """
+        partners = self.partners()
+        high = np.nonzero(partners >= 0)[0]
+        high = high[partners[high] < high]
+        return zip(high.tolist(), partners[high].tolist())
+    
+    
+    def __len__(self):
+        return int(np.count_nonzero(self.toggle >= 0)) // 2
+    
+    
+    def critical(self):
+        """
+        Returns the array of the bitmasks of the critical simplices.
+        """
+        return np.nonzero(self.toggle < 0)[0]
+    
+    
+    def invalid_involution(self):
+        """
+        Returns the array of the simplices whose partner is not matched back with them.
+        """
+        partners = self.partners()
+        matched = np.nonzero(partners >= 0)[0]
+        return matched[self.toggle[partners[matched]] != self.toggle[matched]]
+    
+    
+    def invalid_faces(self, present):
+        """
+        Returns the array of the matched simplices which are not in the complex, or whose partner is not in the complex
+        (present is a boolean array indexed by bitmask).
+        """
+        partners = self.partners()
+        matched = np.nonzero(partners >= 0)[0]
+        return matched[~present[matched] | ~present[partners[matched]]]
+    
+    
+    def invalid_weights(self, weights):
+        """
+        Returns the array of the simplices whose partner has a different weight (weights is an integer array indexed by bitmask).
+        """
+        partners = self.partners()
+        matched = np.nonzero(partners >= 0)[0]
+        return matched[weights[partners[matched]] != weights[matched]]
+    
+    
+    def gradient_arcs(self):
+        """
+        Returns the list of the arcs (sigma, rho) between matched simplices of the same dimension, as couples of arrays
+        (one couple for every vertex): sigma is matched with a face, and rho is matched with another face tau of sigma
+        (so that sigma -> tau -> rho is a step of a gradient path). The matching is acyclic if and only if these arcs
+        form an acyclic graph.
+        """
+        masks = np.arange(len(self.toggle), dtype=np.int64)
+        partners = self.partners()
+        upper = (partners >= 0) & (partners < masks)
+        lower = partners > masks
+        
+        arcs = []
+        for i in xrange(self.n):
+            bit = np.int64(1) << i
+            sigma = np.nonzero(upper & (masks & bit != 0))[0]
+            tau = sigma ^ bit
+            keep = lower[tau] & (partners[sigma] != tau)
+            arcs.append((sigma[keep], partners[tau[keep]]))
+        return arcs
+    
+    
+    def invalid_potential(self, potential):
+        """
+        Returns the array of the simplices sigma for which the potential (an integer array indexed by bitmask) does not
+        decrease along some arc sigma -> rho (see gradient_arcs()). If there is none, the matching is acyclic.
+        """
+        return np.unique(np.concatenate([sigma[potential[sigma] <= potential[rho]] for (sigma, rho) in self.gradient_arcs()] + [np.zeros(0, dtype=np.int64)]))
+    
+    
+    def acyclicity_potential(self):
+        """
+        Returns a potential certifying that the matching is acyclic (see invalid_potential()), or None if it has a cycle.
+        The arcs of the gradient paths are sorted topologically with Kahn's algorithm, removing at once all the simplices
+        whose arcs all lead to removed simplices: the potential of a simplex is the round in which it is removed (the
+        length of the longest gradient path starting from it). Every arc is visited once; if some simplex is never
+        removed, there is a cycle.
+        """
+        arcs = self.gradient_arcs()
+        sigma = np.concatenate([s for (s, rho) in arcs] + [np.zeros(0, dtype=np.int64)])
+        rho = np.concatenate([r for (s, r) in arcs] + [np.zeros(0, dtype=np.int64)])
+        size = len(self.toggle)
+        
+        # number of arcs leaving every simplex, and the arcs entering it (in CSR format)
+        outdegree = np.bincount(sigma, minlength=size)
+        order = np.argsort(rho, kind='mergesort')
+        predecessors = sigma[order]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rho, minlength=size))])
+        
+        potential = np.zeros(size, dtype=np.int64)
+        frontier = np.unique(rho[outdegree[rho] == 0])
+        level = 0
+        while len(frontier) > 0:
+            potential[frontier] = level
+            
+            # remove the arcs entering the frontier
+            counts = indptr[frontier+1] - indptr[frontier]
+            positions = np.repeat(indptr[frontier] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            sources = predecessors[positions]
+            np.subtract.at(outdegree, sources, 1)
+            
+            frontier = np.unique(sources[outdegree[sources] == 0])
+            level += 1
+        
+        if np.any(outdegree > 0):
+            return None
+        return potential
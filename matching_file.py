@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# coding=utf8
+
+import os
+import sys
+import glob
+import mmap
+import operator
+import pickle
+import struct
+import zlib
+
+import numpy as np
+
+from matching import Matching
+
+
+# Binary format of a matching file (all integers are little-endian):
+#   header: magic 'PMATCH', version (uint8), flags (uint8), number of vertices n (uint8), first vertex (int8), 2 bytes of padding;
+#   the toggle array of the matching (2^n int8, see Matching);
+#   if FLAG_CERTIFICATE is set, a potential certifying acyclicity (2^n int32, see Matching.invalid_potential()).
+# If FLAG_COMPRESSED is set, everything after the header is compressed with zlib. Otherwise the arrays are read
+# through mmap, without parsing.
+# The vertex i of the simplicial complex corresponds to the bit i - (first vertex).
+
+MAGIC = 'PMATCH'
+VERSION = 1
+HEADER = struct.Struct('<6sBBBbxx')
+
+FLAG_COMPRESSED = 1
+FLAG_CERTIFICATE = 2
+
+EXTENSION = '.bin'
+
+
+def save_matching(filename, matching, first_vertex=0, certificate=None, compress=False):
+    """
+    Save the Matching (and optionally a certificate of acyclicity) to the file.
+    """
+    flags = (FLAG_COMPRESSED if compress else 0) | (FLAG_CERTIFICATE if certificate is not None else 0)
+    data = np.asarray(matching.toggle, dtype='<i1').tostring()
+    if certificate is not None:
+        data += np.asarray(certificate, dtype='<i4').tostring()
+    if compress:
+        data = zlib.compress(data, 9)
+    
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, matching.n, first_vertex))
+        f.write(data)
+
+
+def load_matching(filename):
+    """
+    Load a matching file. Returns a triple (matching, first_vertex, certificate), where certificate is None if the
+    file does not contain one. Uncompressed arrays are mapped copy-on-write from the file.
+    """
+    with open(filename, 'rb') as f:
+        (magic, version, flags, n, first_vertex) = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise Exception("%s is not a matching file" % filename)
+        if version > VERSION:
+            raise Exception("Unsupported version %d of matching file %s" % (version, filename))
+        
+        if flags & FLAG_COMPRESSED:
+            data = np.frombuffer(zlib.decompress(f.read()), dtype=np.uint8).copy()
+        else:
+            data = np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY), dtype=np.uint8)[HEADER.size:]
+    
+    size = 1 << n
+    expected = size * (5 if flags & FLAG_CERTIFICATE else 1)
+    if len(data) != expected:
+        raise Exception("Matching file %s has %d bytes of data instead of %d" % (filename, len(data), expected))
+    
+    matching = Matching(n, data[:size].view('<i1'))
+    certificate = data[size:].view('<i4') if flags & FLAG_CERTIFICATE else None
+    return (matching, first_vertex, certificate)
+
+
+def convert_pickle(filename, compress=False):
+    """
+    Convert a matching stored as a pickled list of couples of simplices, in a file named <type>_<n>_<d>.p, to a
+    matching file with the same name (and extension EXTENSION), adding a certificate of acyclicity if possible.
+    Returns the name of the new file.
+    """
+    (type, n, d) = os.path.splitext(os.path.basename(filename))[0].split('_')
+    n = int(n)
+    if type[0] == 't':
+        # affine: vertices are numbered 0,1,...,n
+        (size, first_vertex) = (n+1, 0)
+    else:
+        # spherical: vertices are numbered 1,2,...,n
+        (size, first_vertex) = (n, 1)
+    
+    with open(filename, 'r') as f:
+        pairs = pickle.load(f)
+    mask = lambda sigma: reduce(operator.or_, (1 << (v - first_vertex) for v in sigma), 0)
+    matching = Matching.from_pairs(size, ((mask(sigma), mask(tau)) for (sigma, tau) in pairs))
+    certificate = matching.acyclicity_potential()
+    
+    new_filename = os.path.splitext(filename)[0] + EXTENSION
+    save_matching(new_filename, matching, first_vertex, certificate, compress)
+    return new_filename
+
+
+if __name__ == '__main__':
+    
+    if len(sys.argv) >= 2 and sys.argv[1] == "help":
+        print "Usage: python %s [directory] [-z]" % sys.argv[0]
+        print "Convert the pickled matchings in the directory (default: matchings) to matching files (-z: compressed)."
+        sys.exit()
+    
+    directory = ([a for a in sys.argv[1:] if a != '-z'] + ['matchings'])[0]
+    for filename in sorted(glob.glob(os.path.join(directory, '*.p'))):
+        print filename, "->", convert_pickle(filename, compress='-z' in sys.argv)
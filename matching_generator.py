@@ -2,10 +2,14 @@
 # coding=utf8
 
 from coxeter_graph import CoxeterGraph
+from matching import Matching
+import vertex_tables
 
-from itertools import combinations, chain, permutations
+from itertools import combinations, chain, permutations, izip
 
 import copy
+import operator
+import numpy as np
 
 
 def powerset(x):
@@ -15,12 +19,71 @@ def powerset(x):
     return chain.from_iterable(combinations(x,r) for r in xrange(len(x)+1))
 
 
+# The spherical generators work on bitmasks over the vertices 1,2,...,n, where the vertex i corresponds to the bit i-1.
+
+def vertex_bit(i):
+    return 1 << (i-1)
+
+
+def low_mask(k):
+    """
+    Returns the bitmask of the vertices 1,2,...,k.
+    """
+    return (1 << k) - 1
+
+
+def simplex_mask(sigma):
+    """
+    Returns the bitmask of the simplex sigma (an iterable of vertices among 1,2,...).
+    """
+    mask = 0
+    for i in sigma:
+        assert i >= 1
+        mask |= vertex_bit(i)
+    return mask
+
+
+def contains(mask, vertices):
+    return all(mask & vertex_bit(i) for i in vertices)
+
+
+def contains_first(mask, k):
+    """
+    Checks if the vertices 1,2,...,k are in the simplex (k <= 0 is allowed).
+    """
+    return k <= 0 or mask & low_mask(k) == low_mask(k)
+
+
+def contains_last(mask, n, g):
+    """
+    Checks if the vertices n-g+1,...,n are in the simplex (contained in 1,2,...,n).
+    """
+    return g <= n and mask >> (n-g) == low_mask(g)
+
+
+def trailing_vertices(mask):
+    """
+    Returns the largest k such that the vertices 1,2,...,k are in the simplex.
+    """
+    return (~mask & (mask+1)).bit_length() - 1
+
+
+def reverse_mask(mask, n):
+    """
+    Returns the bitmask of the simplex obtained by relabeling each vertex i as n+1-i.
+    """
+    assert mask >> n == 0
+    return int(bin(mask)[:1:-1].ljust(n, '0'), 2) if n > 0 else 0
+
+
+
 
 class MatchingGenerator:
     
     def __init__(self, debug=False):
         self.clear_matching()
         self.debug = debug
+        self.vertex_memo = None # memoized vertex choices of the spherical generators, during iter_matching()
     
     
     def clear_matching(self):
@@ -45,51 +108,167 @@ class MatchingGenerator:
             print "add to matching", x, y, "\tfrom", sigma
     
     
-    def generate_matching(self, simplicial_complex, d, **kwargs):
+    def vertex_function(self, coxeter_graph):
         """
-        Generates the matching for the given simplicial complex (associated to some Coxeter graph).
+        Returns the generator function for the given Coxeter graph, which takes (n, d, sigma, **kwargs) and returns the
+        vertex v such that sigma is matched with sigma \cup {v} or sigma \setminus {v} (or None if sigma is critical).
         """
-        self.clear_matching()
+        category = coxeter_graph.category
+        type = coxeter_graph.type
         
-        coxeter_graph = simplicial_complex.coxeter_graph
+        if category == CoxeterGraph.SPHERICAL:
+            if type == 'A':
+                return self.generate_spherical_A_matching
+            elif type == 'B':
+                return self.generate_spherical_B_matching
+            elif type == 'D':
+                return self.generate_spherical_D_matching
+        
+        elif category == CoxeterGraph.AFFINE:
+            if type == 'A':
+                return self.generate_affine_A_matching
+            elif type == 'B':
+                return self.generate_affine_B_matching
+            elif type == 'C':
+                return self.generate_affine_C_matching
+            elif type == 'D':
+                return self.generate_affine_D_matching
+        
+        raise NotImplementedError
+    
+    
+    def mask_vertex_function(self, coxeter_graph):
+        """
+        Returns the bitmask version of the generator function (see vertex_function()), which takes (n, d, mask, **kwargs),
+        or None if there is none for the given Coxeter graph.
+        """
+        if coxeter_graph.category == CoxeterGraph.SPHERICAL:
+            return {'A': self.spherical_A_vertex, 'B': self.spherical_B_vertex, 'D': self.spherical_D_vertex}.get(coxeter_graph.type)
+        return None
+    
+    
+    def vertex_table(self, coxeter_graph, d):
+        """
+        Returns the vertex table of the generator function for the given Coxeter graph (see vertex_tables), i.e. the
+        array of the vertices chosen for all simplices, or None if there is none.
+        """
         category = coxeter_graph.category
         type = coxeter_graph.type
         n = coxeter_graph.n
         
-        for sigma in simplicial_complex.simplices.iterkeys():
-            v = None
-            if category == CoxeterGraph.SPHERICAL:
-                if type == 'A':
-                    v = self.generate_spherical_A_matching(n, d, sigma, **kwargs)
-                elif type == 'B':
-                    v = self.generate_spherical_B_matching(n, d, sigma, **kwargs)
-                elif type == 'D':
-                    v = self.generate_spherical_D_matching(n, d, sigma, **kwargs)
-                else:
-                    raise NotImplementedError
-            
-            elif category == CoxeterGraph.AFFINE:
-                if type == 'A':
-                    v = self.generate_affine_A_matching(n, d, sigma, **kwargs)
-                elif type == 'B':
-                    v = self.generate_affine_B_matching(n, d, sigma, **kwargs)
-                elif type == 'C':
-                    v = self.generate_affine_C_matching(n, d, sigma, **kwargs)
-                elif type == 'D':
-                    v = self.generate_affine_D_matching(n, d, sigma, **kwargs)
-                else:
-                    raise NotImplementedError
+        if category == CoxeterGraph.SPHERICAL:
+            if type == 'A':
+                return vertex_tables.spherical_A_table(n, d)
+            elif type == 'B':
+                return vertex_tables.spherical_B_table(n, d)
+            elif type == 'D':
+                return vertex_tables.spherical_D_table(n, d)
+        
+        elif category == CoxeterGraph.AFFINE and type in ['A', 'B', 'C', 'D']:
+            return vertex_tables.affine_table(type, n, d)
+        
+        return None
+    
+    
+    def iter_matching(self, simplicial_complex, d, **kwargs):
+        """
+        Generates the matching for the given simplicial complex (associated to some Coxeter graph), yielding every
+        couple (high, low) of matched simplices once, as bitmasks. A couple is emitted from its lower endpoint, after
+        checking that the upper endpoint chooses the same vertex. Since every upper endpoint chooses only one vertex,
+        the matching is consistent if the number of upper endpoints equals the number of couples (this is checked
+        when the iteration is complete).
+        """
+        coxeter_graph = simplicial_complex.coxeter_graph
+        n = coxeter_graph.n
+        lattice = simplicial_complex.lattice
+        simplex = lattice.label
+        bits = {v: 1 << i for (i, v) in enumerate(simplicial_complex.vertices)}
+        
+        mask_vertex = self.mask_vertex_function(coxeter_graph)
+        if mask_vertex is not None and simplicial_complex.vertices == range(1, n+1):
+            # the bitmasks of the simplices are the ones used by the generator
+            vertex = lambda mask: mask_vertex(n, d, mask, **kwargs)
+        else:
+            generator = self.vertex_function(coxeter_graph)
+            vertex = lambda mask: generator(n, d, simplex(mask), **kwargs)
+        
+        # the vertex choices are memoized only for this matching, since they are shared by many simplices
+        self.vertex_memo = {}
+        try:
+            couples = 0
+            upper_endpoints = 0
+            for mask in lattice.masks.tolist():
+                v = vertex(mask)
+                if v is None:
+                    continue
+                
+                if mask & bits[v]:
+                    upper_endpoints += 1
+                    continue
+                
+                high = mask | bits[v]
+                if lattice.index[high] < 0 or vertex(high) != v:
+                    if self.debug:
+                        print "inconsistent matching", simplex(mask), v
+                    raise AssertionError("Inconsistent matching for simplex %s and vertex %d" % (str(simplex(mask)), v))
+                
+                if self.debug:
+                    print "add to matching", simplex(high), simplex(mask)
+                couples += 1
+                yield (high, mask)
             
-            if v is not None:
-                self.add_to_matching(sigma, v)
+            assert upper_endpoints == couples
+        finally:
+            self.vertex_memo = None
+    
+    
+    def generate_matching(self, simplicial_complex, d, **kwargs):
+        """
+        Generates the matching for the given simplicial complex (associated to some Coxeter graph), as a list of
+        couples of simplices in self.matching.
+        """
+        self.clear_matching()
+        simplex = simplicial_complex.simplex
+        self.matching = [(simplex(high), simplex(low)) for (high, low) in self.iter_matching(simplicial_complex, d, **kwargs)]
+    
+    
+    def generate_toggle_matching(self, simplicial_complex, d, vectorized=True, **kwargs):
+        """
+        Generates the matching for the given simplicial complex as a Matching, without building couples of simplices.
+        If vectorized is True and the Coxeter graph has a vertex table (see vertex_table()), the matching is computed
+        for all simplices at once; otherwise every simplex goes through iter_matching().
+        """
+        vertices = simplicial_complex.vertices
+        if vectorized and len(kwargs) == 0 and not self.debug and vertices == range(vertices[0], vertices[0] + len(vertices)):
+            table = self.vertex_table(simplicial_complex.coxeter_graph, d)
+            if table is not None:
+                return self.table_matching(simplicial_complex, table)
         
-        matching = self.matching
-        self.matching = list(set(matching))
-        # print sorted(matching), len(matching)
-        # print sorted(self.matching), len(self.matching)
-        if self.debug:
-            print [x for x in self.matching if matching.count(x) != 2]
-        assert len(matching) == 2*len(self.matching)
+        toggle = [-1] * (1 << len(vertices))
+        for (high, low) in self.iter_matching(simplicial_complex, d, **kwargs):
+            toggle[high] = toggle[low] = (high ^ low).bit_length() - 1
+        return Matching(len(vertices), toggle)
+    
+    
+    def table_matching(self, simplicial_complex, table):
+        """
+        Returns the Matching given by a vertex table of the simplicial complex (whose vertices must be consecutive
+        integers), checking its consistency as in iter_matching().
+        """
+        vertices = simplicial_complex.vertices
+        mask = np.arange(1 << len(vertices), dtype=np.int64)
+        position = np.where(simplicial_complex.present & (table >= 0), table.astype(np.int64) - vertices[0], -1)
+        bit = np.int64(1) << np.maximum(position, 0)
+        
+        lower = (position >= 0) & (mask & bit == 0)
+        upper = (position >= 0) & (mask & bit != 0)
+        inconsistent = np.nonzero(position[mask[lower] | bit[lower]] != position[lower])[0]
+        if len(inconsistent) > 0:
+            low = mask[lower][inconsistent[0]]
+            raise AssertionError("Inconsistent matching for simplex %s and vertex %d" % (str(simplicial_complex.simplex(low)), table[low]))
+        assert np.count_nonzero(upper) == np.count_nonzero(lower)
+        
+        return Matching(len(vertices), position)
     
     
     ### Finite type ###
@@ -134,7 +313,7 @@ class MatchingGenerator:
             if first is not None and i-first == d-1:
                 v = i
                 break
-        
+            
             if first is None:
                 if i in s:
                     first = i
@@ -152,13 +331,28 @@ class MatchingGenerator:
         Vertices are considered to be labeled 1,2,...,n.
         The matching is restricted to the simplices sigma such that the vertices 1,...,f,n-g+1,...,n are in sigma.
         """
-        s = set(sigma)
-        
+        return self.spherical_A_vertex(n, d, simplex_mask(sigma), f=f, g=g)
+    
+    
+    def spherical_A_vertex(self, n, d, mask, f=0, g=0):
+        """
+        Bitmask version of generate_spherical_A_matching() (vertex i corresponds to the bit i-1), memoized by (n, d, f, g, mask) during iter_matching().
+        """
+        if self.vertex_memo is None:
+            return self.compute_spherical_A_vertex(n, d, mask, f, g)
+        key = ('A', n, d, f, g, mask)
+        if key not in self.vertex_memo:
+            self.vertex_memo[key] = self.compute_spherical_A_vertex(n, d, mask, f, g)
+        return self.vertex_memo[key]
+    
+    
+    def compute_spherical_A_vertex(self, n, d, mask, f, g):
         assert n >= 0
+        assert mask >> n == 0
         
         assert 0 <= f <= n and 0 <= g <= n
         
-        if any(i not in sigma for i in range(1, f+1)+range(n-g+1,n+1)):
+        if not contains_first(mask, f) or not contains_last(mask, n, g):
             # sigma does not contain 1,2,...,f, so it must not be considered
             return None
         
@@ -169,7 +363,7 @@ class MatchingGenerator:
         
         elif f >= d:
             # recursively generate the matching on the last n-d vertices
-            vertex = self.generate_spherical_A_matching(n-d, d, [i-d for i in sigma if i>=d+1], f=f-d, g=g)
+            vertex = self.spherical_A_vertex(n-d, d, mask >> d, f=f-d, g=g)
             if vertex is not None:
                 return vertex + d
             else:
@@ -177,7 +371,7 @@ class MatchingGenerator:
         
         elif g >= d:
             # recursively generate the matching on the first n-d vertices
-            vertex = self.generate_spherical_A_matching(n-d, d, [i for i in sigma if i<=n-d], f=f, g=g-d)
+            vertex = self.spherical_A_vertex(n-d, d, mask & low_mask(n-d), f=f, g=g-d)
             if vertex is not None:
                 return vertex
             else:
@@ -197,7 +391,7 @@ class MatchingGenerator:
         if n < d+g:
             # in this case I cannot continue recursively!
             # try to add/remove f+1
-            if all(i in s for i in xrange(f+2, n+1)) and d-1 <= n <= d-1+f:
+            if mask >> (f+1) == low_mask(n-f-1) and d-1 <= n <= d-1+f:
                 # this is the only case that goes wrong (we have two critical cells)
                 return None
             else:
@@ -207,32 +401,32 @@ class MatchingGenerator:
         assert n >= d+g
         
         # find the size of the connected component of 1
-        k = min(i for i in xrange(1, n+2) if i not in s) - 1
+        k = trailing_vertices(mask)
         
         if k >= d-1:
             # long component
             
-            if d in sigma and d <= n-g:
+            if mask & vertex_bit(d) and d <= n-g:
                 # remove d (the condition d <= n-g is now automatically verified)
                 return d
             
-            if d not in sigma and d <= n:
+            if not mask & vertex_bit(d) and d <= n:
                 # add d
                 return d
         
         else:
             # short component
             
-            if f+1 in s:
+            if mask & vertex_bit(f+1):
                 # remove f+1
                 assert f+1 <= n-g
                 return f+1
             
             else:
-                if all(i in s for i in xrange(f+2, d)):
+                if contains_first(mask >> (f+1), d-2-f):
                     # I cannot add f+1 because I would created a too big component
                     # an A_{n-f-1} remains, with f=d-2-f
-                    vertex = self.generate_spherical_A_matching(n-f-1, d, [i-f-1 for i in sigma if i>f+1], f=d-2-f, g=g)
+                    vertex = self.spherical_A_vertex(n-f-1, d, mask >> (f+1), f=d-2-f, g=g)
                     return vertex + f + 1 if vertex is not None else None
                 
                 else:
@@ -247,12 +441,28 @@ class MatchingGenerator:
         The special edge with m=4 is (1,2).
         The matching is restricted to the simplices sigma such that the vertices n-g+1,...,n are in sigma (this works only for d even).
         """
+        return self.spherical_B_vertex(n, d, simplex_mask(sigma), g=g)
+    
+    
+    def spherical_B_vertex(self, n, d, mask, g=0):
+        """
+        Bitmask version of generate_spherical_B_matching(), memoized by (n, d, f=0, g, mask) during iter_matching().
+        """
+        if self.vertex_memo is None:
+            return self.compute_spherical_B_vertex(n, d, mask, g)
+        key = ('B', n, d, 0, g, mask)
+        if key not in self.vertex_memo:
+            self.vertex_memo[key] = self.compute_spherical_B_vertex(n, d, mask, g)
+        return self.vertex_memo[key]
+    
+    
+    def compute_spherical_B_vertex(self, n, d, mask, g):
         if n <= 1:
-            return self.generate_spherical_A_matching(n, d, sigma, g=g)
+            return self.spherical_A_vertex(n, d, mask, g=g)
         
-        s = set(sigma)
+        assert mask >> n == 0
         
-        if any(i not in sigma for i in xrange(n-g+1,n+1)):
+        if not contains_last(mask, n, g):
             # sigma does not contain 1,2,...,f, so it must not be considered
             assert d%2 == 0
             return None
@@ -263,12 +473,12 @@ class MatchingGenerator:
         
         else:
             # size of the B_k component
-            k = min(i-1 for i in xrange(1, n+1) if i not in s) if len(s) < n else n
+            k = trailing_vertices(mask)
             
             if d == 2:
                 # try to match with a cell with the same k
                 if k < n:
-                    vertex = self.generate_spherical_A_matching(n-k-1, d, [i-k-1 for i in sigma if i >= k+2], g=g)
+                    vertex = self.spherical_A_vertex(n-k-1, d, mask >> (k+1), g=g)
                     if vertex is not None:
                         return vertex + k + 1
             
@@ -296,12 +506,12 @@ class MatchingGenerator:
                         # vertex v does not exist
                         return None
                     
-                    elif all(i in s for i in xrange(q*(d/2)+2, (q+1)*(d/2)+1)):
+                    elif contains_first(mask >> v, d/2-1):
                         # there is a big component (length >= d/2-1) immediately after v,
                         # so I can't add v
                         # an A_{n-d/2-1} remains, with f=d/2-1 and g=g
-                        vertex = self.generate_spherical_A_matching(n-q*d/2-1, d, [i-q*d/2-1 for i in sigma if i>q*d/2+1], f=d/2-1, g=g)
-                        return vertex + q*d/2 + 1 if vertex is not None else None
+                        vertex = self.spherical_A_vertex(n-v, d, mask >> v, f=d/2-1, g=g)
+                        return vertex + v if vertex is not None else None
                     
                     else:
                         # add v
@@ -315,9 +525,25 @@ class MatchingGenerator:
         The edges are (1,3), (2,3), (3,4), (3,5), ...
         The matching is restricted to the simplices sigma such that the vertices n-g+1,...,n are in sigma (this works only for d even).
         """
-        s = set(sigma)
+        return self.spherical_D_vertex(n, d, simplex_mask(sigma), g=g)
+    
+    
+    def spherical_D_vertex(self, n, d, mask, g=0):
+        """
+        Bitmask version of generate_spherical_D_matching(), memoized by (n, d, f=0, g, mask) during iter_matching().
+        """
+        if self.vertex_memo is None:
+            return self.compute_spherical_D_vertex(n, d, mask, g)
+        key = ('D', n, d, 0, g, mask)
+        if key not in self.vertex_memo:
+            self.vertex_memo[key] = self.compute_spherical_D_vertex(n, d, mask, g)
+        return self.vertex_memo[key]
+    
+    
+    def compute_spherical_D_vertex(self, n, d, mask, g):
+        assert mask >> n == 0
         
-        if any(i not in sigma for i in xrange(n-g+1,n+1)):
+        if not contains_last(mask, n, g):
             # sigma does not contain n-g+1,...,n, so it must not be considered
             assert d%2 == 0
             return None
@@ -325,7 +551,7 @@ class MatchingGenerator:
         
         if n <= 1:
             # A_n
-            return self.generate_spherical_A_matching(n, d, sigma, g=g)
+            return self.spherical_A_vertex(n, d, mask, g=g)
         elif n == 2:
             # two copies of A_1
             if d == 2 or g >= 2:
@@ -337,17 +563,16 @@ class MatchingGenerator:
         elif n == 3:
             # A_3
             if g != 1:
-                new_vertices = {1: 1, 2: 3, 3: 2}
-                new_vertices_inv = {i: j for (j,i) in new_vertices.iteritems()}
-                vertex = self.generate_spherical_A_matching(3, d, sorted([new_vertices_inv[i] for i in sigma]), g=g)
-                return new_vertices[vertex] if vertex is not None else None
+                # exchange the vertices 2 and 3
+                vertex = self.spherical_A_vertex(3, d, (mask & 1) | (mask & 2) << 1 | (mask & 4) >> 1, g=g)
+                return {1: 1, 2: 3, 3: 2}[vertex] if vertex is not None else None
             else:
                 assert g == 1
                 # for g=1, the fixed vertex of A_3 is the one in the middle!
                 # this case should be done separately
-                if 2 not in s and d != 3:
+                if not mask & vertex_bit(2) and d != 3:
                     return 1
-                elif 2 in s and d not in [2, 4]:
+                elif mask & vertex_bit(2) and d not in [2, 4]:
                     return 1
                 else:
                     return None
@@ -355,9 +580,9 @@ class MatchingGenerator:
         
         if d%2 == 1:
             # d odd
-            if not 1 in s:
+            if not mask & vertex_bit(1):
                 # 1 not in sigma
-                vertex = self.generate_spherical_A_matching(n-1, d, [i-1 for i in sigma])
+                vertex = self.spherical_A_vertex(n-1, d, mask >> 1)
                 if vertex is not None:
                     return vertex + 1
             else:
@@ -365,22 +590,22 @@ class MatchingGenerator:
                 return 2
         
         else:
-            if 2 not in s:
+            if not mask & vertex_bit(2):
                 # this case is in common between d=2 and d>=4
-                # a A_{n-1} remains
-                new_vertices = {i: n+1-i for i in xrange(1,n-1)}
-                new_vertices[n-1] = 1
-                new_vertices_inv = {i: j for (j,i) in new_vertices.iteritems()}
-                vertex = self.generate_spherical_A_matching(n-1, d, sorted([new_vertices_inv[i] for i in sigma]), f=g)
-                return new_vertices[vertex] if vertex is not None else None
+                # a A_{n-1} remains, where i becomes n+1-i (for i >= 3) and 1 becomes n-1
+                reversed_mask = reverse_mask(mask, n)
+                vertex = self.spherical_A_vertex(n-1, d, (reversed_mask & low_mask(n-2)) | (reversed_mask >> (n-1)) << (n-2), f=g)
+                if vertex is None:
+                    return None
+                return 1 if vertex == n-1 else n+1-vertex
             
-            elif d == 2 and any(i not in s for i in [1,2,3,4]):
-                if all(i in s for i in [1,2,4]):
-                    assert 3 not in s
-                    if 5 in s and 5 <= n-g:
+            elif d == 2 and not contains_first(mask, 4):
+                if contains(mask, [1,2,4]):
+                    assert not mask & vertex_bit(3)
+                    if mask & vertex_bit(5) and 5 <= n-g:
                         # remove 5
                         return 5
-                    elif 5 not in s and n >= 5:
+                    elif not mask & vertex_bit(5) and n >= 5:
                         # add 5
                         return 5
                     else:
@@ -388,37 +613,35 @@ class MatchingGenerator:
                 
                 else:
                     # 2 in sigma, at least one of 1, 4 not in sigma
-                    assert 2 in s
-                    assert any(i not in s for i in [1,4])
                     # try to add and remove 3
-                    if 3 in s and 3 <= n-g:
+                    if mask & vertex_bit(3) and 3 <= n-g:
                         # remove 3
                         return 3
-                    elif 3 not in s:
+                    elif not mask & vertex_bit(3):
                         # add 3
                         return 3
                     else:
                         return None
             
-            elif d >= 4 and 3 not in s:
+            elif d >= 4 and not mask & vertex_bit(3):
                 # perfect matching adding and removing 1
                 return 1
             
-            elif d >= 4 and 4 not in s:
+            elif d >= 4 and not mask & vertex_bit(4):
                 if d == 4:
                     # two A_{n-4} remain (depending on whether 1 is in sigma or not)
-                    vertex = self.generate_spherical_A_matching(n-4, d, sorted([n+1-i for i in s if i>4]), f=g)
+                    vertex = self.spherical_A_vertex(n-4, d, reverse_mask(mask & ~low_mask(4), n), f=g)
                     return n+1 - vertex if vertex is not None else None
                 else:
                     # perfect matching adding and removing 1
                     return 1
             
-            elif d >= 4 and 1 not in s:
-                assert 4 in s
+            elif d >= 4 and not mask & vertex_bit(1):
+                assert mask & vertex_bit(4)
                 
-                if all(i in s for i in xrange(2, d/2+2)):
+                if contains_first(mask >> 1, d/2):
                     # a A_{n-1} with g=max(d/2, 3) remains
-                    vertex = self.generate_spherical_A_matching(n-1, d, sorted([n+1-i for i in sigma]), f=g, g=max(d/2, 3))
+                    vertex = self.spherical_A_vertex(n-1, d, reverse_mask(mask, n), f=g, g=max(d/2, 3))
                     return n+1 - vertex if vertex is not None else None
                 else:
                     # add 1
@@ -427,8 +650,8 @@ class MatchingGenerator:
             
             else:
                 # this case is in common between d=2 and d>=4
-                assert all(i in s for i in [1,2,3,4])
-                k = min(i for i in xrange(1, n+1) if i not in s) - 1 if len(s) < n else n  # size of the D_k component on the left
+                assert contains_first(mask, 4)
+                k = trailing_vertices(mask)  # size of the D_k component on the left
                 
                 # euclidean division
                 q = k/(d/2)
@@ -442,7 +665,7 @@ class MatchingGenerator:
                 # find the vertex I want to add/remove, without changing the weight of the D_k component
                 v = q*d/2+1 if q%2==0 else q*d/2+2
                 
-                if v in s:
+                if mask & vertex_bit(v):
                     # simply remove v
                     if 2 <= v <= 4:
                         # removing 2,3,4 is dangerous, because there isn't anymore a D_k component!
@@ -460,16 +683,16 @@ class MatchingGenerator:
                         # the vertex v does not exist
                         return None
                     
-                    elif q%2 == 0 and all(i in s for i in xrange(q*d/2+2, (q+1)*d/2+2)):
+                    elif q%2 == 0 and contains_first(mask >> v, d/2):
                         # q is even, and there is a too big component
                         # an A_{n-q*d/2-1} remains, with g=d/2
-                        vertex = self.generate_spherical_A_matching(n-q*d/2-1, d, sorted([n+1-i for i in s if i>v]), f=g, g=d/2)
+                        vertex = self.spherical_A_vertex(n-v, d, reverse_mask(mask & ~low_mask(v), n), f=g, g=d/2)
                         return n+1 - vertex if vertex is not None else None
                     
-                    elif q%2 == 1 and all(i in s for i in xrange(q*d/2+3, (q+1)*d/2+1)):
+                    elif q%2 == 1 and contains_first(mask >> v, d/2-2):
                         # q is odd, and there is a too big component
                         # an A_{n-q*d/2-2} remains, with g=d/2-2
-                        vertex = self.generate_spherical_A_matching(n-q*d/2-2, d, sorted([n+1-i for i in s if i>v]), f=g, g=d/2-2)
+                        vertex = self.spherical_A_vertex(n-v, d, reverse_mask(mask & ~low_mask(v), n), f=g, g=d/2-2)
                         return n+1 - vertex if vertex is not None else None
                     
                     else:
@@ -545,7 +768,7 @@ class MatchingGenerator:
                 if len(sigma) == n:
                     # adding k we would obtain (0,1,...,n), impossible
                     return None
-            
+                
                 return k
     
     
@@ -787,3 +1010,290 @@ class MatchingGenerator:
                         return n+1 - vertex if vertex is not None else None
 
 
+    
+    
+    ### Critical simplices ###
+    
+    # The candidate generators below follow the recursion of the corresponding generators, and yield a small set of
+    # bitmasks (in the bit convention of the generator) which contains all the critical simplices among the ones
+    # considered (e.g. containing 1,...,f and n-g+1,...,n). Every branch leading to a recursive call contributes the
+    # candidates of the subproblem, and every branch returning None directly contributes the few simplices reaching it.
+    
+    def iter_critical_simplices(self, coxeter_graph, d):
+        """
+        Yields the couples (mask, w) where mask is the bitmask of a critical simplex of the matching for the given
+        Coxeter graph (in the bit convention of coxeter_graph), and w is the d-component of its weight.
+        Only the candidates produced by the recursion of the generator are checked, so the time is roughly
+        proportional to the number of critical simplices (the complex is never built).
+        """
+        category = coxeter_graph.category
+        type = coxeter_graph.type
+        n = coxeter_graph.n
+        
+        mask_vertex = self.mask_vertex_function(coxeter_graph)
+        if mask_vertex is not None:
+            vertex = lambda mask: mask_vertex(n, d, mask)
+            candidates = {'A': self.spherical_A_candidates, 'B': self.spherical_B_candidates, 'D': self.spherical_D_candidates}[type](n, d)
+        else:
+            generator = self.vertex_function(coxeter_graph)
+            vertex = lambda mask: generator(n, d, coxeter_graph.simplex(mask))
+            candidates = {'A': self.affine_A_candidates, 'B': self.affine_B_candidates, 'C': self.affine_C_candidates, 'D': self.affine_D_candidates}[type](n, d)
+        
+        # the top-dimensional simplex of an affine graph is not in the complex
+        missing = low_mask(coxeter_graph.size) if category == CoxeterGraph.AFFINE else None
+        
+        found = set()
+        for mask in candidates:
+            if mask in found or mask == missing or vertex(mask) is not None:
+                continue
+            found.add(mask)
+            yield (mask, coxeter_graph.weight(coxeter_graph.simplex(mask)).component(d))
+    
+    
+    def spherical_A_candidates(self, n, d, f=0, g=0):
+        """
+        Candidates for the critical simplices of spherical_A_vertex() containing 1,...,f and n-g+1,...,n.
+        """
+        if f > n or g > n:
+            return
+        
+        if f+g >= n:
+            yield low_mask(n)
+        
+        elif f >= d:
+            for mask in self.spherical_A_candidates(n-d, d, f-d, g):
+                yield mask << d | low_mask(d)
+        
+        elif g >= d:
+            for mask in self.spherical_A_candidates(n-d, d, f, g-d):
+                yield mask | low_mask(d) << (n-d)
+        
+        elif f == d-1 or g == d-1:
+            # perfect matching
+            return
+        
+        elif n < d+g:
+            # the only case with two critical cells
+            if d-1 <= n <= d-1+f:
+                mask = low_mask(n-f-1) << (f+1) | low_mask(f)
+                yield mask
+                yield mask | vertex_bit(f+1)
+        
+        elif d-2-f <= n-f-1:
+            # short component of 1, and f+1 cannot be added: an A_{n-f-1} remains, with f=d-2-f
+            for mask in self.spherical_A_candidates(n-f-1, d, d-2-f, g):
+                yield mask << (f+1) | low_mask(f)
+    
+    
+    def spherical_B_candidates(self, n, d, g=0):
+        """
+        Candidates for the critical simplices of spherical_B_vertex() containing n-g+1,...,n.
+        """
+        if n <= 1:
+            for mask in self.spherical_A_candidates(n, d, g=g):
+                yield mask
+            return
+        
+        if g > n or d%2 == 1:
+            return
+        
+        # the component B_k covers all the vertices
+        yield low_mask(n)
+        
+        # k is the size of the B_k component (k+1 must not be one of the last g vertices)
+        for k in xrange(0, n-g, 1 if d == 2 else d/2):
+            if d == 2:
+                # an A_{n-k-1} remains
+                for mask in self.spherical_A_candidates(n-k-1, d, g=g):
+                    yield low_mask(k) | mask << (k+1)
+            
+            elif d/2-1 <= n-k-1:
+                # k+1 cannot be added: an A_{n-k-1} remains, with f=d/2-1
+                for mask in self.spherical_A_candidates(n-k-1, d, f=d/2-1, g=g):
+                    yield low_mask(k) | mask << (k+1)
+    
+    
+    def spherical_D_candidates(self, n, d, g=0):
+        """
+        Candidates for the critical simplices of spherical_D_vertex() containing n-g+1,...,n.
+        """
+        if g > n:
+            return
+        
+        if n <= 3:
+            # small cases
+            for mask in xrange(1 << n):
+                if contains_last(mask, n, g):
+                    yield mask
+            return
+        
+        if d%2 == 1:
+            # 1 not in sigma: an A_{n-1} remains
+            for mask in self.spherical_A_candidates(n-1, d):
+                yield mask << 1
+            return
+        
+        if g <= n-2:
+            # 2 not in sigma: an A_{n-1} remains, where i becomes n+1-i (for i >= 3) and 1 becomes n-1
+            for mask in self.spherical_A_candidates(n-1, d, f=g):
+                yield reverse_mask(mask & low_mask(n-2), n) | mask >> (n-2)
+        
+        if d == 2:
+            # sigma = (1,2,4,5,...,n) or (2,3,...,n)
+            yield low_mask(n) & ~vertex_bit(3)
+            yield low_mask(n) & ~vertex_bit(1)
+        
+        else:
+            if d == 4 and g <= n-4:
+                # 2,3 in sigma, 4 not in sigma: two A_{n-4} remain
+                for mask in self.spherical_A_candidates(n-4, d, f=g):
+                    yield reverse_mask(mask, n) | 0b110
+                    yield reverse_mask(mask, n) | 0b111
+            
+            h = max(d/2, 3)
+            if h <= n-1 and g <= n-1:
+                # 1 not in sigma, 2,...,h+1 in sigma: an A_{n-1} remains, with g=h
+                for mask in self.spherical_A_candidates(n-1, d, f=g, g=h):
+                    yield reverse_mask(mask, n)
+        
+        # D_n component
+        yield low_mask(n)
+        
+        # k is the size of the D_k component, and k+1 cannot be added
+        for k in xrange(4, n-g):
+            q = k/(d/2)
+            r = k - q*(d/2)
+            if q%2 == 1 and r == 0:
+                q -= 1
+            v = q*d/2+1 if q%2 == 0 else q*d/2+2
+            limit = d/2 if q%2 == 0 else d/2-2
+            
+            if v == k+1 and limit <= n-v:
+                # an A_{n-v} remains, with g=limit
+                for mask in self.spherical_A_candidates(n-v, d, f=g, g=limit):
+                    yield low_mask(k) | reverse_mask(mask, n)
+    
+    
+    def affine_A_candidates(self, n, d):
+        """
+        Candidates for the critical simplices of generate_affine_A_matching() (vertex i corresponds to the bit i).
+        """
+        # k is the first vertex not in sigma
+        for k in xrange(n+1):
+            for mask in self.spherical_A_candidates(n, d, f=k):
+                yield reduce(operator.or_, (1 << (k-j) % (n+1) for j in xrange(1, n+1) if mask & vertex_bit(j)), 0)
+    
+    
+    def affine_B_candidates(self, n, d):
+        """
+        Candidates for the critical simplices of generate_affine_B_matching() (vertex i corresponds to the bit i).
+        """
+        full = low_mask(n+1)
+        
+        # sigma = (1,2,...,n)
+        yield full & ~1
+        if d%2 == 1:
+            return
+        
+        # sigma = (0,1,...,n-1), (0,1,...,n-2,n), or the simplices with only one vertex missing
+        yield low_mask(n)
+        yield full & ~(1 << n-1)
+        yield full & ~(1 << n/(d/2)*(d/2))
+        if n >= d/2:
+            yield full & ~(1 << n-d/2) & ~(1 << n-1)
+        
+        # k is the first vertex not in sigma, and it cannot be added: a D_{n-k} remains, with g=d/2-1
+        for k in xrange(0, n, d/2):
+            for mask in self.spherical_D_candidates(n-k, d, g=d/2-1):
+                yield low_mask(k) | reverse_mask(mask, n-k) << (k+1)
+    
+    
+    def affine_C_candidates(self, n, d):
+        """
+        Candidates for the critical simplices of generate_affine_C_matching() (vertex i corresponds to the bit i).
+        """
+        full = low_mask(n+1)
+        
+        if d%2 == 1:
+            # sigma = (1,2,...,n)
+            yield full & ~1
+            return
+        
+        # k is the last vertex not in sigma: a B_k (or an A_k) remains on the left
+        for k in xrange(n+1):
+            candidates = self.spherical_B_candidates(k, d) if k >= 2 else self.spherical_A_candidates(k, d)
+            for mask in candidates:
+                yield mask | full & ~low_mask(k+1)
+    
+    
+    def affine_D_candidates(self, n, d):
+        """
+        Candidates for the critical simplices of generate_affine_D_matching() (vertex i corresponds to the bit i).
+        """
+        full = low_mask(n+1)
+        
+        if d%2 == 0 and n == 4 and d <= 6:
+            # degenerate case
+            for mask in xrange(full):
+                yield mask
+            return
+        
+        # 1 not in sigma: a D_n remains, where i becomes n+1-i (for i < n) and n becomes 0
+        for mask in self.spherical_D_candidates(n, d):
+            yield reverse_mask(mask & low_mask(n-1), n-1) << 2 | mask >> (n-1)
+        
+        # sigma = (1,2,...,n)
+        yield full & ~1
+        if d%2 == 1:
+            return
+        
+        if d == 2:
+            # sigma = (0,1,3,5,...,n), (0,1,3,4,...,n) or (1,3,4,...,n)
+            yield full & ~0b10100
+            yield full & ~0b100
+            yield full & ~0b101
+        
+        else:
+            # 0 not in sigma, and 1,...,d/2 in sigma: a D_n remains, with g=d/2
+            for mask in self.spherical_D_candidates(n, d, g=d/2):
+                yield reverse_mask(mask, n) << 1
+            
+            # sigma = (1,2,...,n-2,n)
+            yield full & ~1 & ~(1 << n-1)
+            
+            if d == 4:
+                # 3 not in sigma: a D_{n-3} remains
+                for mask in self.spherical_D_candidates(n-3, d):
+                    yield 0b111 | reverse_mask(mask, n-3) << 4
+        
+        # sigma = (0,1,...,n-2), (0,1,...,n-2,n) or (0,1,...,n-1)
+        yield low_mask(n-1)
+        yield full & ~(1 << n-1)
+        yield low_mask(n)
+        
+        # k is the size of the D_k component on the left
+        for k in xrange(4, n):
+            q = k/(d/2)
+            r = k - q*(d/2)
+            if q%2 == 1 and r == 0:
+                q -= 1
+                r = d/2
+            v = q*d/2 if q%2 == 0 else q*d/2+1
+            limit = d/2 if q%2 == 0 else d/2-2
+            
+            if d == 4 and q%2 == 1 and r == 1:
+                # a D_{n-k} remains
+                for mask in self.spherical_D_candidates(n-k, d):
+                    yield low_mask(k) | reverse_mask(mask, n-k) << (k+1)
+            
+            elif v == k:
+                # v cannot be added: a D_{n-v} remains, with g=limit
+                for mask in self.spherical_D_candidates(n-v, d, g=limit):
+                    yield low_mask(k) | reverse_mask(mask, n-v) << (v+1)
+                
+                if n-v-1 == limit:
+                    # the component after v is degenerate: sigma = (0,1,...,v-1,v+1,...,n-2,n)
+                    yield full & ~(1 << v) & ~(1 << n-1)
+                if n-v < limit:
+                    # the component after v is too short for the D_{n-v}: sigma = (0,1,...,v-1,v+1,...,n)
+                    yield full & ~(1 << v)
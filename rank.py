@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# coding=utf8
+
+import math
+
+import numpy as np
+
+from nzmath import matrix # http://tnt.math.se.tmu.ac.jp/nzmath/
+
+
+def is_prime(n):
+    """
+    Deterministic Miller-Rabin primality test (valid for n < 4759123141).
+    """
+    if n < 2:
+        return False
+    for p in [2, 3, 5, 7, 11, 13]:
+        if n % p == 0:
+            return n == p
+    
+    d = n-1
+    s = 0
+    while d % 2 == 0:
+        d /= 2
+        s += 1
+    
+    for a in [2, 7, 61]:
+        x = pow(a, d, n)
+        if x in [1, n-1]:
+            continue
+        for i in xrange(s-1):
+            x = x*x % n
+            if x == n-1:
+                break
+        else:
+            return False
+    return True
+
+
+def large_primes():
+    """
+    Generates the primes below 2^31, in decreasing order.
+    The product of two residues modulo these primes fits in a 64-bit integer.
+    """
+    n = 2**31 - 1
+    while n > 2:
+        if is_prime(n):
+            yield n
+        n -= 2
+
+
+def echelon_mod_p(m, p):
+    """
+    Reduces the SparseMatrix m modulo the prime p (with p < 2^31) to row echelon form, via Gaussian elimination on NumPy rows.
+    Returns the list of pivots (i,j), where i is the index of the pivot row in m.
+    The submatrix of m given by the pivot rows and columns is invertible modulo p.
+    """
+    a = np.zeros((m.row, m.column), dtype=np.int64)
+    for ((i,j), x) in m.iteritems():
+        a[i,j] = x % p
+    
+    rows, columns = a.shape
+    permutation = range(rows) # original index of the rows
+    pivots = []
+    for j in xrange(columns):
+        rank = len(pivots)
+        if rank == rows:
+            break
+        
+        # Search for a pivot in column j
+        nonzero = np.nonzero(a[rank:, j])[0]
+        if len(nonzero) == 0:
+            continue
+        i = rank + nonzero[0]
+        if i != rank:
+            a[[rank, i]] = a[[i, rank]]
+            permutation[rank], permutation[i] = permutation[i], permutation[rank]
+        
+        # Normalize the pivot row, and clear the column below it
+        a[rank, j:] = a[rank, j:] * pow(int(a[rank, j]), p-2, p) % p
+        below = rank + 1 + np.nonzero(a[rank+1:, j])[0]
+        if len(below) > 0:
+            a[below, j:] = (a[below, j:] - np.outer(a[below, j], a[rank, j:])) % p
+        
+        pivots.append((permutation[rank], j))
+    
+    return pivots
+
+
+def rank_mod_p(m, p):
+    """
+    Returns the rank of the SparseMatrix m modulo the prime p (with p < 2^31).
+    """
+    return len(echelon_mod_p(m, p))
+
+
+def determinant_mod_p(m, p):
+    """
+    Returns the determinant of the square SparseMatrix m modulo the prime p (with p < 2^31).
+    """
+    assert m.row == m.column
+    a = np.zeros((m.row, m.column), dtype=np.int64)
+    for ((i,j), x) in m.iteritems():
+        a[i,j] = x % p
+    
+    det = 1
+    for j in xrange(m.column):
+        nonzero = np.nonzero(a[j:, j])[0]
+        if len(nonzero) == 0:
+            return 0
+        i = j + nonzero[0]
+        if i != j:
+            a[[j, i]] = a[[i, j]]
+            det = -det
+        
+        x = int(a[j, j])
+        det = det * x % p
+        a[j, j:] = a[j, j:] * pow(x, p-2, p) % p
+        below = j + 1 + np.nonzero(a[j+1:, j])[0]
+        if len(below) > 0:
+            a[below, j:] = (a[below, j:] - np.outer(a[below, j], a[j, j:])) % p
+    
+    return det % p
+
+
+def determinant(m):
+    """
+    Returns the determinant of the square SparseMatrix m, computed modulo large primes and reconstructed with the
+    Chinese remainder theorem, using as many primes as needed to exceed twice the Hadamard bound.
+    """
+    assert m.row == m.column
+    if m.row == 0:
+        return 1
+    
+    bound = log_minor_bound(m, m.row)
+    if bound is None:
+        return 0
+    
+    det = 0
+    modulus = 1
+    for p in large_primes():
+        # combine det (mod modulus) with the determinant modulo p
+        x = determinant_mod_p(m, p)
+        t = (x - det) * pow(modulus % p, p-2, p) % p
+        det += modulus * t
+        modulus *= p
+        if math.log(modulus) > bound + math.log(2):
+            break
+    
+    # symmetric representative
+    return det if 2*det < modulus else det - modulus
+
+
+def log_minor_bound(m, k):
+    """
+    Returns the logarithm of an upper bound (Hadamard bound) for the absolute value of the k x k minors of the SparseMatrix m.
+    """
+    bounds = []
+    for lines in [m.columns(), m.rows()]:
+        norms = sorted((sum(x*x for x in line.itervalues()) for line in lines), reverse=True)[:k]
+        if len(norms) < k or norms[-1] == 0:
+            # All k x k minors are zero
+            return None
+        bounds.append(sum(math.log(x) for x in norms) / 2)
+    return min(bounds)
+
+
+def rational_rank(m):
+    """
+    Returns the rank over Q of the SparseMatrix m, computed with NZMATH (rational arithmetic).
+    """
+    b = m.to_nzmath() if (m.row > 0 and m.column > 0) else matrix.Matrix(row=1, column=1)
+    b.toFieldMatrix()
+    return b.rank()
+
+
+def rank(m, primes=None, num_primes=2, certify=True):
+    """
+    Returns the rank over Q of the SparseMatrix m, computed modulo large primes.
+    The ranks modulo the first num_primes primes must agree. If certify is True, more primes are used until their
+    product exceeds the Hadamard bound for the minors of size rank+1: this guarantees that the rank over Q is the same,
+    since the rank modulo p is at most the rank over Q, and drops only if p divides all those minors.
+    If the primes disagree (or there are not enough primes), the rank is computed over Q with NZMATH.
+    """
+    if m.nnz() == 0:
+        return 0
+    
+    if primes is None:
+        primes = large_primes()
+    
+    r = None
+    log_product = 0.0
+    for (i, p) in enumerate(primes):
+        s = rank_mod_p(m, p)
+        if r is not None and s != r:
+            # Some prime is unlucky
+            return rational_rank(m)
+        r = s
+        log_product += math.log(p)
+        
+        if i+1 >= num_primes:
+            bound = log_minor_bound(m, r+1)
+            if not certify or bound is None or log_product > bound:
+                return r
+    
+    return rational_rank(m)
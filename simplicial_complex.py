@@ -1,40 +1,160 @@
 #!/usr/bin/python
 # coding=utf8
 
-from itertools import combinations, chain, permutations
+from itertools import combinations, chain, permutations, izip
 import copy
+import operator
+
+import numpy as np
 
 from complex import Cell, Edge, Complex
 from coxeter_graph import CoxeterGraph
+from face_lattice import popcount, faces, face_lattice
+from implicit_complex import ImplicitComplex
+from array_complex import ArrayComplex
 
-from nzmath import matrix
+from matching import Matching
+from rank import rank, rational_rank
+from smith import torsion_coefficients
+
+
+class SimplexTable:
+    """
+    A table of values indexed by the simplices of a simplicial complex, stored in a list indexed by the bitmask of
+    the simplex (bit i corresponds to the i-th vertex). The simplices can be given either as bitmasks or as tuples
+    of vertices. Iteration is over the simplices present in the table, in the order of their bitmasks, and yields
+    sorted tuples of vertices.
+    """
+    
+    def __init__(self, vertices, values):
+        self.vertices = vertices
+        self.index = {v: i for (i, v) in enumerate(vertices)}
+        self.values = values # list of length 2^len(vertices), with None for missing simplices
+    
+    def mask(self, sigma):
+        """
+        Returns the bitmask of a simplex (given as an iterable of vertices, or already as a bitmask).
+        """
+        if isinstance(sigma, (int, long)):
+            return sigma
+        try:
+            return reduce(operator.or_, (1 << self.index[v] for v in sigma), 0)
+        except KeyError:
+            raise KeyError(sigma)
+    
+    def simplex(self, mask):
+        """
+        Returns the sorted tuple of vertices of the simplex with the given bitmask.
+        """
+        return tuple(v for (i, v) in enumerate(self.vertices) if mask >> i & 1)
+    
+    def __getitem__(self, sigma):
+        mask = self.mask(sigma)
+        x = self.values[mask] if 0 <= mask < len(self.values) else None
+        if x is None:
+            raise KeyError(sigma)
+        return x
+    
+    def __contains__(self, sigma):
+        try:
+            self[sigma]
+            return True
+        except KeyError:
+            return False
+    
+    def __len__(self):
+        return sum(1 for x in self.values if x is not None)
+    
+    def masks(self):
+        for (mask, x) in enumerate(self.values):
+            if x is not None:
+                yield mask
+    
+    def iterkeys(self):
+        for mask in self.masks():
+            yield self.simplex(mask)
+    
+    __iter__ = iterkeys
+    
+    def itervalues(self):
+        for x in self.values:
+            if x is not None:
+                yield x
+    
+    def iteritems(self):
+        for mask in self.masks():
+            yield (self.simplex(mask), self.values[mask])
+
+
+class OnDemandValues:
+    """
+    A read-only list of values indexed by bitmask, which are computed by value(mask) every time they are accessed
+    (to be used as the values of a SimplexTable, when storing all of them would take too much memory).
+    """
+    
+    def __init__(self, size, value):
+        self.size = size
+        self.value = value
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, mask):
+        if not 0 <= mask < self.size:
+            raise IndexError(mask)
+        return self.value(mask)
+    
+    def __iter__(self):
+        for mask in xrange(self.size):
+            yield self.value(mask)
 
 
 class Simplex:
-    def __init__(self, simplicial_complex, coxeter_graph, vertices):
+    def __init__(self, simplicial_complex, mask, vertices, weight):
         self.simplicial_complex = simplicial_complex
+        self.mask = mask
         self.vertices = vertices
-        self.weight = coxeter_graph.weight(vertices)
+        self.weight = weight
         
         self.up_arcs = []   # list of couples (arc, simplex)
         self.down_arcs = [] # list of couples (arc, simplex)
-        
-        self.matching_simplex = None
     
     
+    @property
+    def matching_simplex(self):
+        """
+        The simplex matched with this one (None if it is critical).
+        """
+        partner = self.simplicial_complex.matching.partner(self.mask)
+        return self.simplicial_complex.simplices[partner] if partner >= 0 else None
+    
     def is_matched(self):
         return self.matching is not None
     
     def dimension(self):
-        return len(self.vertices)
+        return popcount(self.mask)
     
     def __str__(self):
         return u'<Simplex %s, weight %s>' % (self.vertices.__str__(), self.weight.__str__())
 
 
 class SimplicialComplex:
-    def __init__(self, coxeter_graph):
+    """
+    The simplicial complex associated with a Coxeter graph.
+    Simplices are encoded as bitmasks over the vertices (bit i corresponds to self.vertices[i]), and the tables
+    self.simplices and self.cells are indexed by bitmask (see SimplexTable).
+    If implicit is True, no cells and edges are created: self.complex is an ImplicitComplex, which computes faces
+    from the bitmasks and stores the matching in an array (self.cells and self.edges are None). The Simplex objects
+    are not stored either: they are created when they are accessed, with their weights (see OnDemandValues).
+    If arrays is True, self.complex is an ArrayComplex built directly from the bitmasks (see ArrayComplex.from_lattice()),
+    and self.cells and self.edges are None as well.
+    """
+    
+    def __init__(self, coxeter_graph, implicit=False, arrays=False):
+        assert not (implicit and arrays)
         self.coxeter_graph = coxeter_graph
+        self.implicit = implicit
+        self.arrays = arrays
         self.size = coxeter_graph.size
         
         if self.coxeter_graph.category == CoxeterGraph.SPHERICAL:
@@ -50,85 +170,279 @@ class SimplicialComplex:
         else:
             raise Exception("Unknown graph category")
         
-        self.simplices = {sigma: Simplex(self, coxeter_graph, sigma) for sigma in chain.from_iterable(combinations(self.vertices,r) for r in xrange(dimension+1))}
+        # the bitmasks of the simplices are the same as in the Coxeter graph
+        assert self.vertices == coxeter_graph.vertex_list
+        self.lattice = face_lattice(self.vertices, dimension)
+        self.present = self.lattice.index >= 0 # simplices in the complex, by bitmask
         
-        # Create cells
-        self.cells = {vertices: Cell(simplex.dimension(), label=vertices) for (vertices, simplex) in self.simplices.iteritems()}
+        if implicit:
+            simplex = lambda mask: Simplex(self, mask, self.simplex(mask), coxeter_graph.weight(self.simplex(mask))) if self.present[mask] else None
+            self.simplices = SimplexTable(self.vertices, OnDemandValues(1 << len(self.vertices), simplex))
+        else:
+            weights = coxeter_graph.weight_table(dimension)
+            simplices = [None] * (1 << len(self.vertices))
+            for mask in self.lattice.masks.tolist():
+                simplices[mask] = Simplex(self, mask, self.simplex(mask), weights[mask])
+            self.simplices = SimplexTable(self.vertices, simplices)
         
-        # Create edges
-        self.edges = {}
-        for (vertices, simplex) in self.simplices.iteritems():
-            for (i,v) in enumerate(vertices):
-                # Remove vertex v
-                vertices2 = tuple([w for w in vertices if w != v])
-                simplex2 = self.simplices[vertices2]
-                
-                edge = Edge(self.cells[vertices], self.cells[vertices2], (-1)**i)
-                self.edges[vertices, vertices2] = edge
+        if implicit:
+            self.cells = None
+            self.edges = None
+            self.complex = ImplicitComplex(self.lattice)
+        
+        elif arrays:
+            self.cells = None
+            self.edges = None
+            self.complex = ArrayComplex.from_lattice(self.lattice)
         
-        # Create a complex
-        self.complex = Complex(self.cells.values(), self.edges.values())
+        else:
+            # Create cells and edges (the face structure is taken from the lattice)
+            cell_list, self.edges = self.lattice.create_cells()
+            cells = [None] * (1 << len(self.vertices))
+            for (mask, cell) in izip(self.lattice.masks.tolist(), cell_list):
+                cells[mask] = cell
+            self.cells = SimplexTable(self.vertices, cells)
+            
+            # Create a complex
+            self.complex = Complex(cell_list, self.edges)
         
-        self.matching = set()
+        self.matching = Matching(len(self.vertices))
         self.morse_complex = None
         self.is_matching_applied = False
     
     
+    def mask(self, sigma):
+        """
+        Returns the bitmask of a simplex, given as an iterable of vertices.
+        """
+        return self.simplices.mask(sigma)
+    
+    
+    def simplex(self, mask):
+        """
+        Returns the sorted tuple of vertices of the simplex with the given bitmask.
+        """
+        return tuple(v for (i, v) in enumerate(self.vertices) if mask >> i & 1)
+    
+    
+    def faces(self, mask):
+        """
+        Returns the list of the bitmasks of the facets of a simplex, obtained by removing its vertices in increasing order.
+        """
+        return faces(mask)
+    
+    
     def clear_matching(self):
-        for s in self.simplices.itervalues():
-            s.matching_simplex = None
-        
-        self.matching = set()
+        self.matching = Matching(len(self.vertices))
         self.is_matching_applied = False
+        if self.implicit or self.arrays:
+            self.complex.clear_matching()
+            return
+        
         for e in self.complex.edges:
             if e.is_in_matching:
                 e.remove_from_matching()
+        self.complex.clear_topological_orders()
     
     
     def add_to_matching(self, sigma, tau, d):
-        sigma = tuple(sorted(sigma))
-        tau = tuple(sorted(tau))
+        """
+        Add to the matching the couple of simplices (sigma, tau), given as iterables of vertices or as bitmasks.
+        """
+        sigma = self.mask(sigma)
+        tau = self.mask(tau)
         
         if self.simplices[sigma].weight.component(d) != self.simplices[tau].weight.component(d):
             raise Exception("Trying to match simplices with different weight: %s weight %d and %s weight %d" % (str(self.simplices[sigma].vertices), self.simplices[sigma].weight.component(d), str(self.simplices[tau].vertices), self.simplices[tau].weight.component(d)))
         
-        for x in permutations([self.simplices[sigma], self.simplices[tau]]):
-            assert x[0].matching_simplex is None
-            x[0].matching_simplex = x[1]
+        self.matching.add(sigma, tau)
+    
+    
+    def weight_components(self, d):
+        """
+        Returns the array of the d-components of the weights of the simplices, indexed by bitmask (0 for missing simplices).
+        """
+        return np.where(self.present, self.coxeter_graph.weight_components(d), 0)
+    
+    
+    def set_matching(self, matching, d=None):
+        """
+        Replace the matching with the given Matching, after checking that it is an involution between simplices of
+        the complex which differ by one vertex (and, if d is given, have the same d-weight).
+        """
+        for (invalid, description) in [(matching.invalid_involution(), "not an involution"), (matching.invalid_faces(self.present), "not in the complex")] + \
+                ([(matching.invalid_weights(self.weight_components(d)), "with different weight")] if d is not None else []):
+            if len(invalid) > 0:
+                raise Exception("Invalid matching: simplex %s is matched %s" % (str(self.simplex(int(invalid[0]))), description))
         
-        self.matching.add((sigma,tau))
+        self.clear_matching()
+        self.matching = matching
     
     
     def import_matching_from_complex(self, d):
-        for e in self.complex.edges:
-            if e.is_in_matching:
-                self.add_to_matching(e.high.label, e.low.label, d)
+        if self.implicit:
+            for (mask, partner) in enumerate(self.complex.partner):
+                if partner >= 0 and popcount(mask) > popcount(partner):
+                    self.add_to_matching(mask, partner, d)
+        elif self.arrays:
+            for k in self.complex.indptr.iterkeys():
+                for (high, low) in enumerate(self.complex.match_down[k].tolist()):
+                    if low >= 0:
+                        self.add_to_matching(int(self.complex.labels[k][high]), int(self.complex.labels[k-1][low]), d)
+        else:
+            for e in self.complex.edges:
+                if e.is_in_matching:
+                    self.add_to_matching(e.high.label, e.low.label, d)
         self.is_matching_applied = True
     
     
-    def apply_matching(self, debug=False):
+    def apply_matching(self, debug=False, acyclicity='incremental', matching=None, d=None, certificate=None):
         """
-        Apply matching to self.complex.
+        Apply matching to self.complex. If a Matching is given, it replaces the current matching (see set_matching()).
         If the matching is not acyclic, an exception is raised.
+        Acyclicity is checked after every edge, either by updating a dynamic topological order ('incremental')
+        or by a new DFS ('dfs'). With 'batch', all the edges are added first, and then the cells of
+        every couple of dimensions are sorted topologically once (suitable for matchings known in advance).
+        For an implicit complex or an ArrayComplex, acyclicity is always checked as in 'batch'.
+        With 'potential', the whole matching is checked at once by a vectorized Kahn sort of the arcs of the gradient
+        paths (see Matching.acyclicity_potential()), before the edges are added.
+        If a certificate is given (a potential computed elsewhere, e.g. stored with the matching, see
+        Matching.invalid_potential()) and it is valid, it replaces these checks: it is verified in one pass over the
+        arcs of the gradient paths.
         """
-        for e in self.complex.edges:
-            if (e.high.label, e.low.label) in self.matching:
+        if matching is not None:
+            self.set_matching(matching, d)
+        
+        if acyclicity == 'potential':
+            if self.matching.acyclicity_potential() is None:
+                raise Exception("Matching is not acyclic")
+            acyclicity = 'certified'
+        
+        if certificate is not None and len(self.matching.invalid_potential(certificate)) == 0:
+            # the matching is known to be acyclic
+            acyclicity = 'certified'
+        
+        if self.implicit:
+            return self.apply_implicit_matching(debug, certified=(acyclicity == 'certified'))
+        if self.arrays:
+            return self.apply_array_matching(debug, certified=(acyclicity == 'certified'))
+        
+        added = set() # dimensions of the added edges
+        for (sigma, tau) in self.matching.pairs():
+            low = self.cells[tau]
+            for e in self.cells[sigma].subcells:
+                if e.low is not low:
+                    continue
+                
                 # add cell to matching
                 e.add_to_matching()
-                if not self.complex.is_acyclic(e.low, e.high.d, print_cycle=debug):
+                added.add(e.high.d)
+                
+                if acyclicity in ['batch', 'certified']:
+                    continue
+                elif acyclicity == 'incremental':
+                    acyclic = self.complex.add_to_topological_order(e, print_cycle=debug)
+                elif acyclicity == 'dfs':
+                    acyclic = self.complex.is_acyclic(e.low, e.high.d, print_cycle=debug)
+                else:
+                    raise Exception("Unknown acyclicity check %s" % acyclicity)
+                
+                if not acyclic:
                     if debug:
                         print e.high, e.low
                     raise Exception("Matching is not acyclic")
+        
+        if acyclicity == 'batch':
+            for k in sorted(added):
+                order, cycle = self.complex.topological_sort(k)
+                if cycle is not None:
+                    if debug:
+                        for c in cycle:
+                            print c
+                    raise Exception("Matching is not acyclic: cycle " + " ".join(str(c.label) for c in cycle))
+        
         self.is_matching_applied = True
     
     
-    def compute_morse_complex(self):
+    def apply_implicit_matching(self, debug=False, certified=False):
         """
-        Compute the Morse complex.
+        Apply matching to the implicit complex, checking acyclicity with a topological sort (see apply_matching()),
+        unless it is certified.
+        """
+        invalid = self.matching.invalid_faces(self.present)
+        if len(invalid) > 0:
+            raise Exception("Invalid matching: simplex %s is matched not in the complex" % str(self.simplex(int(invalid[0]))))
+        
+        partners = self.matching.partners()
+        self.complex.set_partners(partners)
+        
+        # dimensions of the added couples (the simplices matched with a facet)
+        high = np.nonzero((partners >= 0) & (partners < np.arange(len(partners))))[0]
+        added = set(self.lattice.dimensions[self.lattice.index[high]].tolist())
+        
+        if certified:
+            added.clear()
+        
+        for k in sorted(added):
+            order, cycle = self.complex.topological_sort(k)
+            if cycle is not None:
+                if debug:
+                    for mask in cycle:
+                        print self.simplex(mask)
+                raise Exception("Matching is not acyclic: cycle " + " ".join(str(self.simplex(mask)) for mask in cycle))
+        
+        self.is_matching_applied = True
+    
+    
+    def apply_array_matching(self, debug=False, certified=False):
+        """
+        Apply matching to the ArrayComplex, checking acyclicity with a topological sort (see apply_matching()),
+        unless it is certified.
+        """
+        self.complex.clear_matching()
+        partners = self.matching.partners()
+        index = self.complex.cell_index
+        
+        added = set() # dimensions of the added couples
+        for k in sorted(self.complex.indptr.iterkeys()):
+            # k-dimensional simplices matched with a facet
+            masks = self.complex.labels[k]
+            high = np.nonzero((partners[masks] >= 0) & (partners[masks] < masks))[0]
+            low = index[partners[masks[high]]]
+            self.complex.match_down[k][high] = low
+            self.complex.match_up[k-1][low] = high
+            if len(high) > 0:
+                added.add(k)
+        
+        if certified:
+            added.clear()
+        
+        for k in sorted(added):
+            order, cycle = self.complex.topological_sort(k)
+            if cycle is not None:
+                n = self.complex.sizes[k]
+                labels = [self.simplex(int(self.complex.labels[k][v] if v < n else self.complex.labels[k-1][v-n])) for v in cycle]
+                if debug:
+                    for sigma in labels:
+                        print sigma
+                raise Exception("Matching is not acyclic: cycle " + " ".join(str(sigma) for sigma in labels))
+        
+        self.is_matching_applied = True
+    
+    
+    def compute_morse_complex(self, workers=1):
+        """
+        Compute the Morse complex (using the given number of worker processes, see Complex.morse_reduction();
+        for an implicit complex, see ImplicitComplex.morse_reduction(); for an ArrayComplex, see ArrayComplex.morse_reduction()).
         """
         if not self.is_matching_applied:
             self.apply_matching()
-        self.morse_complex = self.complex.morse_reduction()
+        if self.implicit:
+            self.morse_complex = self.complex.morse_reduction(label=self.simplex)
+        elif self.arrays:
+            self.morse_complex = self.complex.morse_reduction().to_complex(label=lambda mask: self.simplex(int(mask)))
+        else:
+            self.morse_complex = self.complex.morse_reduction(workers=workers)
     
     
     def is_matching_precise(self, d, debug=False):
@@ -152,41 +466,59 @@ class SimplicialComplex:
     
     
     def critical_simplices(self):
-        for s in self.simplices.itervalues():
-            if s.matching_simplex is None:
-                yield s
+        for mask in self.matching.critical().tolist():
+            if self.present[mask]:
+                yield self.simplices[mask]
     
     
-    def get_ranks(self):
+    def get_ranks(self, modular=True, iterated=False):
         """
         Returns the ranks over Q of the boundaries of the Morse complex, from the 1-dim to the top-dim.
+        By default the ranks are computed modulo large primes (see rank.rank()), otherwise with rational arithmetic.
+        If iterated is True, the Morse complex is first reduced further by matching its unit edges (see Complex.iterated_reduction()),
+        so that only the ranks of the remaining boundaries have to be computed.
         """
         assert self.morse_complex is not None
-        r, boundaries = self.morse_complex.get_boundaries()
+        if iterated:
+            reduced_complex, collapsed = self.morse_complex.iterated_reduction()
+            r, boundaries = reduced_complex.get_boundaries()
+        else:
+            collapsed = {}
+            r, boundaries = self.morse_complex.get_boundaries()
+        
         ranks = []
-
-        for k in sorted(boundaries.iterkeys()):
-            boundary = boundaries[k]
-            b = boundary.copy() if (boundary.row > 0 and boundary.column > 0) else matrix.Matrix(row=1, column=1)
-            b.toFieldMatrix()
-            ranks.append(b.rank())
+        for k in sorted(k for k in self.morse_complex.cells.iterkeys() if k-1 in self.morse_complex.cells):
+            ranks.append(collapsed.get(k, 0))
+            if k in boundaries:
+                boundary = boundaries[k]
+                ranks[-1] += rank(boundary) if modular else rational_rank(boundary)
         
         return ranks
+    
+    
+    def get_torsion(self):
+        """
+        Returns the torsion coefficients (invariant factors greater than 1) of the boundaries of the Morse complex over Z,
+        from the 1-dim to the top-dim. The torsion of the boundary of k-cells is the torsion of the (k-1)-th homology.
+        """
+        assert self.morse_complex is not None
+        r, boundaries = self.morse_complex.get_boundaries()
+        
+        torsion = []
+        for k in sorted(k for k in self.morse_complex.cells.iterkeys() if k-1 in self.morse_complex.cells):
+            torsion.append(torsion_coefficients(boundaries[k]) if k in boundaries else [])
+        
+        return torsion
         
     
     def relevant_d_values(self):
         """
-        Return list of relevant values for d.
+        Return list of relevant values for d (see CoxeterGraph.relevant_d_values()).
         """
-        relevant_d = set()
-        for simplex in self.simplices.itervalues():
-            for (d, w) in simplex.weight.w.iteritems():
-                if w >= 1:
-                    relevant_d.add(d)
-        return list(sorted(relevant_d))
+        return self.coxeter_graph.relevant_d_values()
     
     
-    def describe_matching(self, d, verbosity=0):
+    def describe_matching(self, d, verbosity=0, iterated=False):
         if verbosity >= 1:
             print "Critical simplices:"
             for s in self.critical_simplices():
@@ -202,7 +534,7 @@ class SimplicialComplex:
         
         if self.is_matching_precise(d):
             print "The matching is precise."
-            ranks = self.get_ranks()
+            ranks = self.get_ranks(iterated=iterated)
             print "Ranks (from 1-dim to %d-dim):" % len(ranks), ranks
         else:
             print "The matching is *not* precise."
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# coding=utf8
+
+from fractions import gcd
+
+from sparse_matrix import SparseMatrix
+from rank import rank, echelon_mod_p, determinant, large_primes
+
+
+def unit_elimination(m):
+    """
+    Eliminate the unit pivots (entries equal to 1 or -1) of the SparseMatrix m, with integer row operations.
+    Each elimination removes a row and a column and contributes an invariant factor equal to 1. Pivots are chosen
+    in sparse columns, to limit fill-in.
+    Returns the number of eliminated pivots, and the remaining rows and columns as a SparseMatrix.
+    """
+    rows = {i: r for (i, r) in enumerate(m.rows()) if len(r) > 0}
+    columns = {}
+    for (i, r) in rows.iteritems():
+        for j in r:
+            columns.setdefault(j, set()).add(i)
+    
+    count = 0
+    found = True
+    while found:
+        found = False
+        for i in sorted(rows.iterkeys()):
+            if i not in rows:
+                continue
+            
+            # Unit entry of row i in the sparsest column
+            units = [j for (j, x) in rows[i].iteritems() if x in [1, -1]]
+            if len(units) == 0:
+                continue
+            j = min(units, key=lambda j: (len(columns[j]), j))
+            
+            # Clear column j using row i
+            pivot_row = rows.pop(i)
+            x = pivot_row[j]
+            for h in columns.pop(j):
+                if h == i:
+                    continue
+                r = rows[h]
+                factor = r[j] * x
+                for (l, y) in pivot_row.iteritems():
+                    z = r.get(l, 0) - factor * y
+                    if z == 0:
+                        del r[l]
+                        if l != j:
+                            columns[l].discard(h)
+                    else:
+                        if l not in r:
+                            columns[l].add(h)
+                        r[l] = z
+                if len(r) == 0:
+                    del rows[h]
+            
+            # Remove row i (the rest of it can be cleared with column operations)
+            for l in pivot_row:
+                if l != j:
+                    columns[l].discard(i)
+            
+            count += 1
+            found = True
+    
+    # Renumber the remaining rows and columns
+    row_index = {i: a for (a, i) in enumerate(sorted(rows.iterkeys()))}
+    column_index = {j: b for (b, j) in enumerate(sorted(j for (j, c) in columns.iteritems() if len(c) > 0))}
+    residual = SparseMatrix(len(row_index), len(column_index))
+    for (i, r) in rows.iteritems():
+        for (j, x) in r.iteritems():
+            residual[row_index[i], column_index[j]] = x
+    
+    return count, residual
+
+
+def extended_gcd(a, b):
+    """
+    Returns (g, x, y) such that g = gcd(a,b) >= 0 and x*a + y*b = g.
+    """
+    x0, y0, x1, y1 = 1, 0, 0, 1
+    while b != 0:
+        q = a // b
+        a, b = b, a - q*b
+        x0, x1 = x1, x0 - q*x1
+        y0, y1 = y1, y0 - q*y1
+    if a < 0:
+        return -a, -x0, -y0
+    return a, x0, y0
+
+
+def diagonalize(rows, modulus):
+    """
+    Diagonalize the matrix given as a list of rows with unimodular row and column operations, keeping the entries
+    reduced modulo the given modulus. This is the same as diagonalizing the matrix extended with modulus * identity,
+    whose cokernel is the cokernel of the original matrix tensored with Z/modulus.
+    Returns the list of diagonal entries (up to associates in Z/modulus).
+    """
+    a = [[x % modulus for x in row] for row in rows]
+    m = len(a)
+    n = len(a[0]) if m > 0 else 0
+    diagonal = []
+    
+    for t in xrange(min(m, n)):
+        # Pivot: non-zero entry with the smallest gcd with the modulus
+        entries = [(gcd(a[i][j], modulus), i, j) for i in xrange(t, m) for j in xrange(t, n) if a[i][j] != 0]
+        if len(entries) == 0:
+            break
+        (g, i, j) = min(entries)
+        a[t], a[i] = a[i], a[t]
+        for row in a:
+            row[t], row[j] = row[j], row[t]
+        
+        while True:
+            # Clear column t with row operations
+            for i in xrange(t+1, m):
+                if a[i][t] == 0:
+                    continue
+                p, q = a[t][t], a[i][t]
+                if q % p == 0:
+                    c = q // p
+                    a[i] = [(v - c*u) % modulus for (u, v) in zip(a[t], a[i])]
+                else:
+                    (g, x, y) = extended_gcd(p, q)
+                    p, q = p // g, q // g
+                    row_t, row_i = a[t], a[i]
+                    a[t] = [(x*u + y*v) % modulus for (u, v) in zip(row_t, row_i)]
+                    a[i] = [(p*v - q*u) % modulus for (u, v) in zip(row_t, row_i)]
+            
+            # Clear row t with column operations
+            for j in xrange(t+1, n):
+                if a[t][j] == 0:
+                    continue
+                p, q = a[t][t], a[t][j]
+                if q % p == 0:
+                    c = q // p
+                    for row in a:
+                        row[j] = (row[j] - c*row[t]) % modulus
+                else:
+                    (g, x, y) = extended_gcd(p, q)
+                    p, q = p // g, q // g
+                    for row in a:
+                        u, v = row[t], row[j]
+                        row[t] = (x*u + y*v) % modulus
+                        row[j] = (p*v - q*u) % modulus
+            
+            if all(a[i][t] == 0 for i in xrange(t+1, m)):
+                break
+        
+        diagonal.append(a[t][t])
+    
+    return diagonal
+
+
+def divisibility_chain(factors):
+    """
+    Returns the invariant factors d_1 | d_2 | ... of the direct sum of the cyclic groups Z/f, for f in factors.
+    """
+    factors = list(factors)
+    for i in xrange(len(factors)):
+        for j in xrange(i+1, len(factors)):
+            g = gcd(factors[i], factors[j])
+            factors[i], factors[j] = g, factors[i] * factors[j] // g
+    return factors
+
+
+def invariant_factors(m):
+    """
+    Returns the non-zero invariant factors d_1 | d_2 | ... | d_r of the SparseMatrix m (i.e. the diagonal of its Smith
+    normal form), where r is the rank of m.
+    Unit pivots are eliminated first (see unit_elimination()). Then a non-zero r x r minor D of the residual matrix is
+    found and computed modulo large primes: every invariant factor of the residual divides D, so the residual can be
+    diagonalized modulo D, which bounds the size of its entries.
+    """
+    units, residual = unit_elimination(m)
+    r = rank(residual)
+    if r == 0:
+        return [1] * units
+    
+    # Non-zero r x r minor
+    for p in large_primes():
+        pivots = echelon_mod_p(residual, p)
+        if len(pivots) == r:
+            break
+    row_index = {i: a for (a, (i, j)) in enumerate(pivots)}
+    column_index = {j: b for (b, (i, j)) in enumerate(pivots)}
+    minor = SparseMatrix(r, r, {(row_index[i], column_index[j]): x for ((i,j), x) in residual.iteritems() if i in row_index and j in column_index})
+    D = abs(determinant(minor))
+    assert D > 0
+    
+    if D == 1:
+        return [1] * (units + r)
+    
+    # The cokernel of the residual tensored with Z/D is the sum of Z/gcd(d_i, D) = Z/d_i (for i <= r), and of Z/D
+    diagonal = diagonalize(residual.to_dense(), D)
+    factors = [gcd(x, D) for x in diagonal] + [D] * (residual.row - len(diagonal))
+    return [1] * units + divisibility_chain(factors)[:r]
+
+
+def torsion_coefficients(m):
+    """
+    Returns the invariant factors of the SparseMatrix m which are greater than 1 (the torsion coefficients of its cokernel).
+    """
+    return [x for x in invariant_factors(m) if x > 1]
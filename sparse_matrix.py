@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# coding=utf8
+
+from nzmath import matrix # http://tnt.math.se.tmu.ac.jp/nzmath/
+
+
+class SparseMatrix:
+    """
+    A sparse integer matrix with the given number of rows and columns, stored as a dictionary of keys (i,j) => entry.
+    Indices start from 0, and only non-zero entries are stored.
+    """
+    
+    def __init__(self, row, column, entries=None):
+        self.row = row
+        self.column = column
+        self.entries = {}
+        if entries is not None:
+            for (key, x) in entries.iteritems():
+                self[key] = x
+    
+    def __getitem__(self, key):
+        return self.entries.get(key, 0)
+    
+    def __setitem__(self, key, x):
+        (i,j) = key
+        assert 0 <= i < self.row and 0 <= j < self.column
+        if x == 0:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = x
+    
+    def __eq__(self, other):
+        return (self.row, self.column, self.entries) == (other.row, other.column, other.entries)
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __repr__(self):
+        return '<SparseMatrix %dx%d, %d non-zero entries>' % (self.row, self.column, len(self.entries))
+    
+    def iteritems(self):
+        """
+        Returns an iterable of tuples ((i,j), entry), for the non-zero entries.
+        """
+        return self.entries.iteritems()
+    
+    def nnz(self):
+        """
+        Returns the number of non-zero entries.
+        """
+        return len(self.entries)
+    
+    def columns(self):
+        """
+        Returns the list of columns, each one given as a dictionary i => entry.
+        """
+        columns = [{} for j in xrange(self.column)]
+        for ((i,j), x) in self.entries.iteritems():
+            columns[j][i] = x
+        return columns
+    
+    def rows(self):
+        """
+        Returns the list of rows, each one given as a dictionary j => entry.
+        """
+        rows = [{} for i in xrange(self.row)]
+        for ((i,j), x) in self.entries.iteritems():
+            rows[i][j] = x
+        return rows
+    
+    def transpose(self):
+        return SparseMatrix(self.column, self.row, {(j,i): x for ((i,j), x) in self.entries.iteritems()})
+    
+    def to_dense(self):
+        """
+        Returns the matrix as a list of rows.
+        """
+        rows = [[0] * self.column for i in xrange(self.row)]
+        for ((i,j), x) in self.entries.iteritems():
+            rows[i][j] = x
+        return rows
+    
+    def to_nzmath(self):
+        """
+        Returns the matrix as a (dense) NZMATH Matrix.
+        """
+        # NZMATH requires at least one row and one column at creation
+        m = matrix.Matrix(row=max(self.row, 1), column=max(self.column, 1))
+        for ((i,j), x) in self.entries.iteritems():
+            m[i+1, j+1] = x
+        
+        if self.column == 0:
+            m.deleteColumn(1)
+        if self.row == 0:
+            m.deleteRow(1)
+        
+        return m
@@ -1,18 +1,38 @@
 #!/usr/bin/python
 # coding=utf8
 
-from matching_generator import MatchingGenerator, powerset
+from matching_generator import MatchingGenerator, powerset, simplex_mask, reverse_mask, trailing_vertices
 from coxeter_graph import *
 from coxeter_type import *
-from complex import Cell, Edge, Complex
+from complex import Cell, Edge, Complex, TopologicalOrder, topological_sort
 from simplicial_complex import SimplicialComplex
+from matching import Matching
+import matching_file
+from array_complex import ArrayComplex
+from sparse_matrix import SparseMatrix
+from rank import is_prime, rank_mod_p, rank, rational_rank, determinant
+from smith import unit_elimination, invariant_factors, torsion_coefficients
+import vertex_tables
+import face_lattice
 
 import unittest
+import os
+import glob
+import pickle
+import shutil
+import tempfile
+import numpy as np
 import fractions
+import math
+import gc
+import operator
 
 def phi(n):
     return sum(1 for k in xrange(1, n+1) if fractions.gcd(n, k) == 1)
 
+def binomial(n, k):
+    return math.factorial(n) / (math.factorial(k) * math.factorial(n-k))
+
 
 class TestCoxeterType(unittest.TestCase):
     
@@ -27,6 +47,20 @@ class TestCoxeterType(unittest.TestCase):
         self.assertEqual(w.component(8), 0)
     
     
+    def test_weight_vector(self):
+        w = Weight({2: 3, 3: 0, 5: 1})
+        self.assertEqual(w.v, (0, 0, 3, 0, 0, 1))
+        self.assertEqual(w.w, {2: 3, 5: 1})
+        self.assertEqual(Weight.from_vector([0, 0, 3, 0, 0, 1, 0, 0]), w)
+        self.assertEqual(w + Weight({3: 2}), Weight({2: 3, 3: 2, 5: 1}))
+        self.assertEqual(sum([w, w]), Weight({2: 6, 5: 2}))
+        self.assertEqual(Weight() + Weight(), Weight())
+        self.assertNotEqual(w, Weight())
+        
+        # weights of Coxeter types are computed once
+        self.assertIs(CoxeterType('E', 8).weight(), CoxeterType('E', 8).weight())
+    
+    
     def test_coxeter_type(self):
         t = CoxeterType('A', 5)
         self.assertEqual(t.weight(), Weight({2: 3, 3: 2, 4: 1, 5: 1, 6: 1}))
@@ -122,6 +156,58 @@ class TestCoxeterGraph(unittest.TestCase):
         self.assertEqual(components, [])
     
     
+    def test_connected_components(self):
+        graph = SphericalDCoxeterGraph(6)
+        mask = graph.mask((1,2,3,5,6))
+        self.assertEqual(graph.connected_components(mask), [graph.mask((1,2,3)), graph.mask((5,6))])
+        self.assertEqual(graph.connected_components(0), [])
+        
+        self.assertNotIn(mask, graph.components_cache)
+        components = graph.connected_components(mask, memo=True)
+        self.assertIs(graph.connected_components(mask, memo=True), components)
+        self.assertEqual(graph.find_connected_components((1,2,3,5,6), memo=True), [(1,2,3), (5,6)])
+        
+        # the weights of the maximal simplices and the critical simplices are computed without caching
+        graph = SphericalBCoxeterGraph(12)
+        graph.relevant_d_values()
+        list(MatchingGenerator().iter_critical_simplices(graph, 4))
+        self.assertEqual(graph.components_cache, {})
+    
+    
+    def test_type_table(self):
+        graph = AffineBCoxeterGraph(5)
+        self.assertEqual(graph.type_table[graph.mask((0,1,2))], CoxeterType('B', 3))
+        self.assertEqual(graph.type_table[graph.mask((2,3,4,5))], CoxeterType('D', 4))
+        self.assertEqual(graph.type_table[graph.mask((1,2))], CoxeterType('A', 2))
+        self.assertIsNone(graph.type_table[graph.mask((0,2))]) # not connected
+        self.assertIsNone(graph.type_table[graph.mask(range(6))]) # not spherical
+        self.assertEqual(sum(1 for t in graph.type_table if t is not None), 23)
+    
+    
+    def test_weight_table(self):
+        graphs = [SphericalACoxeterGraph(6), SphericalBCoxeterGraph(5), SphericalDCoxeterGraph(6), SphericalExceptionalCoxeterGraph('E', 8), SphericalExceptionalCoxeterGraph('H', 4),
+                  AffineBCoxeterGraph(5), AffineCCoxeterGraph(4), AffineDCoxeterGraph(5), AffineExceptionalCoxeterGraph('tE', 7), AffineExceptionalCoxeterGraph('tF', 4)]
+        for graph in graphs:
+            dimension = graph.size if graph.category == CoxeterGraph.SPHERICAL else graph.size-1
+            table = graph.weight_table(dimension)
+            for mask in xrange(1 << graph.size):
+                simplex = graph.simplex(mask)
+                self.assertEqual(graph.mask(simplex), mask)
+                if len(simplex) <= dimension:
+                    self.assertEqual(table[mask], graph.weight(simplex))
+                else:
+                    self.assertIsNone(table[mask])
+    
+    
+    def test_large_graph(self):
+        graph = SphericalDCoxeterGraph(30)
+        self.assertIsNone(graph.type_table)
+        self.assertEqual(graph.coxeter_type(graph.mask(range(1, 31))), CoxeterType('D', 30))
+        self.assertEqual(graph.weight((1,2,3,5,6)), CoxeterType('A', 3).weight() + CoxeterType('A', 2).weight())
+        self.assertEqual(graph.relevant_d_values(), range(2, 30) + range(30, 59, 2))
+        self.assertEqual(AffineACoxeterGraph(4).relevant_d_values(), range(2, 6))
+    
+    
     def test_spherical_A_graph(self):
         graph = SphericalACoxeterGraph(5)
         self.assertEqual(len(graph.vertices), 5)
@@ -652,6 +738,93 @@ class TestCoxeterGraph(unittest.TestCase):
         self.assertEqual(graph.weight(s), CoxeterType('A', 1).weight())
     
 
+class TestSparseMatrix(unittest.TestCase):
+    
+    def test_sparse_matrix(self):
+        m = SparseMatrix(2, 3, {(0,0): 1, (1,2): -2, (0,1): 0})
+        self.assertEqual(m.nnz(), 2)
+        self.assertEqual(m[1,2], -2)
+        self.assertEqual(m[1,1], 0)
+        self.assertEqual(m.to_dense(), [[1,0,0], [0,0,-2]])
+        self.assertEqual(m.columns(), [{0: 1}, {}, {1: -2}])
+        self.assertEqual(m.transpose().to_dense(), [[1,0], [0,0], [0,-2]])
+        
+        m[1,2] = 0
+        self.assertEqual(m.nnz(), 1)
+        
+        n = m.to_nzmath()
+        self.assertEqual((n.row, n.column), (2, 3))
+        self.assertEqual(n[1,1], 1)
+        
+        n = SparseMatrix(0, 3).to_nzmath()
+        self.assertEqual((n.row, n.column), (0, 3))
+
+
+class TestRank(unittest.TestCase):
+    
+    def test_is_prime(self):
+        self.assertEqual([n for n in xrange(30) if is_prime(n)], [2, 3, 5, 7, 11, 13, 17, 19, 23, 29])
+        self.assertTrue(is_prime(2147483647))
+        self.assertFalse(is_prime(2147483647*3))
+    
+    def test_rank_mod_p(self):
+        m = SparseMatrix(2, 2, {(0,0): 2, (0,1): 1, (1,0): 4, (1,1): 4})
+        self.assertEqual(rank_mod_p(m, 2), 1)
+        self.assertEqual(rank_mod_p(m, 3), 2)
+        self.assertEqual(rank(m), 2)
+        
+        # the primes disagree, so the rank is computed over Q
+        m = SparseMatrix(1, 1, {(0,0): 2})
+        self.assertEqual(rank(m, primes=[2, 3]), 1)
+    
+    def test_boundary_ranks(self):
+        c = SimplicialComplex(SphericalACoxeterGraph(6))
+        r, boundaries = c.complex.get_boundaries()
+        for k in sorted(boundaries.iterkeys()):
+            # the boundaries of the full simplex are exact
+            self.assertEqual(rank(boundaries[k]), binomial(5, k-1))
+            self.assertEqual(rational_rank(boundaries[k]), binomial(5, k-1))
+    
+    def test_determinant(self):
+        m = SparseMatrix(3, 3, {(0,0): 2, (0,1): 1, (1,1): 3, (2,0): 7, (2,2): -5})
+        self.assertEqual(determinant(m), -30)
+        m = SparseMatrix(2, 2, {(0,0): 2**40, (1,1): 3**30})
+        self.assertEqual(determinant(m), 2**40 * 3**30)
+        m = SparseMatrix(2, 2, {(0,0): 1, (0,1): 2})
+        self.assertEqual(determinant(m), 0)
+
+
+class TestSmith(unittest.TestCase):
+    
+    def test_unit_elimination(self):
+        m = SparseMatrix(3, 3, {(0,0): 1, (0,1): 2, (1,0): 3, (1,1): 4, (2,2): 6})
+        count, residual = unit_elimination(m)
+        self.assertEqual(count, 1)
+        self.assertEqual(residual, SparseMatrix(2, 2, {(0,0): -2, (1,1): 6}))
+    
+    def test_invariant_factors(self):
+        self.assertEqual(invariant_factors(SparseMatrix(2, 2, {(0,0): 2, (1,1): 3})), [1, 6])
+        self.assertEqual(invariant_factors(SparseMatrix(2, 2, {(0,0): 2, (0,1): 4, (1,0): 6, (1,1): 8})), [2, 4])
+        self.assertEqual(invariant_factors(SparseMatrix(3, 2, {(0,0): 4, (1,0): 6, (2,1): 10})), [2, 10])
+        self.assertEqual(invariant_factors(SparseMatrix(2, 3, {(0,0): 2, (0,1): 2, (1,0): 2, (1,1): 2})), [2])
+        self.assertEqual(invariant_factors(SparseMatrix(2, 2)), [])
+        self.assertEqual(torsion_coefficients(SparseMatrix(2, 2, {(0,0): 1, (1,1): 12})), [12])
+    
+    def test_projective_plane(self):
+        # minimal CW structure of RP^2
+        cells = [Cell(0), Cell(1), Cell(2)]
+        edges = [Edge(cells[1], cells[0], 0), Edge(cells[2], cells[1], 2)]
+        C = Complex(cells, edges)
+        r, boundaries = C.get_boundaries()
+        self.assertEqual(torsion_coefficients(boundaries[1]), [])
+        self.assertEqual(torsion_coefficients(boundaries[2]), [2])
+    
+    def test_spherical_A_torsion(self):
+        c = SimplicialComplex(SphericalACoxeterGraph(6))
+        c.compute_morse_complex()
+        self.assertEqual(c.get_torsion(), [[]] * 6)
+
+
 class TestComplex(unittest.TestCase):
     
     def test_torus(self):
@@ -691,6 +864,138 @@ class TestComplex(unittest.TestCase):
         M = C.morse_reduction()
         self.assertEqual(M.d, -1)
         self.assertTrue(all(len(y) == 0 for y in M.cells.itervalues()))
+    
+    def test_boundaries(self):
+        # {1,2,3}
+        cells = {s: Cell(len(s)-1, label=s) for s in [(1,), (2,), (3,), (1,2), (1,3), (2,3)]}
+        edges = {(s,t): Edge(cells[s], cells[t], x) for (s,t,x) in [((1,2), (1,), -1), ((1,2), (2,), 1), ((1,3), (1,), -1), ((1,3), (3,), 1), ((2,3), (2,), -1), ((2,3), (3,), 1)]}
+        C = Complex(cells.values(), edges.values())
+        
+        ranks, boundaries = C.get_boundaries()
+        self.assertEqual(ranks, {0: 3, 1: 3})
+        delta = boundaries[1]
+        self.assertEqual((delta.row, delta.column, delta.nnz()), (3, 3, 6))
+        for ((s,t), e) in edges.iteritems():
+            self.assertEqual(delta[cells[t].id, cells[s].id], e.deg)
+        
+        ranks, dense_boundaries = C.get_boundaries(dense=True)
+        self.assertEqual(dense_boundaries[1], delta.to_nzmath())
+        self.assertEqual(dense_boundaries[1].row, 3)
+    
+    def test_long_gradient_path(self):
+        # a circle with N vertices, with a gradient path longer than the recursion limit
+        N = 5000
+        vertices = [Cell(0) for i in xrange(N)]
+        arcs = [Cell(1) for i in xrange(N)]
+        edges = [Edge(arcs[i], vertices[i], -1) for i in xrange(N)] + [Edge(arcs[i], vertices[(i+1)%N], 1) for i in xrange(N)]
+        C = Complex(vertices + arcs, edges)
+        
+        for i in xrange(N-1):
+            edges[N+i].add_to_matching()
+        self.assertTrue(C.is_acyclic(vertices[1], 1))
+        
+        for M in [C.morse_reduction(), C.morse_reduction(pairwise=True)]:
+            self.assertEqual(len(M.cells[0]), 1)
+            self.assertEqual(len(M.cells[1]), 1)
+            self.assertEqual(len(M.edges), 0)
+    
+    def test_topological_order(self):
+        arcs = {0: [1], 1: [], 2: [3], 3: []}
+        children = lambda v: arcs[v]
+        parents = lambda v: [u for u in arcs if v in arcs[u]]
+        order = TopologicalOrder([0,1,2,3], children, parents)
+        
+        arcs[3].append(0)
+        self.assertTrue(order.add_arc(3, 0))
+        self.assertTrue(all(order.ord[u] < order.ord[v] for u in arcs for v in arcs[u]))
+        
+        arcs[1].append(2)
+        self.assertFalse(order.add_arc(1, 2))
+    
+    def test_topological_sort(self):
+        arcs = {0: [1], 1: [2], 2: [3], 3: [], 4: [0]}
+        order, cycle = topological_sort(range(5), lambda v: arcs[v])
+        self.assertEqual(order, [4,0,1,2,3])
+        self.assertIsNone(cycle)
+        
+        arcs[3] = [0, 2]
+        order, cycle = topological_sort(range(5), lambda v: arcs[v])
+        self.assertEqual(order, [4])
+        self.assertEqual(cycle, [2,3])
+        
+        # the cycle found by the DFS is shrunk
+        arcs = {0: [1], 1: [2], 2: [3], 3: [4], 4: [5], 5: [0, 2]}
+        order, cycle = topological_sort(range(6), lambda v: arcs[v])
+        self.assertEqual(order, [])
+        self.assertEqual(cycle, [3,4,5,2])
+
+
+class TestArrayComplex(unittest.TestCase):
+    
+    def test_morse_reduction(self):
+        generator = MatchingGenerator()
+        for d in xrange(2, 11):
+            graph = SphericalDCoxeterGraph(6)
+            c = SimplicialComplex(graph)
+            generator.generate_matching(c, d)
+            
+            for (sigma, tau) in generator.matching:
+                c.add_to_matching(sigma, tau, d)
+            c.apply_matching()
+            
+            A = ArrayComplex.from_complex(c.complex)
+            self.assertTrue(all(A.is_acyclic(k) for k in A.indptr))
+            
+            M = c.complex.morse_reduction()
+            MA = A.morse_reduction()
+            self.assertEqual(MA.d, M.d)
+            self.assertEqual([(e.high.label, e.low.label, e.deg) for e in M.edges], [(MA.labels[k][i], MA.labels[k-1][j], x) for (k, i, j, x) in MA.edges()])
+            self.assertEqual(MA.get_boundaries()[0], M.get_boundaries()[0])
+    
+    def test_from_lattice(self):
+        for graph in [SphericalBCoxeterGraph(5), AffineACoxeterGraph(4)]:
+            c = SimplicialComplex(graph)
+            A = ArrayComplex.from_complex(c.complex)
+            B = ArrayComplex.from_lattice(c.lattice)
+            self.assertEqual(A.sizes, B.sizes)
+            self.assertEqual([(k, A.labels[k][i], A.labels[k-1][j], x) for (k, i, j, x) in A.edges()], [(k, c.simplex(B.labels[k][i]), c.simplex(B.labels[k-1][j]), x) for (k, i, j, x) in B.edges()])
+            self.assertEqual(B.cell_index[c.mask((1,3))], A.labels[2].index((1,3)))
+    
+    def test_simplicial_complex(self):
+        generator = MatchingGenerator()
+        for (graph, d) in [(SphericalDCoxeterGraph(6), 6), (AffineCCoxeterGraph(5), 3)]:
+            complexes = [SimplicialComplex(graph), SimplicialComplex(graph, arrays=True)]
+            matching = generator.generate_toggle_matching(complexes[0], d)
+            for c in complexes:
+                c.apply_matching(matching=matching, d=d)
+                c.compute_morse_complex()
+            
+            self.assertIsNone(complexes[1].edges)
+            M1, M2 = [c.morse_complex for c in complexes]
+            self.assertEqual([(e.high.label, e.low.label, e.deg) for e in M1.edges], [(e.high.label, e.low.label, e.deg) for e in M2.edges])
+            self.assertEqual(complexes[0].get_ranks(), complexes[1].get_ranks())
+            self.assertEqual(complexes[0].is_matching_precise(d), complexes[1].is_matching_precise(d))
+        
+        # (0,1) -> (0) -> (0,2) -> (2) -> (1,2) -> (1) -> (0,1)
+        c = SimplicialComplex(AffineACoxeterGraph(2), arrays=True)
+        for (sigma, tau) in [((0,1), (1,)), ((1,2), (2,)), ((0,2), (0,))]:
+            c.add_to_matching(sigma, tau, 2)
+        with self.assertRaises(Exception):
+            c.apply_matching()
+    
+    def test_cycle(self):
+        graph = SphericalACoxeterGraph(5)
+        c = SimplicialComplex(graph)
+        A = ArrayComplex.from_complex(c.complex)
+        index = {k: {label: i for (i, label) in enumerate(l)} for (k, l) in A.labels.iteritems()}
+        
+        for (sigma, tau) in [((1,3), (3,)), ((1,2,3), (1,2)), ((1,2,4), (2,4)), ((2,3,4), (2,3))]:
+            k = len(sigma)
+            self.assertTrue(A.is_acyclic(k))
+            A.add_to_matching(k, index[k][sigma], index[k-1][tau])
+        
+        self.assertFalse(A.is_acyclic(3))
+        self.assertIsNotNone(A.topological_sort(3)[1])
 
 
 class TestSimplicialComplex(unittest.TestCase):
@@ -715,6 +1020,96 @@ class TestSimplicialComplex(unittest.TestCase):
         c.apply_matching()
     
     
+    def test_bitmasks(self):
+        graph = AffineACoxeterGraph(3)
+        c = SimplicialComplex(graph)
+        
+        self.assertEqual(c.mask((0,2,3)), 13)
+        self.assertEqual(c.simplex(13), (0,2,3))
+        self.assertEqual(c.faces(13), [12, 9, 5])
+        self.assertIs(c.simplices[13], c.simplices[(0,2,3)])
+        self.assertEqual(c.simplices[13].dimension(), 3)
+        self.assertNotIn(15, c.simplices) # top-dimensional simplex
+        self.assertNotIn((1,4), c.simplices)
+        self.assertEqual(len(c.simplices), 15)
+        
+        # boundary of (0,2,3)
+        self.assertEqual(sorted((e.low.label, e.deg) for e in c.cells[(0,2,3)].subcells), [((0,2), 1), ((0,3), -1), ((2,3), 1)])
+    
+    
+    def test_face_lattice(self):
+        c1 = SimplicialComplex(SphericalBCoxeterGraph(5))
+        c2 = SimplicialComplex(SphericalDCoxeterGraph(5))
+        c3 = SimplicialComplex(AffineACoxeterGraph(4))
+        self.assertIs(c1.lattice, c2.lattice)
+        self.assertIsNot(c1.lattice, c3.lattice)
+        self.assertEqual(len(c1.lattice), 32)
+        self.assertEqual(len(c3.lattice), 31)
+        
+        # the cells are not shared
+        self.assertIsNot(c1.cells[(1,2)], c2.cells[(1,2)])
+        self.assertNotEqual(c1.simplices[(1,2)].weight, c2.simplices[(1,2)].weight)
+        self.assertEqual(len(c1.edges), 5 * 2**4)
+        
+        # the lattice is released with the last complex using it
+        key = (tuple(c3.vertices), 4)
+        self.assertIn(key, face_lattice._face_lattices)
+        del c3
+        gc.collect()
+        self.assertNotIn(key, face_lattice._face_lattices)
+    
+    
+    def test_implicit_complex(self):
+        generator = MatchingGenerator()
+        for (graph, d) in [(SphericalBCoxeterGraph(6), 4), (SphericalDCoxeterGraph(6), 6), (AffineCCoxeterGraph(5), 3), (AffineACoxeterGraph(5), 2)]:
+            complexes = [SimplicialComplex(graph), SimplicialComplex(graph, implicit=True)]
+            generator.generate_matching(complexes[0], d)
+            for c in complexes:
+                for (sigma, tau) in generator.matching:
+                    c.add_to_matching(sigma, tau, d)
+                c.compute_morse_complex()
+            
+            self.assertIsNone(complexes[1].edges)
+            M1, M2 = [c.morse_complex for c in complexes]
+            self.assertEqual([(e.high.label, e.low.label, e.deg) for e in M1.edges], [(e.high.label, e.low.label, e.deg) for e in M2.edges])
+            self.assertEqual(complexes[0].get_ranks(), complexes[1].get_ranks())
+            self.assertEqual(complexes[0].is_matching_precise(d), complexes[1].is_matching_precise(d))
+    
+    
+    def test_implicit_simplices(self):
+        generator = MatchingGenerator()
+        for (graph, d) in [(SphericalDCoxeterGraph(7), 4), (AffineBCoxeterGraph(5), 6), (AffineDCoxeterGraph(6), 4)]:
+            complexes = [SimplicialComplex(graph), SimplicialComplex(graph, implicit=True)]
+            
+            # the simplices of the implicit complex are created on demand
+            c = complexes[1]
+            self.assertIsNot(c.simplices[(1,2)], c.simplices[(1,2)])
+            self.assertEqual(len(c.simplices), len(complexes[0].simplices))
+            for (sigma, s) in complexes[0].simplices.iteritems():
+                self.assertEqual(c.simplices[sigma].weight, s.weight)
+            self.assertEqual(list(c.weight_components(d)), list(complexes[0].weight_components(d)))
+            
+            matching = generator.generate_toggle_matching(complexes[0], d)
+            for c in complexes:
+                c.apply_matching(matching=matching, d=d)
+                c.compute_morse_complex()
+            self.assertEqual([s.vertices for s in complexes[0].critical_simplices()], [s.vertices for s in complexes[1].critical_simplices()])
+            self.assertEqual(complexes[0].get_ranks(), complexes[1].get_ranks())
+    
+    
+    def test_implicit_cycle(self):
+        c = SimplicialComplex(SphericalACoxeterGraph(3), implicit=True)
+        self.assertEqual(sorted(c.complex.faces(c.mask((1,2,3)))), [(3, 1), (5, -1), (6, 1)])
+        self.assertEqual(sorted(c.complex.cofaces(c.mask((2,)))), [(3, 1), (6, -1)])
+        
+        # (0,1) -> (0) -> (0,2) -> (2) -> (1,2) -> (1) -> (0,1)
+        c = SimplicialComplex(AffineACoxeterGraph(2), implicit=True)
+        for (sigma, tau) in [((0,1), (1,)), ((1,2), (2,)), ((0,2), (0,))]:
+            c.add_to_matching(sigma, tau, 2)
+        with self.assertRaises(Exception):
+            c.apply_matching()
+    
+    
     def test_matching(self):
         graph = SphericalACoxeterGraph(3)
         c = SimplicialComplex(graph)
@@ -824,6 +1219,24 @@ class TestSimplicialComplex(unittest.TestCase):
         
         with self.assertRaises(Exception):
             c.apply_matching()
+        
+        c.clear_matching()
+        c.add_to_matching((1,3), (3,), d)
+        c.add_to_matching((1,2,3), (1,2), d)
+        c.add_to_matching((1,2,4), (2,4), d)
+        c.add_to_matching((2,3,4), (2,3), d)
+        
+        with self.assertRaises(Exception):
+            c.apply_matching(acyclicity='dfs')
+        
+        c.clear_matching()
+        c.add_to_matching((1,3), (3,), d)
+        c.add_to_matching((1,2,3), (1,2), d)
+        c.add_to_matching((1,2,4), (2,4), d)
+        c.add_to_matching((2,3,4), (2,3), d)
+        
+        with self.assertRaises(Exception):
+            c.apply_matching(acyclicity='batch')
     
     
     def test_ranks(self):
@@ -872,6 +1285,218 @@ class TestSimplicialComplex(unittest.TestCase):
         self.assertTrue(c.is_matching_precise(d))
         
         self.assertEqual(c.get_ranks(), [0,0,1])
+    
+    def test_iterated_ranks(self):
+        c = SimplicialComplex(SphericalACoxeterGraph(6))
+        c.compute_morse_complex()
+        self.assertEqual(c.get_ranks(iterated=True), [binomial(5, k-1) for k in xrange(1, 7)])
+        
+        reduced, collapsed = c.morse_complex.iterated_reduction()
+        self.assertEqual(sum(len(l) for l in reduced.cells.itervalues()), 0)
+        self.assertEqual(collapsed, {k: binomial(5, k-1) for k in xrange(1, 7)})
+        
+        generator = MatchingGenerator()
+        for d in xrange(2, 11):
+            c = SimplicialComplex(SphericalDCoxeterGraph(7))
+            generator.generate_matching(c, d)
+            
+            for (sigma, tau) in generator.matching:
+                c.add_to_matching(sigma, tau, d)
+            c.compute_morse_complex()
+            
+            self.assertEqual(c.get_ranks(iterated=True), c.get_ranks())
+    
+    def test_morse_reduction_single_sweep(self):
+        generator = MatchingGenerator()
+        for d in xrange(2, 11, 2):
+            graph = SphericalDCoxeterGraph(6)
+            c = SimplicialComplex(graph)
+            generator.generate_matching(c, d)
+            
+            for (sigma, tau) in generator.matching:
+                c.add_to_matching(sigma, tau, d)
+            c.apply_matching()
+            
+            M1 = c.complex.morse_reduction()
+            M2 = c.complex.morse_reduction(pairwise=True)
+            self.assertEqual([(e.high.label, e.low.label, e.deg) for e in M1.edges], [(e.high.label, e.low.label, e.deg) for e in M2.edges])
+    
+    def test_parallel_morse_reduction(self):
+        generator = MatchingGenerator()
+        c = SimplicialComplex(AffineCCoxeterGraph(5))
+        generator.generate_matching(c, 4)
+        for (sigma, tau) in generator.matching:
+            c.add_to_matching(sigma, tau, 4)
+        c.apply_matching()
+        
+        M1 = c.complex.morse_reduction()
+        M2 = c.complex.morse_reduction(workers=3)
+        self.assertEqual([(e.high.label, e.low.label, e.deg) for e in M1.edges], [(e.high.label, e.low.label, e.deg) for e in M2.edges])
+        self.assertEqual(dict((k, [x.label for x in l]) for (k, l) in M1.cells.iteritems()), dict((k, [x.label for x in l]) for (k, l) in M2.cells.iteritems()))
+    
+    def test_parallel_morse_reduction_failure(self):
+        import complex as complex_module
+        c = SimplicialComplex(AffineCCoxeterGraph(3))
+        c.apply_matching()
+        c.complex.cells[2][0].restricted_children = None # the DFS fails in a worker
+        with self.assertRaises(TypeError):
+            c.complex.morse_reduction(workers=2)
+        self.assertIsNone(complex_module._reduction_complex)
+
+
+class TestMatching(unittest.TestCase):
+    
+    def test_matching(self):
+        m = Matching.from_pairs(3, [(3, 1), (4, 6)])
+        self.assertEqual(list(m.toggle), [-1, 1, -1, 1, 1, -1, 1, -1])
+        self.assertEqual(m.pairs(), [(3, 1), (6, 4)])
+        self.assertEqual(len(m), 2)
+        self.assertEqual(m.partner(6), 4)
+        self.assertEqual(m.partner(0), -1)
+        self.assertEqual(m.critical().tolist(), [0, 2, 5, 7])
+        with self.assertRaises(AssertionError):
+            m.add(0, 3)
+    
+    def test_invalid_matching(self):
+        m = Matching(3, [-1, 1, -1, 1, 0, -1, -1, -1])
+        self.assertEqual(m.invalid_involution().tolist(), [4])
+        m = Matching(3, [-1, -1, -1, -1, -1, -1, 0, 0])
+        self.assertEqual(m.invalid_involution().tolist(), [])
+        self.assertEqual(m.invalid_faces(np.array([True] * 7 + [False])).tolist(), [6, 7])
+        self.assertEqual(m.invalid_weights(np.array([0, 0, 0, 0, 0, 0, 1, 1])).tolist(), [])
+        self.assertEqual(m.invalid_weights(np.array([0, 0, 0, 0, 0, 0, 1, 2])).tolist(), [6, 7])
+    
+    def test_potential(self):
+        # (0,1) -> (0) -> (0,2) -> (2) -> (1,2) -> (1) -> (0,1)
+        m = Matching.from_pairs(3, [(0b011, 0b010), (0b110, 0b100), (0b101, 0b001)])
+        self.assertEqual(sorted((int(s), int(r)) for (sigma, rho) in m.gradient_arcs() for (s, r) in zip(sigma, rho)), [(0b011, 0b101), (0b101, 0b110), (0b110, 0b011)])
+        self.assertEqual(m.invalid_potential(np.arange(8)).tolist(), [0b011, 0b101])
+        
+        m = Matching.from_pairs(3, [(0b011, 0b010), (0b101, 0b001)])
+        self.assertEqual(m.invalid_potential(np.array([0, 0, 0, 1, 0, 0, 0, 0])).tolist(), [])
+        self.assertEqual(m.invalid_potential(np.zeros(8, dtype=np.int64)).tolist(), [0b011])
+    
+    
+    def test_apply_matching(self):
+        generator = MatchingGenerator()
+        for (graph, d) in [(SphericalDCoxeterGraph(6), 4), (AffineBCoxeterGraph(5), 3)]:
+            c1 = SimplicialComplex(graph)
+            generator.generate_matching(c1, d)
+            for (sigma, tau) in generator.matching:
+                c1.add_to_matching(sigma, tau, d)
+            c1.compute_morse_complex()
+            
+            c2 = SimplicialComplex(graph)
+            matching = generator.generate_toggle_matching(c2, d)
+            self.assertEqual(sorted((c2.simplex(sigma), c2.simplex(tau)) for (sigma, tau) in matching.pairs()), sorted(generator.matching))
+            c2.apply_matching(matching=matching, d=d)
+            c2.compute_morse_complex()
+            
+            self.assertEqual([s.vertices for s in c1.critical_simplices()], [s.vertices for s in c2.critical_simplices()])
+            self.assertEqual([(e.high.label, e.low.label, e.deg) for e in c1.morse_complex.edges], [(e.high.label, e.low.label, e.deg) for e in c2.morse_complex.edges])
+            
+            # matched simplices must have the same weight
+            with self.assertRaises(Exception):
+                SimplicialComplex(graph).apply_matching(matching=matching, d=d+1)
+
+
+class TestMatchingFile(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_save_and_load(self):
+        generator = MatchingGenerator()
+        complex = SimplicialComplex(AffineBCoxeterGraph(5))
+        matching = generator.generate_toggle_matching(complex, 4)
+        certificate = matching.acyclicity_potential()
+        
+        filename = os.path.join(self.directory, 'tB_5_4.bin')
+        for compress in [False, True]:
+            matching_file.save_matching(filename, matching, 0, certificate, compress=compress)
+            (m, first_vertex, c) = matching_file.load_matching(filename)
+            self.assertEqual((m.n, first_vertex), (6, 0))
+            self.assertTrue(np.array_equal(m.toggle, matching.toggle))
+            self.assertTrue(np.array_equal(c, certificate))
+            
+            # the loaded matching can be modified
+            m.clear()
+            self.assertEqual(len(m), 0)
+        
+        matching_file.save_matching(filename, matching)
+        self.assertIsNone(matching_file.load_matching(filename)[2])
+        
+        with open(filename, 'wb') as f:
+            f.write('(lp0\n' * 4)
+        with self.assertRaises(Exception):
+            matching_file.load_matching(filename)
+    
+    def test_stored_matchings(self):
+        for filename in sorted(glob.glob(os.path.join('matchings', '*.p'))):
+            (m, first_vertex, certificate) = matching_file.load_matching(os.path.splitext(filename)[0] + matching_file.EXTENSION)
+            with open(filename, 'r') as f:
+                pairs = pickle.load(f)
+            mask = lambda sigma: reduce(operator.or_, (1 << (v - first_vertex) for v in sigma), 0)
+            self.assertEqual(m.pairs(), sorted((mask(sigma), mask(tau)) for (sigma, tau) in pairs))
+            self.assertEqual(m.invalid_potential(certificate).tolist(), [])
+    
+    def test_convert_pickle(self):
+        filename = os.path.join(self.directory, 'H_3_2.p')
+        shutil.copy(os.path.join('matchings', 'H_3_2.p'), filename)
+        self.assertEqual(matching_file.convert_pickle(filename, compress=True), os.path.join(self.directory, 'H_3_2.bin'))
+        (m, first_vertex, certificate) = matching_file.load_matching(os.path.join(self.directory, 'H_3_2.bin'))
+        self.assertEqual((m.n, first_vertex), (3, 1))
+        self.assertTrue(np.array_equal(m.toggle, matching_file.load_matching(os.path.join('matchings', 'H_3_2.bin'))[0].toggle))
+
+
+class TestVertexTables(unittest.TestCase):
+    
+    def test_bit_tables(self):
+        mask = np.array([0b0, 0b1011, 0b0111, 0b1111])
+        self.assertEqual(list(vertex_tables.trailing_ones(mask)), [0, 2, 3, 4])
+        self.assertEqual(list(vertex_tables.highest_zero(mask, 4)), [3, 2, 3, -1])
+        self.assertEqual(list(vertex_tables.reversed_masks(3)), [0b000, 0b100, 0b010, 0b110, 0b001, 0b101, 0b011, 0b111])
+        self.assertEqual(list(vertex_tables.popcounts(3)), [0, 1, 1, 2, 1, 2, 2, 3])
+    
+    
+    def test_vectorized_matching(self):
+        generator = MatchingGenerator()
+        for graph in [SphericalACoxeterGraph(7), SphericalBCoxeterGraph(7), SphericalDCoxeterGraph(9),
+                      AffineACoxeterGraph(6), AffineBCoxeterGraph(6), AffineCCoxeterGraph(8), AffineDCoxeterGraph(6), AffineDCoxeterGraph(4)]:
+            complex = SimplicialComplex(graph)
+            for d in xrange(2, 11):
+                matching = generator.generate_toggle_matching(complex, d, vectorized=False)
+                self.assertTrue(np.array_equal(generator.generate_toggle_matching(complex, d).toggle, matching.toggle))
+    
+    
+    def test_memo(self):
+        self.assertEqual(vertex_tables.spherical_D_table(8, 4).dtype, np.int8)
+        
+        # the sub-tables of a recursive computation are stored in memo, and reused
+        memo = {}
+        table = vertex_tables.spherical_A_table(9, 3, memo=memo)
+        self.assertIn(('A', 6, 3, 0, 0), memo)
+        self.assertIs(vertex_tables.spherical_A_table(9, 3, memo=memo), table)
+        self.assertIsNot(vertex_tables.spherical_A_table(9, 3), table)
+    
+    
+    def test_inconsistent_table(self):
+        generator = MatchingGenerator()
+        complex = SimplicialComplex(SphericalACoxeterGraph(3))
+        table = np.full(8, -1)
+        table[0b000] = 1
+        with self.assertRaises(AssertionError):
+            generator.table_matching(complex, table)
+        
+        table[0b001] = 1
+        self.assertEqual(generator.table_matching(complex, table).pairs(), [(0b001, 0b000)])
+        
+        table[0b011] = 2
+        with self.assertRaises(AssertionError):
+            generator.table_matching(complex, table)
 
 
 class TestMatchingGenerator(unittest.TestCase):
@@ -889,6 +1514,101 @@ class TestMatchingGenerator(unittest.TestCase):
         self.assertEqual(generator.matching, [((0,2,3), (0,3)), ((0,1,2,3), (0,2,3))])
     
     
+    def test_iter_matching(self):
+        generator = MatchingGenerator()
+        complex = SimplicialComplex(SphericalACoxeterGraph(4))
+        couples = list(generator.iter_matching(complex, 3))
+        self.assertEqual(len(couples), len(set(couples)))
+        generator.generate_matching(complex, 3)
+        self.assertEqual(sorted(generator.matching), sorted((complex.simplex(high), complex.simplex(low)) for (high, low) in couples))
+        
+        # the upper endpoint does not agree
+        generator.mask_vertex_function = lambda graph: None
+        generator.vertex_function = lambda graph: (lambda n, d, sigma: 1 if sigma == () else None)
+        with self.assertRaises(AssertionError):
+            list(generator.iter_matching(complex, 3))
+        
+        # the lower endpoint does not agree
+        generator.vertex_function = lambda graph: (lambda n, d, sigma: 1 if sigma == (1,) else None)
+        with self.assertRaises(AssertionError):
+            list(generator.iter_matching(complex, 3))
+    
+    
+    def test_bitmask_generators(self):
+        self.assertEqual(simplex_mask((1,3,4)), 0b1101)
+        self.assertEqual(reverse_mask(0b0011, 5), 0b11000)
+        self.assertEqual(trailing_vertices(0b1011), 2)
+        
+        generator = MatchingGenerator()
+        tuple_generator = MatchingGenerator()
+        tuple_generator.mask_vertex_function = lambda graph: None
+        for graph in [SphericalACoxeterGraph(7), SphericalBCoxeterGraph(7), SphericalDCoxeterGraph(7)]:
+            complex = SimplicialComplex(graph)
+            for d in xrange(2, 9):
+                self.assertEqual(list(generator.iter_matching(complex, d)), list(tuple_generator.iter_matching(complex, d)))
+        
+        # the memo is released after each matching
+        self.assertIsNone(generator.vertex_memo)
+        it = generator.iter_matching(complex, 4)
+        next(it)
+        self.assertGreater(len(generator.vertex_memo), 0)
+        it.close()
+        self.assertIsNone(generator.vertex_memo)
+    
+    
+    def test_iter_critical_simplices(self):
+        generator = MatchingGenerator()
+        for graph in [SphericalACoxeterGraph(8), SphericalBCoxeterGraph(8), SphericalDCoxeterGraph(8),
+                      AffineACoxeterGraph(7), AffineBCoxeterGraph(7), AffineCCoxeterGraph(7), AffineDCoxeterGraph(7), AffineDCoxeterGraph(4)]:
+            complex = SimplicialComplex(graph)
+            for d in xrange(2, 2*graph.size+1):
+                matching = generator.generate_toggle_matching(complex, d)
+                critical = [(mask, complex.simplices[mask].weight.component(d)) for mask in matching.critical().tolist() if complex.present[mask]]
+                self.assertEqual(sorted(generator.iter_critical_simplices(graph, d)), critical)
+        
+        # the complex of D_60 is never built
+        graph = SphericalDCoxeterGraph(60)
+        critical = dict(generator.iter_critical_simplices(graph, 6))
+        self.assertEqual(len(critical), 42)
+        self.assertEqual(critical[graph.mask(range(1, 61))], 20)
+        with self.assertRaises(NotImplementedError):
+            list(generator.iter_critical_simplices(SphericalExceptionalCoxeterGraph('E', 6), 2))
+    
+    
+    def test_acyclicity_potential(self):
+        generator = MatchingGenerator()
+        for graph in [SphericalACoxeterGraph(7), SphericalBCoxeterGraph(7), SphericalDCoxeterGraph(7),
+                      AffineACoxeterGraph(6), AffineBCoxeterGraph(6), AffineCCoxeterGraph(6), AffineDCoxeterGraph(6)]:
+            complex = SimplicialComplex(graph)
+            for d in xrange(2, 2*graph.size+1):
+                matching = generator.generate_toggle_matching(complex, d)
+                certificate = matching.acyclicity_potential()
+                self.assertEqual(matching.invalid_potential(certificate).tolist(), [])
+        
+        complex = SimplicialComplex(SphericalDCoxeterGraph(6))
+        matching = generator.generate_toggle_matching(complex, 4)
+        certificate = matching.acyclicity_potential()
+        complex.apply_matching(matching=matching, d=4, certificate=certificate)
+        self.assertEqual(complex.complex.orders, {})
+        complex.compute_morse_complex()
+        self.assertTrue(complex.is_matching_precise(4))
+        
+        # a cyclic matching has no certificate, and an invalid certificate is not used
+        cyclic = Matching.from_pairs(3, [(0b011, 0b010), (0b110, 0b100), (0b101, 0b001)])
+        self.assertIsNone(cyclic.acyclicity_potential())
+        for implicit in [False, True]:
+            complex = SimplicialComplex(AffineACoxeterGraph(2), implicit=implicit)
+            with self.assertRaises(Exception):
+                complex.apply_matching(matching=cyclic, certificate=np.arange(8))
+            with self.assertRaises(Exception):
+                complex.apply_matching(matching=cyclic, acyclicity='potential')
+        
+        # the same check inside apply_matching()
+        complex = SimplicialComplex(SphericalDCoxeterGraph(6))
+        complex.apply_matching(matching=matching, d=4, acyclicity='potential')
+        self.assertEqual(complex.complex.orders, {})
+    
+    
     def test_generate_spherical_A_matching(self):
         generator = MatchingGenerator()
         for n in xrange(1,9):
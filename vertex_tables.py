@@ -0,0 +1,552 @@
+#!/usr/bin/python
+# coding=utf8
+
+import numpy as np
+
+
+# A vertex table lists the vertex chosen by the matching generator (see MatchingGenerator.vertex_function()) for every
+# simplex at once, as a NumPy array indexed by bitmask (-1 if the simplex is critical). In the spherical case the
+# vertices are 1,2,...,n and the vertex i corresponds to the bit i-1; in the affine case the vertices are 0,1,...,n
+# and the vertex i corresponds to the bit i.
+# The tables are computed with array operations, following the branches of the corresponding generators.
+
+
+def all_masks(n):
+    return np.arange(1 << n, dtype=np.int64)
+
+
+def low_mask(k):
+    return (1 << k) - 1 if k > 0 else 0
+
+
+def first_run(mask, k):
+    """
+    Checks (elementwise) if the lowest k bits of mask are set (always true if k <= 0).
+    """
+    if k <= 0:
+        return np.ones(np.shape(mask), dtype=bool)
+    return mask & low_mask(k) == low_mask(k)
+
+
+def trailing_ones(mask):
+    """
+    Returns (elementwise) the number of trailing ones of mask.
+    """
+    return np.frexp(~mask & (mask + 1))[1].astype(np.int64) - 1
+
+
+def highest_zero(mask, n):
+    """
+    Returns (elementwise) the highest zero among the lowest n bits of mask (-1 if there is none).
+    """
+    return np.frexp(~mask & low_mask(n))[1].astype(np.int64) - 1
+
+
+def memoized(memo, key, compute):
+    """
+    Returns compute(memo), storing it in memo by key. The dictionary memo holds the tables computed during the
+    computation of one vertex table, which are looked up again by its recursive cases; if memo is None, a new
+    dictionary is used, so that only these sub-tables are stored (and they are discarded at the end).
+    """
+    if memo is None:
+        return compute({})
+    if key not in memo:
+        memo[key] = compute(memo)
+    return memo[key]
+
+
+def reversed_masks(n, memo=None):
+    """
+    Returns the table of the reversed bitmasks over n bits (the vertex i becomes n+1-i).
+    """
+    def compute(memo):
+        mask = all_masks(n)
+        reversed_mask = np.zeros_like(mask)
+        for i in xrange(n):
+            reversed_mask |= ((mask >> i) & 1) << (n-1-i)
+        return reversed_mask
+    return memoized(memo, ('reversed', n), compute)
+
+
+def popcounts(n, memo=None):
+    """
+    Returns the table of the number of ones of the bitmasks over n bits.
+    """
+    def compute(memo):
+        mask = all_masks(n)
+        count = np.zeros(len(mask), dtype=np.int8)
+        for i in xrange(n):
+            count += ((mask >> i) & 1).astype(np.int8)
+        return count
+    return memoized(memo, ('popcount', n), compute)
+
+
+def shift_vertices(vertex, offset):
+    return np.where(vertex >= 0, vertex + offset, -1)
+
+
+def mirror_vertices(vertex, n):
+    """
+    Relabels each vertex i as n+1-i.
+    """
+    return np.where(vertex >= 0, n+1 - vertex, -1)
+
+
+def relabel_vertices(vertex, labels):
+    """
+    Relabels each vertex i as labels[i].
+    """
+    return np.where(vertex >= 0, np.array(labels)[np.maximum(vertex, 0)], -1)
+
+
+def grouped(parameter, mask, lookup):
+    """
+    Returns the array of the values lookup(p, masks), where masks are the bitmasks with parameter p, for every value p of
+    the parameter (the sub-table of a recursive case usually depends on such a parameter).
+    """
+    values = np.empty(len(mask), dtype=np.int8)
+    for p in np.unique(parameter):
+        selection = parameter == p
+        values[selection] = lookup(int(p), mask[selection])
+    return values
+
+
+class Cases:
+    """
+    Fills a vertex table case by case, in the same order as the branches of the generator: each simplex takes the value
+    of the first case whose condition it satisfies (or -1 if there is none).
+    """
+    
+    def __init__(self, mask):
+        self.table = np.full(len(mask), -1, dtype=np.int8)
+        self.todo = np.ones(len(mask), dtype=bool)
+    
+    
+    def set(self, condition, value):
+        """
+        Sets the value of the remaining simplices which satisfy condition. The value is a constant, an array indexed by
+        bitmask, or a function which takes the boolean array of the selected simplices and returns their values (it is
+        called only if some simplex is selected, so that sub-tables are computed only when needed).
+        """
+        selection = self.todo & condition
+        self.todo &= ~selection
+        if callable(value):
+            if selection.any():
+                self.table[selection] = value(selection)
+        elif np.ndim(value) > 0:
+            self.table[selection] = value[selection]
+        else:
+            self.table[selection] = value
+    
+    
+    def remaining(self):
+        return self.todo
+
+
+
+# Vertex tables of the spherical types (the tables of the recursive cases are stored in memo, see memoized())
+
+def spherical_A_table(n, d, f=0, g=0, memo=None):
+    """
+    Vertex table of MatchingGenerator.generate_spherical_A_matching().
+    """
+    return memoized(memo, ('A', n, d, f, g), lambda memo: compute_spherical_A_table(n, d, f, g, memo))
+
+
+def compute_spherical_A_table(n, d, f, g, memo):
+    assert n >= 0
+    assert 0 <= f <= n and 0 <= g <= n
+    mask = all_masks(n)
+    cases = Cases(mask)
+    
+    # sigma must contain 1,...,f,n-g+1,...,n
+    cases.set(~(first_run(mask, f) & (mask >> (n-g) == low_mask(g))), -1)
+    
+    if f+g >= n:
+        # nothing can be done
+        pass
+    
+    elif f >= d:
+        # recursively generate the matching on the last n-d vertices
+        cases.set(True, lambda s: shift_vertices(spherical_A_table(n-d, d, f-d, g, memo=memo)[mask[s] >> d], d))
+    
+    elif g >= d:
+        # recursively generate the matching on the first n-d vertices
+        cases.set(True, lambda s: spherical_A_table(n-d, d, f, g-d, memo=memo)[mask[s] & low_mask(n-d)])
+    
+    elif f == d-1:
+        cases.set(True, d)
+    
+    elif g == d-1:
+        cases.set(True, n-d+1)
+    
+    elif n < d+g:
+        if d-1 <= n <= d-1+f:
+            # two critical cells
+            cases.set(mask >> (f+1) == low_mask(n-f-1), -1)
+        cases.set(True, f+1)
+    
+    else:
+        # size of the connected component of 1
+        k = trailing_ones(mask)
+        has_d = (mask >> (d-1)) & 1 == 1
+        
+        # long component
+        if d <= n-g:
+            cases.set((k >= d-1) & has_d, d)
+        cases.set((k >= d-1) & ~has_d, d)
+        cases.set(k >= d-1, -1)
+        
+        # short component
+        cases.set((mask >> f) & 1 == 1, f+1)
+        cases.set(first_run(mask >> (f+1), d-2-f), lambda s: shift_vertices(spherical_A_table(n-f-1, d, d-2-f, g, memo=memo)[mask[s] >> (f+1)], f+1))
+        cases.set(True, f+1)
+    
+    return cases.table
+
+
+def spherical_B_table(n, d, g=0, memo=None):
+    """
+    Vertex table of MatchingGenerator.generate_spherical_B_matching().
+    """
+    return memoized(memo, ('B', n, d, g), lambda memo: compute_spherical_B_table(n, d, g, memo))
+
+
+def compute_spherical_B_table(n, d, g, memo):
+    if n <= 1:
+        return spherical_A_table(n, d, g=g, memo=memo)
+    
+    assert g == 0 or d%2 == 0
+    mask = all_masks(n)
+    cases = Cases(mask)
+    
+    # sigma must contain n-g+1,...,n
+    if g > n:
+        return cases.table
+    cases.set(mask >> (n-g) != low_mask(g), -1)
+    
+    if d%2 == 1:
+        cases.set(True, 1)
+        return cases.table
+    
+    # size of the B_k component
+    k = trailing_ones(mask)
+    
+    if d == 2:
+        def lookup(k, m):
+            return shift_vertices(spherical_A_table(n-k-1, d, g=g, memo=memo)[m >> (k+1)], k+1)
+        cases.set(k < n, lambda s: grouped(k[s], mask[s], lookup))
+    
+    else:
+        h = d/2
+        q = k // h
+        r = k - q*h
+        v = q*h + 1
+        
+        if g > 0:
+            cases.set((r >= 1) & (v > n-g), -1)
+        cases.set(r >= 1, v)
+        cases.set(v > n, -1)
+        
+        # big component immediately after v
+        def lookup(v, m):
+            return shift_vertices(spherical_A_table(n-v, d, h-1, g, memo=memo)[m >> v], v)
+        cases.set(first_run(mask >> v, h-1), lambda s: grouped(v[s], mask[s], lookup))
+        cases.set(True, v)
+    
+    return cases.table
+
+
+def spherical_D_table(n, d, g=0, memo=None):
+    """
+    Vertex table of MatchingGenerator.generate_spherical_D_matching().
+    """
+    return memoized(memo, ('D', n, d, g), lambda memo: compute_spherical_D_table(n, d, g, memo))
+
+
+def compute_spherical_D_table(n, d, g, memo):
+    assert g == 0 or d%2 == 0
+    mask = all_masks(n)
+    cases = Cases(mask)
+    has = lambda i: (mask >> (i-1)) & 1 == 1
+    
+    # sigma must contain n-g+1,...,n
+    if g > n:
+        return cases.table
+    cases.set(mask >> (n-g) != low_mask(g), -1)
+    
+    if n <= 1:
+        cases.set(True, lambda s: spherical_A_table(n, d, g=g, memo=memo)[mask[s]])
+        return cases.table
+    
+    elif n == 2:
+        # two copies of A_1
+        if d != 2 and g < 2:
+            cases.set(True, 1)
+        return cases.table
+    
+    elif n == 3:
+        if g != 1:
+            # A_3, exchanging 2 and 3
+            swapped = (mask & 1) | (mask & 2) << 1 | (mask & 4) >> 1
+            cases.set(True, lambda s: relabel_vertices(spherical_A_table(3, d, g=g, memo=memo)[swapped[s]], [0, 1, 3, 2]))
+        else:
+            if d != 3:
+                cases.set(~has(2), 1)
+            if d not in [2, 4]:
+                cases.set(has(2), 1)
+        return cases.table
+    
+    if d%2 == 1:
+        cases.set(~has(1), lambda s: shift_vertices(spherical_A_table(n-1, d, memo=memo)[mask[s] >> 1], 1))
+        cases.set(True, 2)
+        return cases.table
+    
+    h = d/2
+    reversed_mask = reversed_masks(n, memo=memo)[mask]
+    
+    # 2 not in sigma: an A_{n-1} remains, where i becomes n+1-i (for i >= 3) and 1 becomes n-1
+    def lookup(s):
+        r = reversed_mask[s]
+        return relabel_vertices(spherical_A_table(n-1, d, f=g, memo=memo)[(r & low_mask(n-2)) | (r >> (n-1)) << (n-2)], [0] + range(n, 2, -1) + [1])
+    cases.set(~has(2), lookup)
+    
+    if d == 2:
+        not_1234 = ~first_run(mask, 4)
+        has_124 = not_1234 & has(1) & has(2) & has(4)
+        if 5 <= n-g:
+            cases.set(has_124 & has(5), 5)
+        if n >= 5:
+            cases.set(has_124 & ~has(5), 5)
+        cases.set(has_124, -1)
+        if 3 <= n-g:
+            cases.set(not_1234 & has(3), 3)
+        cases.set(not_1234 & ~has(3), 3)
+        cases.set(not_1234, -1)
+    
+    else:
+        cases.set(~has(3), 1)
+        if d == 4:
+            cases.set(~has(4), lambda s: mirror_vertices(spherical_A_table(n-4, d, f=g, memo=memo)[reversed_masks(n, memo=memo)[mask[s] & ~low_mask(4)]], n))
+        else:
+            cases.set(~has(4), 1)
+        cases.set(~has(1) & first_run(mask >> 1, h), lambda s: mirror_vertices(spherical_A_table(n-1, d, g, max(h, 3), memo=memo)[reversed_mask[s]], n))
+        cases.set(~has(1), 1)
+    
+    # 1,2,3,4 in sigma: size of the D_k component on the left
+    k = trailing_ones(mask)
+    q = k // h
+    r = k - q*h
+    q -= (q%2 == 1) & (r == 0)
+    v = np.where(q%2 == 0, q*h+1, q*h+2)
+    has_v = (mask >> (v-1)) & 1 == 1
+    
+    # removing 2,3,4 would not leave a D_k component (this does not happen)
+    assert not np.any(cases.remaining() & has_v & (2 <= v) & (v <= 4))
+    cases.set(has_v & (v > n-g), -1)
+    cases.set(has_v, v)
+    cases.set(v > n, -1)
+    
+    # too big component after v
+    def lookup(g_new):
+        return lambda v, m: mirror_vertices(spherical_A_table(n-v, d, g, g_new, memo=memo)[reversed_masks(n, memo=memo)[m & ~low_mask(v)]], n)
+    even = q%2 == 0
+    cases.set(even & first_run(mask >> v, h), lambda s: grouped(v[s], mask[s], lookup(h)))
+    cases.set(~even & first_run(mask >> v, h-2), lambda s: grouped(v[s], mask[s], lookup(h-2)))
+    cases.set(True, v)
+    
+    return cases.table
+
+
+
+# Vertex tables of the affine types
+
+def affine_table(type, n, d):
+    """
+    Vertex table of MatchingGenerator.generate_affine_*_matching(), for the given type ('A', 'B', 'C' or 'D').
+    """
+    compute = {'A': compute_affine_A_table, 'B': compute_affine_B_table, 'C': compute_affine_C_table, 'D': compute_affine_D_table}[type]
+    return compute(n, d, {})
+
+
+def compute_affine_A_table(n, d, memo):
+    mask = all_masks(n+1)
+    cases = Cases(mask)
+    cases.set(mask == low_mask(n+1), -1)
+    
+    # first vertex not in sigma: if we fix k, an A_n remains with k fixed vertices, where i becomes k-i (mod n+1)
+    k = trailing_ones(mask)
+    rotated = np.zeros_like(mask)
+    for i in xrange(n+1):
+        j = (k - i) % (n+1)
+        rotated |= np.where(j > 0, ((mask >> i) & 1) << np.maximum(j-1, 0), 0)
+    
+    def lookup(k, m):
+        vertex = spherical_A_table(n, d, f=k, memo=memo)[m]
+        return np.where(vertex >= 0, (k - vertex) % (n+1), -1)
+    cases.set(True, lambda s: grouped(k[s], rotated[s], lookup))
+    
+    return cases.table
+
+
+def compute_affine_B_table(n, d, memo):
+    mask = all_masks(n+1)
+    full = low_mask(n+1)
+    cases = Cases(mask)
+    has = lambda i: (mask >> i) & 1 == 1
+    cases.set(mask == full, -1)
+    
+    if d%2 == 1:
+        # almost perfect matching adding and removing 0
+        cases.set(mask != full-1, 0)
+        return cases.table
+    
+    # size of the B_k component (sigma=(0,1,...,n-2,n) has k=n)
+    h = d/2
+    k = trailing_ones(mask)
+    special_case = (k == n-1) & has(n)
+    k = np.where(special_case, n, k)
+    q = k // h
+    r = k - q*h
+    
+    # remove q*d/2
+    cases.set((r >= 1) & special_case & (q*h == n-1), -1)
+    cases.set(r >= 1, q*h)
+    
+    # cannot add k
+    def lookup(k, m):
+        return mirror_vertices(spherical_D_table(n-k, d, h-1, memo=memo)[reversed_masks(n-k, memo=memo)[m >> (k+1)]], n)
+    cases.set(first_run(mask >> (k+1), h-1), lambda s: grouped(k[s], mask[s], lookup))
+    
+    # add k
+    cases.set(first_run(mask >> (k+1), h-2) & ((mask >> (k+h)) & 1 == 1) & (k+h == n), -1)
+    cases.set(popcounts(n+1, memo=memo)[mask] == n, -1)
+    cases.set(True, k)
+    
+    return cases.table
+
+
+def compute_affine_C_table(n, d, memo):
+    mask = all_masks(n+1)
+    full = low_mask(n+1)
+    cases = Cases(mask)
+    cases.set(mask == full, -1)
+    
+    if d%2 == 1:
+        # almost perfect matching adding and removing 0
+        cases.set(mask != full-1, 0)
+        return cases.table
+    
+    # a B_k (or A_k, for k <= 1) remains on the left of the last vertex k not in sigma
+    def lookup(k, m):
+        table = spherical_B_table(k, d, memo=memo) if k >= 2 else spherical_A_table(k, d, memo=memo)
+        return shift_vertices(table[m & low_mask(k)], -1)
+    k = highest_zero(mask, n+1)
+    cases.set(True, lambda s: grouped(k[s], mask[s], lookup))
+    
+    return cases.table
+
+
+def compute_affine_D_table(n, d, memo):
+    mask = all_masks(n+1)
+    full = low_mask(n+1)
+    cases = Cases(mask)
+    has = lambda i: (mask >> i) & 1 == 1
+    size = popcounts(n+1, memo=memo)[mask]
+    cases.set(mask == full, -1)
+    
+    # 1 not in sigma: a D_n remains, where i becomes n+1-i (for i >= 2) and 0 becomes n
+    reversed_mask = reversed_masks(n+1, memo=memo)[mask]
+    def remaining_D(s):
+        r = reversed_mask[s]
+        return relabel_vertices(spherical_D_table(n, d, memo=memo)[(r & low_mask(n-1)) | (r >> n) << (n-1)], [0] + range(n, 1, -1) + [0])
+    
+    if d%2 == 1:
+        has_123 = has(1) & has(2) & has(3)
+        cases.set(has_123 & (mask >> 1 != low_mask(n)), 0)
+        cases.set(has_123, -1)
+        cases.set(~has(1), remaining_D)
+        cases.set(True, 0)
+        return cases.table
+    
+    if n == 4 and d <= 6:
+        # degenerate case
+        if d == 2:
+            cases.set((size == 1) & ~has(2), 2)
+            cases.set(size == 2, 2)
+            cases.set((size == 3) & has(2), 2)
+        elif d == 4:
+            cases.set(~has(2) | ~(has(1) | has(3) | has(4)), 0)
+        elif d == 6:
+            cases.set(has(2) & ~has(0) & (size >= 3), -1)
+            cases.set(has(2) & has(0) & (size == 4), -1)
+            cases.set(True, 0)
+        return cases.table
+    
+    h = d/2
+    cases.set(~has(1), remaining_D)
+    
+    if d == 2:
+        not_0123 = ~first_run(mask, 4)
+        has_013 = not_0123 & has(0) & has(1) & has(3)
+        cases.set(has_013 & ~first_run(mask >> 5, n-4), 4)
+        cases.set(has_013, -1)
+        cases.set(not_0123 & ((mask | 4) >> 1 != low_mask(n)), 2)
+        cases.set(not_0123, -1)
+    
+    else:
+        # 0 not in sigma
+        cases.set(~has(0) & first_run(mask >> 1, h), lambda s: mirror_vertices(spherical_D_table(n, d, h, memo=memo)[reversed_mask[s]], n))
+        if h+1 == n:
+            cases.set(~has(0) & first_run(mask >> 1, h-1) & has(n), -1)
+        cases.set(~has(0) & (size < n), 0)
+        cases.set(~has(0), -1)
+        
+        cases.set(~has(2), 0)
+        if d == 4:
+            cases.set(~has(3), lambda s: mirror_vertices(spherical_D_table(n-3, d, memo=memo)[reversed_masks(n-3, memo=memo)[mask[s] >> 4]], n))
+        else:
+            cases.set(~has(3), 0)
+    
+    # 0,1,2,3 in sigma: size of the D_k component on the left (sigma=(0,1,...,n-2,n) has k=n)
+    k = trailing_ones(mask)
+    k = np.where((k == n-1) & has(n), n, k)
+    q = k // h
+    r = k - q*h
+    adjust = (q%2 == 1) & (r == 0)
+    q -= adjust
+    r = np.where(adjust, h, r)
+    v = np.where(q%2 == 0, q*h, q*h+1)
+    
+    def lookup(g):
+        return lambda k, m: mirror_vertices(spherical_D_table(n-k, d, g, memo=memo)[reversed_masks(n-k, memo=memo)[m >> (k+1)]], n)
+    
+    if d == 4:
+        # only one k with this weight: a D_{n-k} remains
+        one_k = (q%2 == 1) & (r == 1)
+        cases.set(one_k & (k <= n-2), lambda s: grouped(k[s], mask[s], lookup(0)))
+        cases.set(one_k, -1)
+    
+    cases.set((k == n) & ~has(n-1) & (v >= n-1), -1)
+    
+    has_v = (mask >> v) & 1 == 1
+    # removing 1,2,3 would not leave a D_k component (this does not happen)
+    assert not np.any(cases.remaining() & has_v & (1 <= v) & (v <= 3))
+    cases.set(has_v, v)
+    cases.set(v > n, -1)
+    
+    # connected component c right after v
+    c_max = v + 1 + trailing_ones(mask >> (v+1))
+    goes_up = c_max >= n
+    goes_down = (c_max == n+1) | ((c_max == n-1) & has(n))
+    c_max = np.where((c_max == n-1) & has(n), c_max+1, c_max)
+    c_length = c_max - v - 1
+    even = q%2 == 0
+    limit_size = np.where(even, h, h-2)
+    
+    cases.set((c_length < limit_size) & ~(goes_up & goes_down), v)
+    cases.set(goes_down & ~goes_up & (c_length == limit_size), -1)
+    cases.set(even, lambda s: grouped(v[s], mask[s], lookup(h)))
+    cases.set(True, lambda s: grouped(v[s], mask[s], lookup(h-2)))
+    
+    return cases.table